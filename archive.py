@@ -0,0 +1,172 @@
+# archive.py
+# Getting media off the robot in bulk and keeping the archive bounded:
+#
+#   ZipStream        a ZIP of any number of files, produced while it is sent.
+#                    Entries are stored (photos and videos are compressed
+#                    already) and written in CHUNK_SIZE pieces, so memory
+#                    does not grow with the size of the files; only the
+#                    central directory (one small record per file) is kept.
+#   delete_files()   removes a batch of files.
+#   RetentionSweeper background thread deleting the oldest files once they
+#                    pass a maximum age or the archive a maximum size.
+import os
+import threading
+import time
+import zipfile
+
+# Bytes read from a file per piece of the stream
+CHUNK_SIZE = 256 * 1024
+
+# Files this recent are never swept (they may still be being recorded)
+RETENTION_GRACE = 60.0
+
+RETENTION_INTERVAL = float(os.environ.get("FERMIA_RETENTION_INTERVAL", "600"))
+
+
+class _Buffer:
+    """Write-only file for zipfile; what it receives is handed out by drain()."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class ZipStream:
+    """
+    Response body streaming a ZIP of files as it is built.
+
+    Args:
+        entries: Iterable of (name in the archive, path) pairs; consumed
+            lazily, so it may be a generator over a large selection.
+        on_close (callable): Called once when the response ends.
+    """
+    def __init__(self, entries, on_close=None):
+        self.entries = entries
+        self.on_close = on_close
+        self.count = 0
+
+    def __iter__(self):
+        buffer = _Buffer()
+        # zipfile falls back to data descriptors on an unseekable stream
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for arcname, path in self.entries:
+                try:
+                    info = zipfile.ZipInfo.from_file(path, arcname)
+                    f = open(path, "rb")
+                except OSError:
+                    # Deleted since it was selected
+                    continue
+                with f, archive.open(info, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dest:
+                    while True:
+                        chunk = f.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+                self.count += 1
+                data = buffer.drain()
+                if data:
+                    yield data
+        # The central directory, written on close
+        yield buffer.drain()
+
+    def close(self):
+        # Called by the server when the response ends, even if it was never iterated
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None
+
+
+def delete_files(paths):
+    """
+    Deletes a batch of files.
+    Args:
+        paths: Iterable of file paths.
+    Returns:
+        tuple: (list of deleted paths, dict of path to error for the rest).
+    """
+    deleted = []
+    failed = {}
+    for path in paths:
+        try:
+            os.remove(path)
+            deleted.append(path)
+        except OSError as e:
+            failed[path] = e.strerror or str(e)
+    return deleted, failed
+
+
+class RetentionSweeper:
+    """
+    Deletes the oldest media once they are older than max_age seconds, or
+    while the archive holds more than max_bytes. Either limit may be None.
+
+    Args:
+        media_index (MediaIndex): Index of the archive.
+        max_age (float): Maximum age of a file in seconds.
+        max_bytes (int): Maximum combined size of all files.
+        interval (float): Seconds between sweeps.
+    """
+    def __init__(self, media_index, max_age=None, max_bytes=None, interval=RETENTION_INTERVAL):
+        self.media_index = media_index
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Retention sweep failed: {e}")
+            if self.stopped.wait(self.interval):
+                return
+
+    def _expired(self):
+        """Yields the paths to delete, oldest first."""
+        protected_after = time.time() - RETENTION_GRACE
+        excess = 0
+        if self.max_bytes is not None:
+            excess = self.media_index.total_bytes() - self.max_bytes
+        for item in self.media_index.iterate(oldest_first=True, until=protected_after):
+            too_old = self.max_age is not None and item['mtime'] < time.time() - self.max_age
+            if not too_old and excess <= 0:
+                return
+            excess -= item['bytes']
+            yield item['path']
+
+    def sweep(self):
+        """
+        Deletes what the policy no longer allows.
+        Returns:
+            int: Number of files deleted.
+        """
+        if self.max_age is None and self.max_bytes is None:
+            return 0
+        deleted, failed = delete_files(self._expired())
+        for path, error in failed.items():
+            print(f"Retention could not delete {path}: {error}")
+        if deleted:
+            self.media_index.sync(force=True)
+            print(f"Retention deleted {len(deleted)} files")
+        return len(deleted)
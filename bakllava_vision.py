@@ -1,8 +1,12 @@
 import sys
 from langchain_ollama import OllamaLLM
-import time 
 import fermia_camera
 
+# Bakllava works on ~672 px images; anything larger is decoded and scaled down anyway
+VLM_SUBSTREAM = "vlm"
+VLM_WIDTH = 672
+VLM_QUALITY = 85
+
 def camera_vision(prompt: str) -> str:
     """
     Capture an image from the stream and process it with Bakllava LLM.
@@ -15,10 +19,16 @@ def camera_vision(prompt: str) -> str:
     """
     
     try:
-        # Capture frame from stream and get base64 string
-        for _ in range(5):
+        # Ask the publisher for a downscaled copy made once per frame, so the
+        # full-resolution frame is never shipped to the model
+        fermia_camera.define_substream(VLM_SUBSTREAM, width=VLM_WIDTH, quality=VLM_QUALITY)
+
+        # Wait for a fresh frame from the publisher, then fetch it once
+        fermia_camera.wait_for_frame(timeout=1.0)
+        base64_image = fermia_camera.get_base64_image(substream=VLM_SUBSTREAM)
+        if base64_image is None:
+            # The publisher picks up new substreams within a second
             base64_image = fermia_camera.get_base64_image()
-            time.sleep(0.05)
 
         if base64_image is None:
             return "Failed to capture image from stream."
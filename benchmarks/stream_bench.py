@@ -0,0 +1,403 @@
+# stream_bench.py
+# End-to-end benchmark of the camera streaming stack. Starts a publisher on a
+# synthetic or recorded source (fermia_camera.sources), a stream server, N
+# simulated MJPEG viewers and optional recordings, then reports as JSON:
+#   - capture-to-wire latency percentiles (publisher timestamp to the moment
+#     the client has the full frame, from the X-Timestamp part header)
+#   - achieved fps and bytes per client
+#   - CPU per process (publisher, stream server, encoders, Redis, clients)
+#   - time per pipeline stage (capture, encode, publish, fetch, serve): the
+#     first four from the stage histograms on the server's /metrics (its own
+#     and the publisher's), serve from how long clients take to receive a part
+#   - Redis network bytes per second
+#
+# Needs a local Redis server and must run from the repository root:
+#   python benchmarks/stream_bench.py --server async --clients 50 --duration 30
+#   python benchmarks/stream_bench.py --source replay:scene.fdr --stream depth --output run.json
+#
+# Environment variables of the publisher (FERMIA_TRANSPORT, FERMIA_SHM, ...)
+# are passed through, so transports can be compared run against run.
+# --redis-host/--redis-port reach the publisher and the server as
+# FERMIA_REDIS_HOST/FERMIA_REDIS_PORT.
+import argparse
+import datetime
+import http.client
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import redis
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STREAMS = ("color", "depth", "side_by_side")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+# Stage histograms (fermia_camera.metrics) making up each pipeline stage.
+# render_* are left out: they wrap colorize, resize and mjpeg_encode.
+STAGES = {
+    "capture": ("source_read",),
+    "encode": ("jpeg_encode", "substream_render", "colorize", "resize", "mjpeg_encode",
+               "variant_encode"),
+    "publish": ("redis_write", "shm_write"),
+    "fetch": ("redis_get", "parse", "shm_copy", "imdecode"),
+}
+STAGE_LINE = re.compile(r'fermia_stage_seconds_(sum|count)\{process="([^"]*)",stage="([^"]*)"\} (\S+)')
+
+
+class StreamClient(threading.Thread):
+    """One simulated viewer reading a multipart MJPEG stream as fast as it is sent."""
+    def __init__(self, host, port, path, measuring, stop):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.measuring = measuring
+        self.stop = stop
+        self.latencies = []
+        # Seconds from a part's headers to the end of its frame
+        self.transfers = []
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            conn.request("GET", self.path)
+            response = conn.getresponse()
+            while not self.stop.is_set():
+                headers = self.read_part_headers(response)
+                if headers is None:
+                    break
+                started = time.monotonic()
+                jpeg = response.read(int(headers["content-length"]))
+                received = time.time()
+                transfer = time.monotonic() - started
+                response.readline()  # CRLF after the frame
+                if not self.measuring.is_set():
+                    continue
+                self.frames += 1
+                self.bytes += len(jpeg)
+                self.transfers.append(transfer)
+                if "x-timestamp" in headers:
+                    self.latencies.append(received - float(headers["x-timestamp"]))
+            conn.close()
+        except Exception as e:
+            self.error = str(e)
+
+    @staticmethod
+    def read_part_headers(response):
+        """Skips to the next boundary and returns the part headers (lowercase keys)."""
+        line = response.readline()
+        while line and not line.startswith(b"--frame"):
+            line = response.readline()
+        if not line:
+            return None
+        headers = {}
+        while True:
+            line = response.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+            key, _, value = line.decode().partition(":")
+            headers[key.strip().lower()] = value.strip()
+        return headers
+
+
+def cpu_seconds(pid):
+    """User + system CPU seconds of a process and all its descendants."""
+    total = 0.0
+    for child in [pid] + descendants(pid):
+        try:
+            with open(f"/proc/{child}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+
+def descendants(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        return []
+    return children + [d for c in children for d in descendants(c)]
+
+
+def encoder_cpu_seconds(server_pid):
+    """CPU seconds of the processes started by the stream server (recording encoders)."""
+    return sum(cpu_seconds(pid) for pid in descendants(server_pid))
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ms = np.asarray(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+        "samples": len(values),
+    }
+
+
+def stage_totals(port):
+    """
+    Reads the stage histograms served on the stream server's /metrics.
+    Returns:
+        dict: (process, stage) -> [seconds, samples] so far.
+    """
+    try:
+        text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10).read().decode()
+    except Exception:
+        return {}
+    totals = {}
+    for line in text.splitlines():
+        match = STAGE_LINE.match(line)
+        if match:
+            kind, process, stage, value = match.groups()
+            totals.setdefault((process, stage), [0.0, 0])[kind == "count"] = float(value)
+    return totals
+
+
+def stage_breakdown(start, end, transfers, elapsed):
+    """
+    Time spent per pipeline stage during the measurement: busy_percent is the
+    stage's summed duration over the wall time (it can exceed 100 when the
+    stage runs on several threads), mean_ms the average of one run.
+    """
+    breakdown = {}
+    for name, stages in STAGES.items():
+        seconds, samples = 0.0, 0
+        for (process, stage), (total, count) in end.items():
+            if stage in stages:
+                before = start.get((process, stage), (0.0, 0))
+                seconds += total - before[0]
+                samples += int(count - before[1])
+        breakdown[name] = {
+            "busy_percent": round(100 * seconds / elapsed, 1),
+            "mean_ms": round(1000 * seconds / samples, 3) if samples else None,
+            "samples": samples,
+        }
+    breakdown["serve"] = {
+        "busy_percent": round(100 * sum(transfers) / elapsed, 1),
+        "mean_ms": round(1000 * float(np.mean(transfers)), 3) if transfers else None,
+        "samples": len(transfers),
+    }
+    return breakdown
+
+
+def wait_for_http(port, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/take_photo?stream=none", timeout=1).read()
+            return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def start_server(kind, port, clients, env):
+    """Starts the stream server under test and returns its process."""
+    if kind == "async":
+        cmd = [sys.executable, "-m", "uvicorn", "stream_async:app",
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        # Enough threads that every client (and the API calls) get one
+        cmd = [sys.executable, "-c",
+               "import logging, stream_service;"
+               "logging.getLogger('werkzeug').setLevel(logging.ERROR);"
+               f"stream_service.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+        try:
+            import gunicorn  # noqa: F401
+            cmd = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+                   "--worker-class=gthread", f"--threads={clients + 8}", "--workers=1",
+                   "--log-level", "warning", "stream_service:app"]
+        except ImportError:
+            pass
+    return subprocess.Popen(cmd, cwd=ROOT, env=env)
+
+
+def redis_info(r, section):
+    """INFO section of the Redis server, or {} if the server does not support it."""
+    try:
+        return r.info(section)
+    except redis.ResponseError:
+        return {}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    env = dict(os.environ)
+    env["FERMIA_SOURCE"] = args.source
+    env["FERMIA_REDIS_HOST"] = args.redis_host
+    env["FERMIA_REDIS_PORT"] = str(args.redis_port)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (os.path.join(ROOT, "fermia_camera"), env.get("PYTHONPATH")) if p)
+
+    r = redis.Redis(host=args.redis_host, port=args.redis_port)
+    redis_pid = redis_info(r, "server").get("process_id")
+    processes = {}
+    try:
+        if not args.no_publisher:
+            if r.get("fermia_publisher_running"):
+                sys.exit("A publisher is already running; stop it or pass --no-publisher")
+            processes["publisher"] = subprocess.Popen(
+                [sys.executable, "-m", "fermia_camera.publisher"], cwd=ROOT, env=env)
+        if args.server != "none":
+            processes["server"] = start_server(args.server, args.port, args.clients, env)
+        if not wait_for_http(args.port):
+            sys.exit(f"Stream server on port {args.port} did not come up")
+
+        query = "&".join(f"{k}={v}" for k, v in (("fps", args.client_fps), ("width", args.width),
+                                                   ("quality", args.quality)) if v is not None)
+        path = f"/{args.stream}" + (f"?{query}" if query else "")
+        stop = threading.Event()
+        measuring = threading.Event()
+        clients = [StreamClient("127.0.0.1", args.port, path, measuring, stop)
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+
+        # One recording per stream at most, starting with the benchmarked one
+        recorded = [args.stream] + [s for s in STREAMS if s != args.stream]
+        recorded = recorded[:args.recordings]
+        for stream in recorded:
+            urllib.request.urlopen(
+                f"http://127.0.0.1:{args.port}/start_recording?stream={stream}", timeout=30).read()
+
+        time.sleep(args.warmup)
+        cpu_start = {name: cpu_seconds(p.pid) for name, p in processes.items()}
+        if "server" in processes:
+            cpu_start["encoders"] = encoder_cpu_seconds(processes["server"].pid)
+        if redis_pid:
+            cpu_start["redis"] = cpu_seconds(redis_pid)
+        self_start = os.times()
+        net_start = redis_info(r, "stats")
+        stages_start = stage_totals(args.port)
+        started = time.monotonic()
+        measuring.set()
+
+        time.sleep(args.duration)
+
+        measuring.clear()
+        elapsed = time.monotonic() - started
+        stages_end = stage_totals(args.port)
+        net_end = redis_info(r, "stats")
+        self_end = os.times()
+        cpu = {name: cpu_seconds(p.pid) - cpu_start[name] for name, p in processes.items()}
+        if redis_pid:
+            cpu["redis"] = cpu_seconds(redis_pid) - cpu_start["redis"]
+        if "server" in processes:
+            # Encoder processes are children of the server; report them apart
+            cpu["encoders"] = encoder_cpu_seconds(processes["server"].pid) - cpu_start["encoders"]
+            cpu["server"] -= cpu["encoders"]
+        cpu["clients"] = (self_end.user + self_end.system) - (self_start.user + self_start.system)
+
+        for stream in recorded:
+            urllib.request.urlopen(
+                f"http://127.0.0.1:{args.port}/stop_recording?stream={stream}", timeout=60).read()
+        stop.set()
+        for client in clients:
+            client.join(timeout=5)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    per_client = [{
+        "frames": client.frames,
+        "fps": round(client.frames / elapsed, 2),
+        "bytes_per_s": round(client.bytes / elapsed),
+        "error": client.error,
+    } for client in clients]
+    fps = [c["fps"] for c in per_client]
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "config": {
+            "source": args.source,
+            "server": args.server,
+            "stream": args.stream,
+            "clients": args.clients,
+            "recordings": recorded,
+            "client_fps": args.client_fps,
+            "width": args.width,
+            "quality": args.quality,
+            "duration_s": round(elapsed, 2),
+            "transport": env.get("FERMIA_TRANSPORT", "binary"),
+            "shm": env.get("FERMIA_SHM", "0") == "1",
+        },
+        "latency": percentiles([l for c in clients for l in c.latencies]),
+        "fps": {
+            "mean": round(float(np.mean(fps)), 2) if fps else 0.0,
+            "min": min(fps) if fps else 0.0,
+            "max": max(fps) if fps else 0.0,
+        },
+        "clients": per_client,
+        "cpu_percent": {name: round(100 * seconds / elapsed, 1) for name, seconds in cpu.items()},
+        "stages": stage_breakdown(stages_start, stages_end,
+                                  [t for c in clients for t in c.transfers], elapsed),
+        "redis_bytes_per_s": {
+            "in": round((net_end["total_net_input_bytes"] - net_start["total_net_input_bytes"]) / elapsed),
+            "out": round((net_end["total_net_output_bytes"] - net_start["total_net_output_bytes"]) / elapsed),
+        } if net_end and net_start else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end camera streaming benchmark")
+    parser.add_argument("--source", default="synthetic:1280x720@15",
+                        help="FERMIA_SOURCE of the publisher (synthetic:WxH@FPS or replay:PATH)")
+    parser.add_argument("--server", choices=["flask", "async", "none"], default="flask",
+                        help="stream server to start; 'none' benchmarks one already on --port")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--stream", choices=STREAMS, default="color")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--recordings", type=int, default=0, choices=range(len(STREAMS) + 1),
+                        help="concurrent recordings (one per stream)")
+    parser.add_argument("--client-fps", type=float, default=None)
+    parser.add_argument("--width", type=int, default=None)
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--no-publisher", action="store_true",
+                        help="measure against an already running publisher")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--output", help="write the JSON report here as well")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
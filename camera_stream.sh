@@ -1,5 +1,5 @@
 #!/bin/bash
-# start_depth_stream.sh - Start the depth stream with Gunicorn
+# start_camera_stream.sh - Start the color, depth and side-by-side streams with Gunicorn
 
 # Get current directory where this script is located
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
@@ -14,5 +14,5 @@ if ! command -v gunicorn &> /dev/null; then
 fi
 
 # Start the server with Gunicorn using thread workers instead
-echo "Starting depth stream on port 5000..."
+echo "Starting camera streams on port 5000..."
 gunicorn --bind 0.0.0.0:5000 --worker-class=gthread --threads=4 --workers=1 camera_stream:app
\ No newline at end of file
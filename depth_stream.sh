@@ -1,18 +1,12 @@
 #!/bin/bash
-# start_depth_stream.sh - Start the depth stream with Gunicorn
+# start_depth_stream.sh - Start the unified stream service
+#
+# Depth is served by the same process as the color and side-by-side streams
+# (port 5000, /view/depth), so this no longer starts a second server with its
+# own capture loop; it just runs camera_stream.sh.
 
 # Get current directory where this script is located
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 
-# Change to the script directory
-cd "$SCRIPT_DIR"
-
-# Check if Gunicorn is installed
-if ! command -v gunicorn &> /dev/null; then
-    echo "Gunicorn is not installed. Installing now..."
-    pip install gunicorn
-fi
-
-# Start the server with Gunicorn using thread workers instead
-echo "Starting depth stream on port 5001..."
-gunicorn --bind 0.0.0.0:5001 --worker-class=gthread --threads=4 --workers=1 depth_stream:app
\ No newline at end of file
+echo "The depth stream is served at port 5000 under /view/depth."
+exec "$SCRIPT_DIR/camera_stream.sh"
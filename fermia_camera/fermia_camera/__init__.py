@@ -1,96 +1,728 @@
+import asyncio
+import json
 import redis
+import redis.asyncio as aioredis
 import subprocess
 import os
 import time
+import threading
+import weakref
 import base64
 import cv2
 import numpy as np
 
-# Initialize Redis client (must match the one used by the publisher)
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+from fermia_camera.frame import (
+    is_binary_frame, unpack_frame, parse_color, parse_depth, STREAM_CONFIG_KEY,
+    FRAMESET_KEY, FRAMESET_COLOR_KEY, FrameSet,
+)
+from fermia_camera.substreams import SUBSTREAMS_KEY, feed_key, substream_spec
+from fermia_camera.shm import RingReader, SHM_KEY
+from fermia_camera.notify import FrameNotifier
+from fermia_camera.colormap import colorize
+from fermia_camera.heartbeat import RUNNING_KEY, LEASE_KEY, read_status
+from fermia_camera.cameras import camera_key, load_registry
+from fermia_camera import metrics
 
-def ensure_publisher():
+# Shared Redis connection pool (must match the one used by the publisher).
+# Creating the client does not connect, so importing the package is free.
+REDIS_OPTIONS = {
+    "host": os.environ.get("FERMIA_REDIS_HOST", "localhost"),
+    "port": int(os.environ.get("FERMIA_REDIS_PORT", "6379")),
+    "db": 0,
+}
+redis_pool = redis.ConnectionPool(**REDIS_OPTIONS)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# asyncio clients, one connection pool per event loop (their connections
+# cannot be shared between loops)
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_client():
     """
-    Checks if the publisher is running (via a Redis key). If not, spawns it.
+    Retrieves the shared asyncio Redis client of the running event loop.
+    Returns:
+    A redis.asyncio.Redis, created on first use.
     """
-    publisher_running = redis_client.get("fermia_publisher_running")
-    if not publisher_running:
-        # Attempt to acquire a lock to avoid simultaneous spawns
-        lock_acquired = redis_client.set("fermia_publisher_lock", str(os.getpid()), nx=True, ex=10)
-        if lock_acquired:
-            print("No publisher running. Starting publisher automatically.")
-            # Spawn the publisher process in the background
-            subprocess.Popen(["python", "-m", "fermia_camera.publisher"])
-            # Allow a moment for the publisher to initialize
-            time.sleep(2)
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = aioredis.Redis(
+            connection_pool=aioredis.ConnectionPool(**REDIS_OPTIONS))
+    return client
+
+class _Camera:
+    """Consumer-side state of one camera (None is the default camera)."""
+    def __init__(self, camera):
+        self.camera = camera
+        # Shared-memory rings announced by a publisher on the same host (FERMIA_SHM=1)
+        self.ring_reader = RingReader(redis_client, key=camera_key(SHM_KEY, camera))
+        # Per-process subscription to the publisher's new-frame notifications
+        self.notifier = FrameNotifier(redis_client, camera)
+        self.connected = False
+        # Publisher stream configuration, cached briefly: (value, fetched at)
+        self.config_cache = (None, 0.0)
+        # Last shared-memory color frame encoded as JPEG: ((seq, timestamp), bytes)
+        self.jpeg_cache = (None, None)
+        self.jpeg_lock = threading.Lock()
+
+_cameras = {None: _Camera(None)}
+_cameras_lock = threading.Lock()
+
+# The default camera's reader and notifier
+ring_reader = _cameras[None].ring_reader
+notifier = _cameras[None].notifier
+
+_connect_lock = threading.Lock()
+
+# Substreams defined by this process: (camera, name) -> (spec arguments, ttl, renewed at)
+_substreams = {}
+_substreams_lock = threading.Lock()
 
-# Ensure the publisher is running when the package is imported.
-ensure_publisher()
+# Last colorized depth frame: ((camera, seq, timestamp, settings...), image)
+_depth_image_cache = (None, None)
 
-def get_image():
+CONFIG_CACHE_SECONDS = 1.0
+
+# Registered cameras, cached briefly: (registry, fetched at)
+_registry_cache = ({}, 0.0)
+
+def _registry():
+    global _registry_cache
+    registry, fetched = _registry_cache
+    if time.monotonic() - fetched >= CONFIG_CACHE_SECONDS:
+        try:
+            registry = load_registry(redis_client)
+        except redis.RedisError:
+            registry = {}
+        _registry_cache = (registry, time.monotonic())
+    return registry
+
+def camera_namespace(camera):
     """
-    Retrieves the latest image from Redis.
+    Key namespace of a camera. A registered serial resolves to the namespace
+    its publisher uses (None for the default camera); anything else is used
+    as the namespace itself.
+    """
+    if camera is None:
+        return None
+    camera = str(camera)
+    entry = _registry().get(camera)
+    return entry["camera"] if entry is not None else camera
+
+def _camera(camera=None):
+    """Consumer state of a camera, created on first use."""
+    namespace = camera_namespace(camera)
+    state = _cameras.get(namespace)
+    if state is None:
+        with _cameras_lock:
+            state = _cameras.setdefault(namespace, _Camera(namespace))
+    return state
+
+def get_ring_reader(camera=None):
+    """
+    Retrieves the shared-memory RingReader of a camera (ring_reader is the
+    default camera's).
+    Args:
+    camera (str): Device serial or camera name, None for the default camera.
+    """
+    return _lazy_connect(camera).ring_reader
+
+def list_cameras():
+    """
+    Retrieves the cameras with a running publisher.
     Returns:
-    The decoded OpenCV image (numpy array) or None if unavailable.
+    A dict of device serial -> the camera argument to use for it (None for
+    the default camera, which also answers to its serial).
+    """
+    try:
+        registry = load_registry(redis_client)
+    except redis.RedisError:
+        return {}
+    return {serial: entry["camera"] for serial, entry in sorted(registry.items())}
+
+def ensure_publisher(timeout=5.0, camera=None):
     """
-    b64_img = redis_client.get("camera_feed")
-    if b64_img is None:
+    Checks if the camera's publisher is running (via its heartbeat keys). If
+    not, spawns it and polls until it reports in or the deadline passes.
+    Args:
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    True if the publisher is running.
+    """
+    namespace = camera_namespace(camera)
+    running_key = camera_key(RUNNING_KEY, namespace)
+    # A publisher holding the lease is alive even before its first frame
+    if redis_client.exists(running_key, camera_key(LEASE_KEY, namespace)):
+        return True
+    # Attempt to acquire a lock to avoid simultaneous spawns; a duplicate
+    # that slips through exits on finding the lease held
+    lock_key = camera_key("fermia_publisher_lock", namespace)
+    lock_acquired = redis_client.set(lock_key, str(os.getpid()), nx=True, ex=10)
+    if lock_acquired:
+        print("No publisher running. Starting publisher automatically.")
+        # Spawn the publisher process in the background
+        command = ["python", "-m", "fermia_camera.publisher"]
+        if namespace is not None:
+            command += ["--camera", namespace]
+        subprocess.Popen(command)
+    # Wait for the publisher (ours or another process's) to come up
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if redis_client.get(running_key):
+            return True
+        time.sleep(0.05)
+    return False
+
+def connect(timeout=5.0, camera=None):
+    """
+    Makes sure a camera's publisher is running, starting one if needed.
+    Called automatically on first use; call it explicitly to pay the cost up
+    front.
+    Args:
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    True if the publisher is running.
+    """
+    state = _camera(camera)
+    with _connect_lock:
+        running = ensure_publisher(timeout, state.camera)
+        state.connected = True
+        return running
+
+def _lazy_connect(camera=None):
+    """Runs connect() once per camera, the first time a frame is requested."""
+    state = _camera(camera)
+    if not state.connected:
+        try:
+            connect(camera=state.camera)
+        except redis.RedisError as e:
+            print(f"Could not reach Redis: {e}")
+    return state
+
+def wait_for_frame(after_seq=None, timeout=1.0, camera=None):
+    """
+    Blocks until the publisher stores a frame newer than after_seq.
+    Args:
+    after_seq (int): Sequence number of the last frame the caller handled.
+    None waits for the next frame after the current one.
+    timeout (float): Seconds to wait, None waits forever.
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    The new frame sequence number, or None on timeout.
+    """
+    return _lazy_connect(camera).notifier.wait(after_seq, timeout)
+
+def stream_seq(stream, camera=None):
+    """
+    Sequence number of the last frame that changed a stream. Color and depth
+    are published at their own rates, so a new frame may leave one of them
+    untouched.
+    Args:
+    stream (str): "color" or "depth".
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    The sequence number (0 if unknown).
+    """
+    return _lazy_connect(camera).notifier.stream_seq(stream)
+
+async def wait_for_frame_async(after_seq=None, timeout=1.0, camera=None):
+    """
+    Asynchronous version of wait_for_frame().
+    Returns:
+    The new frame sequence number, or None on timeout.
+    """
+    loop = asyncio.get_running_loop()
+    if camera is None:
+        namespace = None
+    elif time.monotonic() - _registry_cache[1] < CONFIG_CACHE_SECONDS:
+        # Resolved from the cached registry, without touching Redis
+        namespace = camera_namespace(camera)
+    else:
+        namespace = await loop.run_in_executor(None, camera_namespace, camera)
+    state = _cameras.get(namespace)
+    if state is None or not state.connected:
+        state = await loop.run_in_executor(None, _lazy_connect, camera)
+    return await state.notifier.wait_async(after_seq, timeout)
+
+def get_publisher_status(camera=None):
+    """
+    Retrieves the publisher's health as reported by its heartbeat, which
+    keeps beating while the camera is down.
+    Args:
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    A dict with "state" ("streaming", "reconnecting" or "unavailable"),
+    "last_frame" (time of the newest frame) and "stale_since" (None while
+    frames flow, else the time since which the stored frames are old), or
+    None if no publisher is alive.
+    """
+    try:
+        return read_status(redis_client, camera_namespace(camera))
+    except redis.RedisError:
         return None
+
+def get_stream_config(camera=None):
+    """
+    Retrieves the running publisher's stream configuration: source,
+    transport, and per stream the resolution, fps, pixel format and encoding,
+    plus the active substreams, the depth calibration and the device serial.
+    Args:
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    A dict, or None if no publisher has recorded one.
+    """
+    state = _camera(camera)
+    config, fetched = state.config_cache
+    if time.monotonic() - fetched < CONFIG_CACHE_SECONDS:
+        return config
     try:
-        img_bytes = base64.b64decode(b64_img)
-        img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        raw = redis_client.get(camera_key(STREAM_CONFIG_KEY, state.camera))
+        config = json.loads(raw) if raw else None
+    except (redis.RedisError, ValueError):
+        config = None
+    state.config_cache = (config, time.monotonic())
+    return config
+
+def _legacy_depth_shape(camera=None):
+    """(height, width) of headerless base64 depth payloads, from the publisher's configuration."""
+    config = get_stream_config(camera)
+    if config is None:
+        return None
+    return config["depth"]["height"], config["depth"]["width"]
+
+def define_substream(name, stream="color", width=None, height=None, roi=None, quality=None, ttl=60,
+                     camera=None):
+    """
+    Asks the publisher to produce a named, downscaled and/or cropped view of
+    a stream, encoded once for every consumer using it. Read it with e.g.
+    get_jpeg(substream=name) or get_depth_data(substream=name); it appears
+    within about a second.
+    Args:
+    name (str): Substream name, shared by all consumers asking for it.
+    stream (str): "color" or "depth".
+    width (int), height (int): Output size; one of them keeps the aspect ratio.
+    roi (tuple): (x, y, w, h) crop in full-frame pixels.
+    quality (int): JPEG quality of color substreams.
+    ttl (float): Seconds the request lives unless renewed; reading the
+    substream from this process renews it. None keeps it until
+    remove_substream().
+    camera (str): Device serial or camera name, None for the default camera.
+    """
+    namespace = camera_namespace(camera)
+    options = {"stream": stream, "width": width, "height": height, "roi": roi, "quality": quality}
+    spec = substream_spec(ttl=ttl, **options)
+    redis_client.hset(camera_key(SUBSTREAMS_KEY, namespace), name, json.dumps(spec))
+    with _substreams_lock:
+        _substreams[(namespace, name)] = (options, ttl, time.monotonic())
+
+def remove_substream(name, camera=None):
+    """Stops a substream defined with define_substream()."""
+    namespace = camera_namespace(camera)
+    with _substreams_lock:
+        _substreams.pop((namespace, name), None)
+    redis_client.hdel(camera_key(SUBSTREAMS_KEY, namespace), name)
+
+def _renew_substream(name, camera=None):
+    """Renews this process's request for a substream once half its ttl has passed."""
+    with _substreams_lock:
+        entry = _substreams.get((camera, name))
+    if entry is None:
+        return
+    options, ttl, renewed = entry
+    if ttl is not None and time.monotonic() - renewed > ttl / 2:
+        define_substream(name, ttl=ttl, camera=camera, **options)
+
+def _read_substream(stream, name, camera=None):
+    """Reads the stored value of a substream, or None if it is not produced (yet)."""
+    state = _lazy_connect(camera)
+    _renew_substream(name, state.camera)
+    with metrics.timed("redis_get"):
+        return redis_client.get(feed_key(stream, name, state.camera))
+
+def _decode_jpeg(buf):
+    """Decodes a JPEG buffer into an OpenCV image."""
+    img_array = np.frombuffer(buf, dtype=np.uint8)
+    with metrics.timed("imdecode"):
+        return cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+
+def _read_shm(stream, copy, camera=None):
+    """
+    Reads the newest frame of a stream from shared memory.
+    Returns:
+    (FrameHeader, numpy array) with a read-only view when copy is False, or
+    (None, None) if the publisher is not sharing frames on this host.
+    """
+    ring = _lazy_connect(camera).ring_reader.get(stream)
+    if ring is None:
+        return None, None
+    for _ in range(2):
+        ring_frame = ring.read_latest()
+        if ring_frame is None:
+            return None, None
+        if not copy:
+            return ring_frame.header, ring_frame.array
+        with metrics.timed("shm_copy"):
+            data = ring_frame.copy()
+        if data is not None:
+            return ring_frame.header, data
+    return None, None
+
+def _shm_jpeg(state, header, img):
+    """
+    Encodes a shared-memory color frame as JPEG, once per frame for the whole
+    process and at the publisher's JPEG quality.
+    Returns:
+    The JPEG bytes, or None if encoding failed.
+    """
+    key = (header.seq, header.timestamp)
+    with state.jpeg_lock:
+        cached_key, jpeg = state.jpeg_cache
+        if cached_key != key:
+            config = get_stream_config(state.camera)
+            quality = config["color"].get("jpeg_quality") if config else None
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+            with metrics.timed("jpeg_encode"):
+                ret, encoded = cv2.imencode('.jpg', img, params)
+            jpeg = encoded.tobytes() if ret else None
+            state.jpeg_cache = (key, jpeg)
+    return jpeg
+
+def get_jpeg_frame(substream=None, camera=None):
+    """
+    Retrieves the latest color frame as encoded JPEG bytes along with its
+    header (resolution, sequence number, timestamp).
+    Args:
+    substream (str): Name of a color substream (see define_substream()).
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    (FrameHeader, bytes), (None, bytes) for legacy base64 payloads, or
+    (None, None) if unavailable.
+    """
+    if substream is not None:
+        raw = _read_substream("color", substream, camera)
+        try:
+            return parse_color(raw) if raw is not None else (None, None)
+        except Exception:
+            return None, None
+    header, img = _read_shm("color", False, camera)
+    if img is not None:
+        # The publisher does not encode full frames in shm mode; share one encode per frame
+        jpeg = _shm_jpeg(_lazy_connect(camera), header, img)
+        return (header, jpeg) if jpeg is not None else (None, None)
+    with metrics.timed("redis_get"):
+        raw = redis_client.get(feed_key("color", camera=camera_namespace(camera)))
+    if raw is None:
+        return None, None
+    try:
+        with metrics.timed("parse"):
+            return parse_color(raw)
+    except Exception:
+        return None, None
+
+def get_jpeg(substream=None, camera=None):
+    """
+    Retrieves the latest color frame as encoded JPEG bytes.
+    Args:
+    substream (str): Name of a color substream (see define_substream()).
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    The JPEG bytes or None if unavailable.
+    """
+    _, jpeg = get_jpeg_frame(substream, camera)
+    return jpeg
+
+def get_image(copy=True, substream=None, camera=None):
+    """
+    Retrieves the latest image from shared memory or Redis.
+    Args:
+    copy (bool): When False and the frame comes from shared memory, return a
+    read-only zero-copy view instead of a private copy.
+    substream (str): Name of a color substream (see define_substream()).
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    The decoded OpenCV image (numpy array) or None if unavailable.
+    """
+    if substream is not None:
+        jpeg = get_jpeg(substream, camera)
+        return _decode_jpeg(jpeg) if jpeg is not None else None
+    _, img = _read_shm("color", copy, camera)
+    if img is not None:
         return img
+    with metrics.timed("redis_get"):
+        raw = redis_client.get(feed_key("color", camera=camera_namespace(camera)))
+    if raw is None:
+        return None
+    try:
+        with metrics.timed("parse"):
+            _, jpeg = parse_color(raw)
+        return _decode_jpeg(jpeg)
     except Exception:
         return None
 
-def get_base64_image():
+def get_base64_image(substream=None, camera=None):
     """
     Retrieves the latest image from Redis.
+    The base64 string is only built here, on demand, when the publisher uses
+    the binary transport.
+    Args:
+    substream (str): Name of a color substream (see define_substream()).
+    camera (str): Device serial or camera name, None for the default camera.
     Returns:
     The a base64 image or None if unavailable.
     """
-    b64_img = redis_client.get("camera_feed")
-    if b64_img is None:
+    state = _lazy_connect(camera)
+    if substream is not None:
+        jpeg = get_jpeg(substream, camera)
+        return base64.b64encode(jpeg).decode('utf-8') if jpeg is not None else None
+    if state.ring_reader.get("color") is not None:
+        jpeg = get_jpeg(camera=camera)
+        return base64.b64encode(jpeg).decode('utf-8') if jpeg is not None else None
+    raw = redis_client.get(feed_key("color", camera=state.camera))
+    if raw is None:
         return None
     try:
-        return b64_img.decode('utf-8')
+        if is_binary_frame(raw):
+            _, payload = unpack_frame(raw)
+            return base64.b64encode(payload).decode('utf-8')
+        return raw.decode('utf-8')
     except Exception:
         return None
 
-def get_depth_data():
+def _read_depth(copy=True, substream=None, camera=None):
+    """Reads the latest depth frame as (FrameHeader, uint16 array)."""
+    if substream is not None:
+        raw = _read_substream("depth", substream, camera)
+        if raw is None:
+            return None, None
+        with metrics.timed("parse"):
+            return parse_depth(raw)
+    header, depth_array = _read_shm("depth", copy, camera)
+    if depth_array is not None:
+        return header, depth_array
+    with metrics.timed("redis_get"):
+        raw = redis_client.get(feed_key("depth", camera=camera_namespace(camera)))
+    if raw is None:
+        return None, None
+    shape = None if is_binary_frame(raw) else _legacy_depth_shape(camera)
+    with metrics.timed("parse"):
+        return parse_depth(raw, shape)
+
+def get_depth_frame(copy=True, substream=None, camera=None):
     """
-    Retrieves the latest depth array from Redis
+    Retrieves the latest depth array along with its header (resolution,
+    sequence number, timestamp).
+    Args:
+    copy (bool): See get_depth_data().
+    substream (str): Name of a depth substream (see define_substream()).
+    camera (str): Device serial or camera name, None for the default camera.
     Returns:
-    The depth array as a numpy array or None if unavailable.
+    (FrameHeader, numpy array), (None, array) for legacy base64 payloads, or
+    (None, None) if unavailable.
     """
-    b64_depth = redis_client.get("depth_feed")
-    if b64_depth is None:
-        return None
     try:
-        depth_bytes = base64.b64decode(b64_depth)
-        # Convert the raw bytes back into numpy array
-        depth_array = np.frombuffer(depth_bytes, dtype=np.uint16)
-        depth_array = depth_array.reshape((720, 1280))
-        return depth_array
+        return _read_depth(copy, substream, camera)
     except Exception:
+        return None, None
+
+def get_depth_data(copy=True, substream=None, camera=None):
+    """
+    Retrieves the latest depth array from shared memory or Redis
+    Args:
+    copy (bool): When False and the frame comes from shared memory, return a
+    read-only zero-copy view instead of a private copy.
+    substream (str): Name of a depth substream (see define_substream()).
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    The depth array as a numpy array or None if unavailable.
+    """
+    _, depth_array = get_depth_frame(copy, substream, camera)
+    return depth_array
+
+def _frameset_keys(camera):
+    return [camera_key(FRAMESET_COLOR_KEY, camera), feed_key("depth", camera=camera),
+            camera_key(FRAMESET_KEY, camera)]
+
+def _frameset_meta(raw_meta, camera):
+    """The tick record plus the depth calibration, or None."""
+    if raw_meta is None:
+        return None
+    meta = json.loads(raw_meta)
+    config = get_stream_config(camera)
+    if config is not None:
+        meta["depth_scale"] = config["depth"].get("depth_scale")
+        meta["intrinsics"] = config["depth"].get("intrinsics")
+    return meta
+
+def _parse_frameset(raw_color, raw_depth, raw_meta, camera):
+    """Builds a FrameSet from the stored values, or returns None if they are not from the same tick."""
+    if raw_color is None or raw_depth is None or raw_meta is None:
+        return None
+    if not (is_binary_frame(raw_color) and is_binary_frame(raw_depth)):
+        # Legacy base64 payloads carry no capture times to align
         return None
+    meta = _frameset_meta(raw_meta, camera)
+    with metrics.timed("parse"):
+        color_header, jpeg = parse_color(raw_color)
+        depth_header, depth_array = parse_depth(raw_depth)
+    if (color_header.timestamp != meta["color_timestamp"]
+            or depth_header.timestamp != meta["timestamp"]):
+        return None
+    return FrameSet(_decode_jpeg(jpeg), depth_array, color_header, depth_header, meta)
+
+def _read_frameset_shm(state, copy):
+    """Reads an aligned pair from the shared-memory rings, which keep a few past frames each."""
+    with metrics.timed("redis_get"):
+        raw_meta = redis_client.get(camera_key(FRAMESET_KEY, state.camera))
+    meta = _frameset_meta(raw_meta, state.camera)
+    if meta is None:
+        return None
+    frames = []
+    for stream, timestamp in (("color", meta["color_timestamp"]), ("depth", meta["timestamp"])):
+        ring = state.ring_reader.get(stream)
+        ring_frame = ring.read_latest(timestamp) if ring is not None else None
+        if ring_frame is None:
+            return None
+        frames.append(ring_frame)
+    arrays = [ring_frame.array for ring_frame in frames]
+    if copy:
+        with metrics.timed("shm_copy"):
+            arrays = [ring_frame.copy() for ring_frame in frames]
+        if any(array is None for array in arrays):
+            return None
+    return FrameSet(arrays[0], arrays[1], frames[0].header, frames[1].header, meta)
+
+def _read_frameset(state, copy):
+    if state.ring_reader.get("color") is not None and state.ring_reader.get("depth") is not None:
+        return _read_frameset_shm(state, copy)
+    with metrics.timed("redis_get"):
+        raw = redis_client.mget(_frameset_keys(state.camera))
+    return _parse_frameset(*raw, state.camera)
+
+def get_frameset(timeout=1.0, copy=True, camera=None):
+    """
+    Retrieves the newest depth array and the color image captured with it,
+    with their headers and metadata, in a single Redis round-trip (one MGET of
+    the paired color frame, depth and the publisher's tick record). Right
+    after a depth frame is stored its color frame may still be encoding; this
+    then waits for it. Needs the binary transport (the default).
+    Args:
+    timeout (float): Seconds to wait for an aligned pair.
+    copy (bool): See get_image().
+    camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+    A FrameSet (color, depth, color_header, depth_header, meta), where meta
+    holds the tick's sequence number and capture times plus the depth scale
+    and intrinsics, or None if no aligned pair arrived in time.
+    """
+    state = _lazy_connect(camera)
+    deadline = time.monotonic() + timeout
+    seq = None
+    while True:
+        try:
+            frameset = _read_frameset(state, copy)
+        except (redis.RedisError, ValueError):
+            frameset = None
+        if frameset is not None:
+            return frameset
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        metrics.count("frameset_retries")
+        seq = state.notifier.wait(seq, remaining)
+
+async def get_frameset_async(timeout=1.0, camera=None):
+    """
+    Asynchronous version of get_frameset(), fetching through the shared
+    asyncio client.
+    Returns:
+    A FrameSet or None if no aligned pair arrived in time.
+    """
+    loop = asyncio.get_running_loop()
+    state = await loop.run_in_executor(None, _lazy_connect, camera)
+    if await loop.run_in_executor(None, state.ring_reader.get, "color") is not None:
+        # Same-host shared memory: nothing to fetch over the network
+        return await loop.run_in_executor(None, get_frameset, timeout, True, state.camera)
+    client = get_async_client()
+    keys = _frameset_keys(state.camera)
+    deadline = loop.time() + timeout
+    seq = None
+    while True:
+        try:
+            with metrics.timed("redis_get"):
+                raw = await client.mget(keys)
+            frameset = await loop.run_in_executor(None, _parse_frameset, *raw, state.camera)
+        except (redis.RedisError, ValueError):
+            frameset = None
+        if frameset is not None:
+            return frameset
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+        metrics.count("frameset_retries")
+        seq = await state.notifier.wait_async(seq, remaining)
+
+def _depth_scale(camera=None):
+    config = get_stream_config(camera)
+    return config["depth"].get("depth_scale", 0.001) if config else 0.001
 
-def get_depth_image():
+def colorize_depth(depth_array, min_distance=None, max_distance=None, colormap=None, camera=None):
+    """
+    Applies the visualization colormap to a uint16 depth array through a
+    cached lookup table (see colormap.py). Pixels without a reading are black.
+    Args:
+    min_distance (float), max_distance (float): Range in metres spread over
+    the colormap (default FERMIA_DEPTH_MIN / FERMIA_DEPTH_MAX).
+    colormap (str): OpenCV colormap name (default FERMIA_DEPTH_COLORMAP).
+    camera (str): Camera the frame comes from, for its depth scale.
+    Returns:
+    The BGR depth image.
+    """
+    with metrics.timed("colorize"):
+        return colorize(depth_array, min_distance, max_distance, colormap, _depth_scale(camera))
+
+def colorize_depth_frame(header, depth_array, min_distance=None, max_distance=None, colormap=None,
+                         camera=None):
+    """
+    colorize_depth() for a frame read with get_depth_frame(). The result is
+    cached per depth sequence number and settings, so every caller in the
+    process showing the same frame shares one render. Treat it as read-only.
+    """
+    global _depth_image_cache
+    if header is None:
+        return colorize_depth(depth_array, min_distance, max_distance, colormap, camera)
+    key = (camera_namespace(camera), header.seq, header.timestamp, min_distance, max_distance, colormap)
+    cached_key, image = _depth_image_cache
+    if cached_key == key:
+        metrics.count("colorize_cached")
+        return image
+    image = colorize_depth(depth_array, min_distance, max_distance, colormap, camera)
+    _depth_image_cache = (key, image)
+    return image
+
+def get_depth_image(min_distance=None, max_distance=None, colormap=None, copy=True, camera=None):
     """
     Retrives the latest depth image from Redis
+    Args:
+    min_distance (float), max_distance (float), colormap (str): See
+    colorize_depth().
+    copy (bool): When False, return the render shared with other callers
+    instead of a private copy.
+    camera (str): Device serial or camera name, None for the default camera.
     Returns:
     The depth image or None if unavailable.
     """
-    b64_depth = redis_client.get("depth_feed")
-    if b64_depth is None:
-        return None
     try:
-        depth_bytes = base64.b64decode(b64_depth)
-        # Convert the raw bytes back into numpy array
-        depth_array = np.frombuffer(depth_bytes, dtype=np.uint16)
-        depth_array = depth_array.reshape((720, 1280))
-        depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(depth_array, alpha=0.06), cv2.COLORMAP_JET)
-        return depth_colormap
+        cached_key, image = _depth_image_cache
+        if (image is not None and cached_key[0] == camera_namespace(camera)
+                and cached_key[3:] == (min_distance, max_distance, colormap)
+                and cached_key[1] == stream_seq("depth", camera)):
+            # Still the newest depth frame: skip the fetch as well
+            metrics.count("colorize_cached")
+        else:
+            header, depth_array = _read_depth(False, None, camera)
+            if depth_array is None:
+                return None
+            image = colorize_depth_frame(header, depth_array, min_distance, max_distance, colormap, camera)
+        return image.copy() if copy else image
     except Exception:
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,53 @@
+import json
+import time
+
+# Several cameras on one host: every device gets its own publisher process
+# (python -m fermia_camera.publisher --camera SERIAL, or --all for every
+# connected device), so capture, encoding and Redis writes of different
+# cameras run on different cores.
+#
+# The default camera keeps the plain keys (camera_feed, depth_feed,
+# fermia_frames, ...), so single-camera setups and existing consumers are
+# unaffected. Every other camera's keys live under camera:<serial>: (see
+# camera_key()).
+#
+# Publishers register the device they capture from in the CAMERAS_KEY hash
+# (serial -> {"camera": namespace or None for the default, "seen": time}),
+# which is how consumers map a serial to its keys and list the cameras.
+CAMERAS_KEY = "fermia_cameras"
+
+# Registrations not refreshed for this long belong to stopped publishers
+REGISTRY_TTL = 10.0
+
+
+def camera_key(key, camera=None):
+    """Redis key (or channel) of a camera; the default camera (None) keeps the plain key."""
+    return key if camera is None else f"camera:{camera}:{key}"
+
+
+def register(pipe, serial, camera):
+    """Queue the registration of a publisher's device on a Redis pipeline."""
+    pipe.hset(CAMERAS_KEY, serial, json.dumps({"camera": camera, "seen": time.time()}))
+
+
+def unregister(redis_client, serial):
+    redis_client.hdel(CAMERAS_KEY, serial)
+
+
+def load_registry(redis_client):
+    """
+    Reads the registered cameras.
+    Returns:
+        dict: {serial: {"camera": namespace or None, "seen": time}} of the
+        cameras whose publisher is alive.
+    """
+    now = time.time()
+    cameras = {}
+    for serial, raw in redis_client.hgetall(CAMERAS_KEY).items():
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            continue
+        if now - entry.get("seen", 0) <= REGISTRY_TTL:
+            cameras[serial.decode()] = entry
+    return cameras
@@ -0,0 +1,74 @@
+import functools
+import os
+
+import cv2
+import numpy as np
+
+# Depth visualization through a precomputed lookup table: every possible z16
+# value (0..65535) maps straight to its BGR color, so colorizing a frame is a
+# single gather instead of a scale, a colormap pass and a mask for missing
+# readings. Each table entry is packed into a uint32 (B, G, R, 0) so the
+# gather moves one machine word per pixel.
+#
+# The visualized range and colormap come from the environment and can be
+# overridden per call:
+#   FERMIA_DEPTH_MIN / FERMIA_DEPTH_MAX   range in metres (default 0 - 4.25 m)
+#   FERMIA_DEPTH_COLORMAP                 OpenCV colormap name (default "jet")
+DEPTH_MIN = float(os.environ.get("FERMIA_DEPTH_MIN", "0"))
+DEPTH_MAX = float(os.environ.get("FERMIA_DEPTH_MAX", "4.25"))
+DEPTH_COLORMAP = os.environ.get("FERMIA_DEPTH_COLORMAP", "jet")
+
+# Color of pixels without a depth reading (value 0)
+INVALID_COLOR = (0, 0, 0)
+
+
+def colormap_id(name):
+    """
+    OpenCV colormap constant for a name such as "jet" or "turbo".
+    Raises:
+        ValueError: If OpenCV has no such colormap.
+    """
+    value = getattr(cv2, f"COLORMAP_{name.upper()}", None)
+    if value is None:
+        raise ValueError(f"Unknown colormap: {name}")
+    return value
+
+
+@functools.lru_cache(maxsize=8)
+def depth_lut(min_value, max_value, colormap):
+    """
+    Builds the z16 -> packed BGR lookup table for a range of raw depth
+    values; values outside it are clamped to the ends of the colormap.
+    Returns:
+        numpy.ndarray: 65536 uint32 entries.
+    """
+    values = np.arange(65536, dtype=np.float32)
+    span = max(max_value - min_value, 1)
+    levels = np.clip(np.rint((values - min_value) * (255.0 / span)), 0, 255).astype(np.uint8)
+    colors = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), colormap_id(colormap))
+    lut = np.zeros((65536, 4), dtype=np.uint8)
+    lut[:, :3] = colors.reshape(256, 3)[levels]
+    lut[0, :3] = INVALID_COLOR
+    return lut.view(np.uint32).ravel()
+
+
+def colorize(depth_array, min_distance=None, max_distance=None, colormap=None, depth_scale=0.001):
+    """
+    Colorizes a uint16 depth array.
+    Args:
+        depth_array (numpy.ndarray): z16 depth frame.
+        min_distance (float), max_distance (float): Range in metres spread
+        over the colormap (default FERMIA_DEPTH_MIN / FERMIA_DEPTH_MAX).
+        colormap (str): OpenCV colormap name (default FERMIA_DEPTH_COLORMAP).
+        depth_scale (float): Metres per depth unit.
+    Returns:
+        numpy.ndarray: The BGR image.
+    """
+    lut = depth_lut(
+        int(round((DEPTH_MIN if min_distance is None else min_distance) / depth_scale)),
+        int(round((DEPTH_MAX if max_distance is None else max_distance) / depth_scale)),
+        colormap or DEPTH_COLORMAP,
+    )
+    height, width = depth_array.shape[:2]
+    packed = lut.take(depth_array).view(np.uint8).reshape(height, width, 4)
+    return cv2.cvtColor(packed, cv2.COLOR_BGRA2BGR)
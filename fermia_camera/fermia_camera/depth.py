@@ -0,0 +1,359 @@
+import numpy as np
+
+import fermia_camera
+from fermia_camera.sources import DEFAULT_DEPTH_SCALE, estimated_intrinsics
+
+# Spatial queries on the raw z16 depth stream, answered with whole-array NumPy
+# operations (no Python loops over pixels): a query on a 1280x720 frame takes
+# a few milliseconds.
+#
+# Depth values of 0 mean "no reading" (shadows, out of range, reflective
+# surfaces) and are ignored everywhere. Distances are returned in metres,
+# using the depth scale the publisher records in its stream configuration.
+#
+# Every function takes the depth array explicitly, so they work the same on
+# live frames (get_depth_data()), substreams and recordings (depthlog).
+#
+#   from fermia_camera import depth
+#   frame = fermia_camera.get_depth_data()
+#   depth.roi_stats(frame, depth.region_roi("center", frame.shape))
+#   points = depth.deproject(frame, depth.get_intrinsics(frame.shape))
+
+# Named regions as (x, y, w, h) fractions of the frame, for callers (like the
+# agent's tools) that think in "in front" rather than pixels
+REGIONS = {
+    "full": (0.0, 0.0, 1.0, 1.0),
+    "center": (1 / 3, 1 / 3, 1 / 3, 1 / 3),
+    "left": (0.0, 0.0, 1 / 3, 1.0),
+    "right": (2 / 3, 0.0, 1 / 3, 1.0),
+    "top": (0.0, 0.0, 1.0, 1 / 3),
+    "bottom": (0.0, 2 / 3, 1.0, 1 / 3),
+}
+
+# Largest voxel grid (in cells) voxel_downsample() counts into directly;
+# sparser clouds spanning more space are grouped by sorting instead
+VOXEL_GRID_LIMIT = 1 << 24
+
+# Pixel grids of deproject(), per (shape, intrinsics, stride)
+_ray_cache = {}
+
+
+def region_roi(name, shape):
+    """
+    Converts a named region (see REGIONS) to a pixel ROI.
+    Args:
+        name (str): Region name.
+        shape (tuple): Shape of the depth frame (height, width).
+    Returns:
+        tuple: (x, y, w, h) in pixels.
+    Raises:
+        ValueError: If the region is unknown.
+    """
+    if name not in REGIONS:
+        raise ValueError(f"Unknown region: {name}")
+    height, width = shape[:2]
+    fx, fy, fw, fh = REGIONS[name]
+    x, y = int(fx * width), int(fy * height)
+    return x, y, max(int(fw * width), 1), max(int(fh * height), 1)
+
+
+def crop(depth, roi=None):
+    """Returns the part of the frame inside roi (x, y, w, h), as a view."""
+    if roi is None:
+        return depth
+    x, y, w, h = roi
+    return depth[max(y, 0):y + h, max(x, 0):x + w]
+
+
+def get_depth_scale(camera=None):
+    """Metres per depth unit of the camera's publisher (0.001 if unknown)."""
+    config = fermia_camera.get_stream_config(camera)
+    if config is None:
+        return DEFAULT_DEPTH_SCALE
+    return config["depth"].get("depth_scale", DEFAULT_DEPTH_SCALE)
+
+
+def scale_intrinsics(intrinsics, width, height, roi=None):
+    """
+    Adapts intrinsics to a cropped and/or resized frame, e.g. a decimated
+    depth stream or a substream.
+    Args:
+        intrinsics (dict): Intrinsics of the full frame.
+        width (int), height (int): Size of the frame they should describe.
+        roi (tuple): (x, y, w, h) crop, in full-frame pixels, applied before
+        resizing.
+    Returns:
+        dict: The adapted intrinsics.
+    """
+    x, y, full_w, full_h = roi if roi is not None else (0, 0, intrinsics["width"], intrinsics["height"])
+    sx, sy = width / full_w, height / full_h
+    scaled = dict(intrinsics)
+    scaled.update(
+        width=width, height=height,
+        fx=intrinsics["fx"] * sx, fy=intrinsics["fy"] * sy,
+        # Pixel centres, not corners, scale with the image
+        ppx=(intrinsics["ppx"] - x + 0.5) * sx - 0.5,
+        ppy=(intrinsics["ppy"] - y + 0.5) * sy - 0.5,
+    )
+    return scaled
+
+
+def get_intrinsics(shape=None, camera=None):
+    """
+    Retrieves the depth stream intrinsics recorded by the publisher.
+    Args:
+        shape (tuple): Shape of the depth frame they are for; intrinsics are
+        rescaled if it differs from the calibrated resolution (e.g. after
+        decimation). None returns them as published.
+        camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+        dict: fx, fy, ppx, ppy, width, height, model and coeffs. Estimated
+        from a nominal field of view if the publisher did not record any.
+    """
+    config = fermia_camera.get_stream_config(camera)
+    intrinsics = config["depth"].get("intrinsics") if config else None
+    if intrinsics is None:
+        if shape is None:
+            return None
+        return estimated_intrinsics(shape[1], shape[0])
+    if shape is not None and (shape[0], shape[1]) != (intrinsics["height"], intrinsics["width"]):
+        return scale_intrinsics(intrinsics, shape[1], shape[0])
+    return intrinsics
+
+
+def _valid(values, min_distance, max_distance, depth_scale):
+    """Boolean mask of readings inside [min_distance, max_distance] metres."""
+    mask = values > 0
+    if min_distance is not None:
+        mask &= values >= min_distance / depth_scale
+    if max_distance is not None:
+        mask &= values <= max_distance / depth_scale
+    return mask
+
+
+def roi_stats(depth, roi=None, depth_scale=None, min_distance=None, max_distance=None):
+    """
+    Distance statistics of a region.
+    Args:
+        depth (numpy.ndarray): z16 depth frame.
+        roi (tuple): (x, y, w, h) in pixels, None for the whole frame.
+        depth_scale (float): Metres per depth unit, None asks the publisher.
+        min_distance (float), max_distance (float): Readings outside this
+        range (metres) are ignored.
+    Returns:
+        dict: min, max, mean, median, p10, p90 and std in metres (None if the
+        region has no valid reading) and valid_fraction, the share of pixels
+        with a reading.
+    """
+    scale = depth_scale or get_depth_scale()
+    region = crop(depth, roi)
+    values = region[_valid(region, min_distance, max_distance, scale)]
+    stats = {"valid_fraction": values.size / region.size if region.size else 0.0}
+    if not values.size:
+        stats.update(dict.fromkeys(("min", "max", "mean", "median", "p10", "p90", "std")))
+        return stats
+    # Readings are integers below 65536: one bincount gives exact percentiles
+    # and moments in O(n), without sorting
+    counts = np.bincount(values)
+    levels = np.flatnonzero(counts)
+    counts = counts[levels]
+    cumulative = np.cumsum(counts)
+    p10, median, p90 = levels[np.searchsorted(cumulative, np.array([0.1, 0.5, 0.9]) * values.size)]
+    mean = float(np.dot(levels, counts)) / values.size
+    variance = float(np.dot((levels - mean) ** 2, counts)) / values.size
+    stats.update(
+        min=float(levels[0]) * scale,
+        max=float(levels[-1]) * scale,
+        mean=mean * scale,
+        median=float(median) * scale,
+        p10=float(p10) * scale,
+        p90=float(p90) * scale,
+        std=variance ** 0.5 * scale,
+    )
+    return stats
+
+
+def nearest_obstacle(depth, roi=None, depth_scale=None, min_distance=0.1, max_distance=None,
+                     min_pixels=50):
+    """
+    Finds the closest surface in a region. Isolated speckles are ignored: the
+    obstacle distance is that of the min_pixels-th closest reading.
+    Args:
+        depth (numpy.ndarray): z16 depth frame.
+        roi (tuple): (x, y, w, h) in pixels, None for the whole frame.
+        depth_scale (float): Metres per depth unit, None asks the publisher.
+        min_distance (float): Readings closer than this (metres) are noise or
+        the robot itself.
+        max_distance (float): Readings farther than this are ignored.
+        min_pixels (int): How many pixels an obstacle has to cover.
+    Returns:
+        dict: distance (metres), x and y (full-frame pixel of the obstacle
+        point) and pixels (readings within 5 cm of it), or None if nothing is
+        in range.
+    """
+    scale = depth_scale or get_depth_scale()
+    region = crop(depth, roi)
+    flat = region.ravel()
+    index = np.flatnonzero(_valid(flat, min_distance, max_distance, scale))
+    if not index.size:
+        return None
+    values = flat[index]
+    k = min(min_pixels, values.size) - 1
+    # O(n) selection instead of a full sort
+    nearest = np.argpartition(values, k)[k]
+    distance = float(values[nearest])
+    y, x = divmod(int(index[nearest]), region.shape[1])
+    if roi is not None:
+        x += max(roi[0], 0)
+        y += max(roi[1], 0)
+    return {
+        "distance": distance * scale,
+        "x": x,
+        "y": y,
+        "pixels": int(np.count_nonzero(values <= distance + 0.05 / scale)),
+    }
+
+
+def histogram(depth, roi=None, bins=20, max_distance=None, depth_scale=None):
+    """
+    Histogram of the distances in a region.
+    Args:
+        depth (numpy.ndarray): z16 depth frame.
+        roi (tuple): (x, y, w, h) in pixels, None for the whole frame.
+        bins (int): Number of equal-width bins from 0 to max_distance.
+        max_distance (float): Upper edge in metres, None uses the farthest
+        reading. Farther readings are left out.
+        depth_scale (float): Metres per depth unit, None asks the publisher.
+    Returns:
+        tuple: (counts, edges) with edges in metres (bins + 1 of them).
+    """
+    scale = depth_scale or get_depth_scale()
+    region = crop(depth, roi)
+    values = region[_valid(region, None, max_distance, scale)]
+    if max_distance is None:
+        max_distance = float(values.max()) * scale if values.size else 1.0
+    edges = np.linspace(0.0, max_distance, bins + 1)
+    # Integer bin index per reading, counted with bincount (no per-bin passes)
+    index = np.minimum((values * (scale * bins / max_distance)).astype(np.intp), bins - 1)
+    return np.bincount(index, minlength=bins), edges
+
+
+def _rays(shape, intrinsics, stride):
+    """Normalized image-plane coordinates of every sampled pixel, cached."""
+    key = (shape, stride, intrinsics["fx"], intrinsics["fy"], intrinsics["ppx"], intrinsics["ppy"])
+    rays = _ray_cache.get(key)
+    if rays is None:
+        height, width = shape
+        u = np.arange(0, width, stride, dtype=np.float32)
+        v = np.arange(0, height, stride, dtype=np.float32)
+        rays = ((u - intrinsics["ppx"]) / intrinsics["fx"],
+                ((v - intrinsics["ppy"]) / intrinsics["fy"])[:, None])
+        if len(_ray_cache) > 16:
+            _ray_cache.clear()
+        _ray_cache[key] = rays
+    return rays
+
+
+def deproject(depth, intrinsics=None, roi=None, stride=1, depth_scale=None,
+              min_distance=None, max_distance=None):
+    """
+    Converts a depth frame into a point cloud in the camera frame: x to the
+    right, y down, z forward, in metres. Lens distortion is ignored (the
+    RealSense depth stream is rectified).
+    Args:
+        depth (numpy.ndarray): z16 depth frame.
+        intrinsics (dict): Intrinsics of this frame, None asks the publisher.
+        roi (tuple): (x, y, w, h) in pixels, None for the whole frame.
+        stride (int): Use every stride-th pixel in each direction.
+        depth_scale (float): Metres per depth unit, None asks the publisher.
+        min_distance (float), max_distance (float): Range of kept readings.
+    Returns:
+        numpy.ndarray: (N, 3) float32 points, one per valid reading.
+    """
+    scale = depth_scale or get_depth_scale()
+    if intrinsics is None:
+        intrinsics = get_intrinsics(depth.shape)
+    if roi is not None:
+        x, y, w, h = roi
+        x, y = max(x, 0), max(y, 0)
+        # Shift the principal point instead of rebuilding the grid for every crop
+        intrinsics = dict(intrinsics, ppx=intrinsics["ppx"] - x, ppy=intrinsics["ppy"] - y)
+        depth = depth[y:y + h, x:x + w]
+    sampled = depth[::stride, ::stride]
+    ray_x, ray_y = _rays(depth.shape[:2], intrinsics, stride)
+    mask = _valid(sampled, min_distance, max_distance, scale)
+    z = sampled[mask].astype(np.float32) * np.float32(scale)
+    rows, cols = np.nonzero(mask)
+    points = np.empty((z.size, 3), dtype=np.float32)
+    points[:, 0] = ray_x[cols] * z
+    points[:, 1] = ray_y[rows, 0] * z
+    points[:, 2] = z
+    return points
+
+
+def voxel_downsample(points, voxel_size=0.05):
+    """
+    Reduces a point cloud to one point (the centroid) per occupied voxel.
+    Args:
+        points (numpy.ndarray): (N, 3) points in metres.
+        voxel_size (float): Edge length of the voxels in metres.
+    Returns:
+        numpy.ndarray: (M, 3) float32 centroids, M <= N.
+    """
+    if not len(points):
+        return np.empty((0, 3), dtype=np.float32)
+    # Work on contiguous per-axis rows; column slices of (N, 3) are strided
+    axes = np.ascontiguousarray(points.T)
+    voxels = np.floor(axes / voxel_size).astype(np.int64)
+    voxels -= voxels.min(axis=1, keepdims=True)
+    # One integer key per voxel, so grouping is 1-D
+    dims = voxels.max(axis=1) + 1
+    keys = (voxels[0] * dims[1] + voxels[1]) * dims[2] + voxels[2]
+    if dims.prod() <= VOXEL_GRID_LIMIT:
+        # Bounded grid: count straight into it, no sort needed
+        counts = np.bincount(keys, minlength=int(dims.prod()))
+        occupied = np.flatnonzero(counts)
+        counts = counts[occupied]
+        sums = [np.bincount(keys, weights=axes[axis])[occupied] for axis in range(3)]
+    else:
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        sums = [np.bincount(inverse, weights=axes[axis], minlength=counts.size) for axis in range(3)]
+    centroids = np.empty((counts.size, 3), dtype=np.float32)
+    for axis in range(3):
+        centroids[:, axis] = sums[axis] / counts
+    return centroids
+
+
+def describe_region(region="center", depth=None, camera=None):
+    """
+    Plain-language summary of the distances in a named region, for the
+    agent's tools.
+    Args:
+        region (str): One of REGIONS.
+        depth (numpy.ndarray): Depth frame, None reads the latest one.
+        camera (str): Camera to measure with, None for the default camera.
+    Returns:
+        str: The summary, or an explanation of why there is none.
+    """
+    if depth is None:
+        depth = fermia_camera.get_depth_data(camera=camera)
+    if depth is None or not depth.any():
+        return "No depth data available."
+    roi = region_roi(region, depth.shape)
+    scale = get_depth_scale(camera)
+    stats = roi_stats(depth, roi, scale)
+    if stats["median"] is None:
+        return f"No depth readings in the {region} region (too close, too far or reflective)."
+    text = (f"{region.capitalize()} region: typical distance {stats['median']:.2f} m "
+            f"(most readings between {stats['p10']:.2f} and {stats['p90']:.2f} m, "
+            f"{stats['valid_fraction']:.0%} of pixels with a reading).")
+    obstacle = nearest_obstacle(depth, roi, scale)
+    if obstacle is not None:
+        height, width = depth.shape[:2]
+        side = ("left" if obstacle["x"] < width / 3 else
+                "right" if obstacle["x"] >= 2 * width / 3 else "center")
+        level = ("upper" if obstacle["y"] < height / 3 else
+                 "lower" if obstacle["y"] >= 2 * height / 3 else "middle")
+        text += (f" Nearest obstacle at {obstacle['distance']:.2f} m, "
+                 f"{level} {side} of the view.")
+    return text
@@ -0,0 +1,320 @@
+import bisect
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Lossless depth recordings.
+#
+# A .fdr file holds raw z16 frames, each optionally compressed on its own so
+# any frame can be read without touching the others:
+#
+#   file header   <4sHHHB7x : magic b"FDR1", version, width, height, compression
+#   frame chunk   <IQdI     : chunk magic, seq, timestamp, payload size
+#                 payload   : width*height uint16 values (maybe compressed)
+#   ...
+#   index         <dQQI per frame : timestamp, offset, seq, payload size
+#   trailer       <QQ4s     : index offset, frame count, b"FIDX"
+#
+# The index and trailer are written on close. A recording that was cut short
+# (crash, power loss) is still readable: the reader rebuilds the index by
+# walking the chunk headers.
+FILE_MAGIC = b"FDR1"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHHHB7x")
+CHUNK_MAGIC = 0x4B4E4843  # "CHNK"
+CHUNK_HEADER = struct.Struct("<IQdI")
+INDEX_ENTRY = struct.Struct("<dQQI")
+TRAILER = struct.Struct("<QQ4s")
+TRAILER_MAGIC = b"FIDX"
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSION_LZ4 = 2
+
+_COMPRESSIONS = {
+    None: COMPRESSION_NONE,
+    "none": COMPRESSION_NONE,
+    "zstd": COMPRESSION_ZSTD,
+    "lz4": COMPRESSION_LZ4,
+}
+
+
+def check_compression(compression):
+    """
+    Checks that frames can be written with a compression.
+
+    Args:
+        compression (str): None, "zstd" or "lz4".
+    Raises:
+        ValueError: If the compression is unknown or its package is missing.
+    """
+    _compressor(_compression_id(compression))
+
+
+def _compression_id(compression):
+    if compression not in _COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    return _COMPRESSIONS[compression]
+
+
+def _compressor(compression):
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=1).compress
+    if compression == COMPRESSION_LZ4:
+        if lz4 is None:
+            raise ValueError("lz4 compression requires the 'lz4' package")
+        return lz4.frame.compress
+    return None
+
+
+def _decompressor(compression):
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("This recording needs the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress
+    if compression == COMPRESSION_LZ4:
+        if lz4 is None:
+            raise ValueError("This recording needs the 'lz4' package")
+        return lz4.frame.decompress
+    return None
+
+
+class DepthRecorder:
+    """
+    Appends raw z16 depth frames to a .fdr file.
+
+    Args:
+        path (str): Output file.
+        width (int), height (int): Frame resolution.
+        compression (str): None, "zstd" or "lz4" (per frame).
+    """
+
+    def __init__(self, path, width, height, compression=None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.compression = _compression_id(compression)
+        self.compress = _compressor(self.compression)
+        self.index = []
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, width, height, self.compression))
+
+    def write(self, depth_array, seq, timestamp=None):
+        """Append one (height, width) uint16 frame."""
+        if timestamp is None:
+            timestamp = time.time()
+        if depth_array.shape != (self.height, self.width) or depth_array.dtype != np.uint16:
+            raise ValueError(f"Expected a {self.height}x{self.width} uint16 frame, "
+                             f"got {depth_array.shape} {depth_array.dtype}")
+        payload = np.ascontiguousarray(depth_array).data.cast("B")
+        if self.compress is not None:
+            payload = self.compress(payload)
+        offset = self.file.tell()
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, seq, timestamp, len(payload)))
+        self.file.write(payload)
+        self.index.append((timestamp, offset, seq, len(payload)))
+
+    def close(self):
+        """Write the frame index and trailer, and close the file."""
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(index_offset, len(self.index), TRAILER_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DepthPlayback:
+    """
+    Random access to a .fdr recording through a memory map. Uncompressed
+    frames are returned as zero-copy views into the file; nothing is read or
+    decompressed until a frame is asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height, self.compression = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a fermia depth recording")
+        self.decompress = _decompressor(self.compression)
+
+        entries = self._read_index()
+        if entries is None:
+            entries = self._scan_chunks()
+        self.timestamps = [entry[0] for entry in entries]
+        self.offsets = [entry[1] for entry in entries]
+        self.seqs = [entry[2] for entry in entries]
+        self.sizes = [entry[3] for entry in entries]
+
+    def _read_index(self):
+        """Reads the index written on close, or None if it is missing."""
+        if len(self.map) < FILE_HEADER.size + TRAILER.size:
+            return None
+        index_offset, count, magic = TRAILER.unpack_from(self.map, len(self.map) - TRAILER.size)
+        if magic != TRAILER_MAGIC:
+            return None
+        return [INDEX_ENTRY.unpack_from(self.map, index_offset + i * INDEX_ENTRY.size)
+                for i in range(count)]
+
+    def _scan_chunks(self):
+        """Rebuilds the index of an unfinished recording from the chunk headers."""
+        entries = []
+        offset = FILE_HEADER.size
+        end = len(self.map)
+        while offset + CHUNK_HEADER.size <= end:
+            magic, seq, timestamp, size = CHUNK_HEADER.unpack_from(self.map, offset)
+            if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + size > end:
+                break
+            entries.append((timestamp, offset, seq, size))
+            offset += CHUNK_HEADER.size + size
+        return entries
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def duration(self):
+        """Seconds between the first and the last frame."""
+        if not self.timestamps:
+            return 0.0
+        return self.timestamps[-1] - self.timestamps[0]
+
+    def frame(self, i):
+        """
+        Returns (seq, timestamp, depth array) of frame i. The array is a
+        read-only view into the file for uncompressed recordings.
+        """
+        start = self.offsets[i] + CHUNK_HEADER.size
+        payload = memoryview(self.map)[start:start + self.sizes[i]]
+        if self.decompress is not None:
+            payload = self.decompress(payload)
+        depth = np.frombuffer(payload, dtype=np.uint16).reshape((self.height, self.width))
+        return self.seqs[i], self.timestamps[i], depth
+
+    def index_at(self, timestamp):
+        """Index of the last frame captured at or before timestamp."""
+        return max(bisect.bisect_right(self.timestamps, timestamp) - 1, 0)
+
+    def frame_at(self, timestamp):
+        """Returns the frame that was current at the given capture time."""
+        return self.frame(self.index_at(timestamp))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def play(self, realtime=True, loop=False):
+        """
+        Yields (seq, timestamp, depth array) frames, sleeping between them to
+        reproduce the original pacing when realtime is True.
+        """
+        while True:
+            started = time.monotonic()
+            for i in range(len(self)):
+                if realtime:
+                    delay = started + (self.timestamps[i] - self.timestamps[0]) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                yield self.frame(i)
+            if not loop or not len(self):
+                return
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Frames handed out still view the map; it is unmapped with them
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_depth(path, duration=None, compression=None, stop_event=None, camera=None):
+    """
+    Records the live depth stream of fermia_camera into a .fdr file.
+
+    Args:
+        path (str): Output file.
+        duration (float): Seconds to record, or None to record until stop_event is set.
+        compression (str): None, "zstd" or "lz4".
+        stop_event (threading.Event): Ends the recording when set.
+        camera (str): Device serial or camera name, None for the default camera.
+    Returns:
+        int: Number of frames written.
+    Raises:
+        ValueError: If the compression cannot be used, or the depth
+        resolution changes during the recording.
+        OSError: If the file cannot be written.
+    """
+    import fermia_camera
+
+    check_compression(compression)
+    recorder = None
+    seq = None
+    # Sequence number of the depth frame written last
+    written = None
+    deadline = time.monotonic() + duration if duration is not None else None
+    try:
+        while ((deadline is None or time.monotonic() < deadline)
+               and (stop_event is None or not stop_event.is_set())):
+            seq = fermia_camera.wait_for_frame(seq, timeout=1.0, camera=camera)
+            if seq is None:
+                continue
+            header, depth = fermia_camera.get_depth_frame(copy=False, camera=camera)
+            if depth is None:
+                continue
+            # Color-only publishes wake the wait too; write each depth frame once
+            depth_seq = header.seq if header is not None else fermia_camera.stream_seq("depth", camera=camera)
+            if depth_seq == written:
+                continue
+            written = depth_seq
+            if recorder is None:
+                recorder = DepthRecorder(path, depth.shape[1], depth.shape[0], compression)
+            timestamp = header.timestamp if header is not None else time.time()
+            recorder.write(depth, depth_seq, timestamp)
+    finally:
+        if recorder is not None:
+            recorder.close()
+    return len(recorder.index) if recorder is not None else 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record the live depth stream losslessly")
+    parser.add_argument("path")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--compression", choices=["zstd", "lz4"], default=None)
+    parser.add_argument("--camera", default=None, help="Device serial or camera name")
+    args = parser.parse_args()
+    frames = record_depth(args.path, args.duration, args.compression, camera=args.camera)
+    print(f"Wrote {frames} frames to {args.path} ({os.path.getsize(args.path) / 1e6:.1f} MB)")
@@ -0,0 +1,163 @@
+import base64
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Binary frame layout used by the publisher and the client functions.
+# Every frame stored in Redis starts with a small fixed header followed by the
+# payload bytes (a JPEG for color frames, raw z16 for depth frames), so readers
+# can decode straight from the buffer without a base64 step.
+#
+#   magic     4s  b"FRM1"
+#   encoding  B   ENCODING_RAW / ENCODING_JPEG
+#   dtype     B   DTYPE_UINT8 / DTYPE_UINT16
+#   width     H
+#   height    H
+#   channels  H
+#   seq       Q   publisher frame sequence number
+#   timestamp d   capture time (seconds since the epoch)
+MAGIC = b"FRM1"
+HEADER = struct.Struct("<4sBBHHHQd")
+HEADER_SIZE = HEADER.size
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+
+DTYPE_UINT8 = 0
+DTYPE_UINT16 = 1
+
+_DTYPES = {
+    DTYPE_UINT8: np.uint8,
+    DTYPE_UINT16: np.uint16,
+}
+_DTYPE_CODES = {np.dtype(v): k for k, v in _DTYPES.items()}
+
+# Resolution of legacy base64 depth payloads, which carry no header, when the
+# publisher has not recorded its configuration
+LEGACY_DEPTH_SHAPE = (720, 1280)
+
+# JSON description of the running publisher's streams (resolution, fps,
+# pixel format, encoding, active substreams), refreshed while it runs
+STREAM_CONFIG_KEY = "fermia_stream_config"
+
+# JSON record of the newest RGB-D tick, written together with every depth
+# frame: the depth frame's sequence number and capture time, and the capture
+# time of the color frame the camera delivered with it ("color_timestamp").
+# That color frame is also kept under FRAMESET_COLOR_KEY until the next depth
+# frame, as the color stream moves on at its own rate.
+FRAMESET_KEY = "fermia_frameset"
+FRAMESET_COLOR_KEY = "fermia_frameset_color"
+
+FrameHeader = namedtuple(
+    "FrameHeader",
+    ["encoding", "dtype", "width", "height", "channels", "seq", "timestamp"],
+)
+
+# Aligned color and depth frames of one publisher tick (see get_frameset())
+FrameSet = namedtuple(
+    "FrameSet",
+    ["color", "depth", "color_header", "depth_header", "meta"],
+)
+
+
+def dtype_code(dtype):
+    """Return the header code for a NumPy dtype."""
+    return _DTYPE_CODES[np.dtype(dtype)]
+
+
+def numpy_dtype(code):
+    """Return the NumPy dtype for a header code."""
+    return _DTYPES[code]
+
+
+def pack_frame(payload, width, height, channels=1, dtype=np.uint8,
+               encoding=ENCODING_RAW, seq=0, timestamp=None):
+    """
+    Prepends the binary frame header to a payload.
+
+    Args:
+        payload (bytes | memoryview | np.ndarray): The frame data.
+        width (int): Frame width in pixels.
+        height (int): Frame height in pixels.
+        channels (int): Number of channels per pixel.
+        dtype: NumPy dtype of the decoded pixels.
+        encoding (int): ENCODING_RAW or ENCODING_JPEG.
+        seq (int): Publisher sequence number.
+        timestamp (float): Capture time, defaults to now.
+    Returns:
+        bytes: Header plus payload, ready for redis SET.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    header = HEADER.pack(MAGIC, encoding, dtype_code(dtype), width, height,
+                         channels, seq, timestamp)
+    if isinstance(payload, np.ndarray):
+        payload = payload.data if payload.flags.c_contiguous else payload.tobytes()
+    return b"".join((header, payload))
+
+
+def is_binary_frame(buf):
+    """Returns True if the buffer carries the binary frame header."""
+    return buf is not None and len(buf) >= HEADER_SIZE and bytes(buf[:4]) == MAGIC
+
+
+def unpack_frame(buf):
+    """
+    Splits a binary frame into its header and payload.
+
+    Returns:
+        (FrameHeader, memoryview): The parsed header and a zero-copy view of
+        the payload.
+    Raises:
+        ValueError: If the buffer does not carry the frame header.
+    """
+    if not is_binary_frame(buf):
+        raise ValueError("Buffer is not a binary fermia frame")
+    _, encoding, dtype, width, height, channels, seq, timestamp = HEADER.unpack_from(buf)
+    header = FrameHeader(encoding, dtype, width, height, channels, seq, timestamp)
+    return header, memoryview(buf)[HEADER_SIZE:]
+
+
+def frame_array(header, payload):
+    """
+    Returns a read-only NumPy view over a raw (ENCODING_RAW) payload.
+    """
+    array = np.frombuffer(payload, dtype=numpy_dtype(header.dtype))
+    if header.channels > 1:
+        return array.reshape((header.height, header.width, header.channels))
+    return array.reshape((header.height, header.width))
+
+
+def parse_color(raw):
+    """
+    Parses a camera_feed value in either transport.
+
+    Returns:
+        (FrameHeader, bytes): The header (None for legacy base64 payloads)
+        and the JPEG bytes.
+    """
+    if is_binary_frame(raw):
+        header, payload = unpack_frame(raw)
+        return header, bytes(payload)
+    return None, base64.b64decode(raw)
+
+
+def parse_depth(raw, shape=None):
+    """
+    Parses a depth_feed value in either transport.
+
+    Args:
+        raw (bytes): The stored value.
+        shape (tuple): (height, width) of legacy base64 payloads, which do
+        not carry it; LEGACY_DEPTH_SHAPE if unknown.
+    Returns:
+        (FrameHeader, np.ndarray): The header (None for legacy base64
+        payloads) and a read-only uint16 depth array.
+    """
+    if is_binary_frame(raw):
+        header, payload = unpack_frame(raw)
+        return header, frame_array(header, payload)
+    depth_array = np.frombuffer(base64.b64decode(raw), dtype=np.uint16)
+    return None, depth_array.reshape(shape or LEGACY_DEPTH_SHAPE)
@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import redis
+
+from fermia_camera.cameras import camera_key
+
+# Publisher liveness, kept up by a heartbeat thread independent of frame
+# arrival, so a camera that stops delivering frames never makes the
+# publisher look dead (and makes nobody spawn a second one).
+#
+#   LEASE_KEY     token of the one publisher allowed to run. Taken with
+#                 SET NX, renewed only by its holder (compare-and-expire), so
+#                 a second publisher started by accident exits instead of
+#                 fighting over the camera.
+#   RUNNING_KEY   "true" while a publisher is alive (what consumers check)
+#   STATUS_KEY    JSON: state ("streaming", "reconnecting", "unavailable"),
+#                 time of the last frame and, once frames stop arriving, the
+#                 time since which the published frames are stale
+#
+# All three expire LEASE_TTL seconds after the last heartbeat. Each camera
+# has its own set (camera_key()), one publisher per camera.
+LEASE_KEY = "fermia_publisher_lease"
+RUNNING_KEY = "fermia_publisher_running"
+STATUS_KEY = "fermia_publisher_status"
+
+LEASE_TTL = float(os.environ.get("FERMIA_LEASE_TTL", "2.0"))
+HEARTBEAT_INTERVAL = LEASE_TTL / 4
+
+# Frames older than this mark the stream as stale
+STALE_AFTER = float(os.environ.get("FERMIA_STALE_AFTER", "0.5"))
+
+
+class PublisherLease:
+    """Single-instance lease of the publisher in Redis."""
+    def __init__(self, redis_client, ttl=LEASE_TTL, camera=None):
+        self.redis_client = redis_client
+        self.camera = camera
+        self.key = camera_key(LEASE_KEY, camera)
+        self.ttl_ms = int(ttl * 1000)
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self, timeout=None):
+        """
+        Takes the lease, waiting up to timeout seconds (default: twice the
+        ttl, enough for the lease of a crashed publisher to run out).
+        Returns:
+            bool: True if this process now holds the lease.
+        """
+        deadline = time.monotonic() + (2 * self.ttl_ms / 1000 if timeout is None else timeout)
+        while True:
+            if self.redis_client.set(self.key, self.token, nx=True, px=self.ttl_ms):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+    def holder(self):
+        value = self.redis_client.get(self.key)
+        return value.decode() if value else None
+
+    def _if_held(self, action):
+        # Optimistic compare-and-set: the lease must still be ours when the
+        # action executes, or the transaction is dropped
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                if pipe.get(self.key) != self.token.encode():
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                action(pipe)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def renew(self):
+        """Extends the lease. Returns False if another process holds it now."""
+        return self._if_held(lambda pipe: pipe.pexpire(self.key, self.ttl_ms))
+
+    def release(self):
+        """Gives up the lease if this process still holds it."""
+        return self._if_held(lambda pipe: pipe.delete(self.key))
+
+
+class Heartbeat:
+    """
+    Background thread renewing the publisher's lease and liveness keys every
+    HEARTBEAT_INTERVAL seconds, whether or not frames arrive. The publisher
+    loop reports frames with frame() and its state with set_state(); `lost`
+    is set if the lease was taken over, after which the publisher must stop.
+    """
+    def __init__(self, redis_client, lease):
+        self.redis_client = redis_client
+        self.lease = lease
+        self.running_key = camera_key(RUNNING_KEY, lease.camera)
+        self.status_key = camera_key(STATUS_KEY, lease.camera)
+        self.state = "starting"
+        self.last_frame = None
+        # Start of the current outage; stays set until frames flow again
+        self.down_since = time.time()
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        # Called with the beat's pipeline, for other keys that expire with the publisher
+        self.callbacks = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.beat()
+        self.thread.start()
+
+    def frame(self, timestamp):
+        """Record that a frame was published."""
+        self.last_frame = timestamp
+        if self.state != "streaming":
+            self.state = "streaming"
+            self.down_since = None
+            # Tell consumers right away that frames flow again
+            self.beat()
+
+    def set_state(self, state):
+        """Report a state other than streaming ("reconnecting", "unavailable")."""
+        if state != self.state:
+            self.state = state
+            if self.down_since is None:
+                self.down_since = self.last_frame or time.time()
+            self.beat()
+
+    def stale_since(self):
+        """Time since which consumers are looking at old frames, or None."""
+        if self.down_since is not None:
+            return self.down_since
+        if self.last_frame is not None and time.time() - self.last_frame > STALE_AFTER:
+            return self.last_frame
+        return None
+
+    def status(self):
+        return {
+            "state": self.state,
+            "publisher": self.lease.token,
+            "heartbeat": time.time(),
+            "last_frame": self.last_frame,
+            "stale_since": self.stale_since(),
+        }
+
+    def beat(self):
+        """Renew the lease and refresh the liveness and status keys."""
+        if not self.lease.renew():
+            print(f"Publisher lease lost to {self.lease.holder()}.")
+            self.lost.set()
+            return
+        ttl_ms = self.lease.ttl_ms
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(self.running_key, "true", px=ttl_ms)
+        pipe.set(self.status_key, json.dumps(self.status()), px=ttl_ms)
+        for callback in self.callbacks:
+            callback(pipe)
+        pipe.execute()
+
+    def _run(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.beat()
+            except Exception as e:
+                print(f"Heartbeat failed: {e}")
+            if self.lost.is_set():
+                return
+
+    def stop(self):
+        """Stop beating and withdraw the liveness keys and the lease."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        try:
+            if self.lease.release():
+                self.redis_client.delete(self.running_key, self.status_key)
+        except redis.RedisError:
+            pass
+
+
+def read_status(redis_client, camera=None):
+    """
+    Reads the publisher status written by the heartbeat.
+    Returns:
+        dict: See Heartbeat.status(), or None if no publisher is alive.
+    """
+    raw = redis_client.get(camera_key(STATUS_KEY, camera))
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
@@ -0,0 +1,164 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Per-stage timing histograms and frame counters, cheap enough to leave on:
+# recording a sample is a perf_counter() pair, a bisect over a dozen bucket
+# bounds and an increment under a lock (a few microseconds per frame stage).
+#
+# Each process keeps its own registry. The publisher pushes a snapshot of its
+# registry into the Redis hash METRICS_KEY; the stream apps serve their own
+# registry plus the publisher's on /metrics in Prometheus text format.
+#
+# Set FERMIA_METRICS=0 to turn recording off entirely.
+ENABLED = os.environ.get("FERMIA_METRICS", "1") == "1"
+
+METRICS_KEY = "fermia_metrics"
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Cumulative-on-export histogram of stage durations."""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def snapshot(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+class Registry:
+    """Stage histograms and counters of one process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """JSON-serializable copy of every histogram and counter."""
+        with self.lock:
+            return {
+                "histograms": {stage: h.snapshot() for stage, h in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+
+registry = Registry()
+
+
+def observe(stage, seconds):
+    """Record how long one run of a stage took."""
+    if ENABLED:
+        registry.observe(stage, seconds)
+
+
+def count(name, n=1):
+    """Add n to a counter (e.g. frames_dropped)."""
+    if ENABLED and n:
+        registry.count(name, n)
+
+
+class timed:
+    """
+    Context manager timing the enclosed block as one sample of a stage:
+
+        with metrics.timed("jpeg_encode"):
+            ret, buffer = cv2.imencode('.jpg', img)
+    """
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+
+
+def push(redis_client, process, pipe=None, ttl=30):
+    """
+    Store this process's snapshot in the METRICS_KEY hash under `process`.
+    Pass a pipeline to piggyback on an existing round-trip.
+    """
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    target.hset(METRICS_KEY, process, json.dumps(registry.snapshot()))
+    target.expire(METRICS_KEY, ttl)
+    if pipe is None:
+        target.execute()
+
+
+def pulled(redis_client):
+    """
+    Returns the snapshots pushed by other processes as {process: snapshot}.
+    """
+    try:
+        stored = redis_client.hgetall(METRICS_KEY)
+    except Exception:
+        return {}
+    snapshots = {}
+    for process, data in stored.items():
+        try:
+            snapshots[process.decode()] = json.loads(data)
+        except ValueError:
+            continue
+    return snapshots
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshots):
+    """
+    Renders {process: snapshot} in the Prometheus text exposition format.
+    Returns:
+        str: The /metrics response body.
+    """
+    lines = [
+        "# HELP fermia_stage_seconds Time spent in each frame pipeline stage.",
+        "# TYPE fermia_stage_seconds histogram",
+    ]
+    for process, snapshot in sorted(snapshots.items()):
+        for stage, histogram in sorted(snapshot["histograms"].items()):
+            labels = f'process="{process}",stage="{stage}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram["counts"]):
+                cumulative += n
+                lines.append(f'fermia_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'fermia_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'fermia_stage_seconds_sum{{{labels}}} {_format(histogram["sum"])}')
+            lines.append(f'fermia_stage_seconds_count{{{labels}}} {histogram["count"]}')
+
+    counters = {}
+    for process, snapshot in snapshots.items():
+        for name, value in snapshot["counters"].items():
+            counters.setdefault(name, []).append((process, value))
+    for name in sorted(counters):
+        lines.append(f"# TYPE fermia_{name}_total counter")
+        for process, value in sorted(counters[name]):
+            lines.append(f'fermia_{name}_total{{process="{process}"}} {value}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+from fermia_camera.cameras import camera_key
+
+# The publisher bumps SEQ_KEY and publishes the new sequence number on
+# FRAME_CHANNEL after every frame it stores. Color and depth are published at
+# their own rates, so the message also names the streams that changed
+# ("42:color,depth") and each stream's last sequence number is kept under
+# STREAM_SEQ_KEY:<stream>. A bare "42" means every stream changed. Cameras
+# other than the default one use their own channel and keys (camera_key()).
+FRAME_CHANNEL = "fermia_frames"
+SEQ_KEY = "fermia_frame_seq"
+STREAM_SEQ_KEY = "fermia_frame_seq"
+FRAME_STREAMS = ("color", "depth")
+
+
+def announce_frame(pipe, seq, streams=FRAME_STREAMS, camera=None):
+    """Queue the new-frame notification on a publisher Redis pipeline."""
+    pipe.set(camera_key(SEQ_KEY, camera), seq)
+    for stream in streams:
+        pipe.set(camera_key(f"{STREAM_SEQ_KEY}:{stream}", camera), seq)
+    pipe.publish(camera_key(FRAME_CHANNEL, camera), f"{seq}:{','.join(streams)}")
+
+
+def parse_message(data):
+    """Splits a FRAME_CHANNEL message into (seq, streams)."""
+    if isinstance(data, bytes):
+        data = data.decode()
+    seq, _, streams = data.partition(":")
+    return int(seq), tuple(streams.split(",")) if streams else FRAME_STREAMS
+
+
+def _resolve(future, seq):
+    if not future.done():
+        future.set_result(seq)
+
+
+class FrameNotifier:
+    """
+    Wakes consumers once per new publisher frame.
+
+    A single background thread per process subscribes to FRAME_CHANNEL and
+    keeps the latest sequence number. Threads block on a condition variable,
+    coroutines on futures resolved from the listener thread. Any change of
+    sequence number counts as a new frame, so a publisher restart (which
+    starts counting from 1 again) still wakes everyone.
+    """
+
+    def __init__(self, redis_client, camera=None):
+        self.redis_client = redis_client
+        self.channel = camera_key(FRAME_CHANNEL, camera)
+        self.seq_key = camera_key(SEQ_KEY, camera)
+        self.stream_keys = [camera_key(f"{STREAM_SEQ_KEY}:{stream}", camera) for stream in FRAME_STREAMS]
+        self.cond = threading.Condition()
+        self.seq = 0
+        # Sequence number at which each stream last changed
+        self.stream_seqs = dict.fromkeys(FRAME_STREAMS, 0)
+        self.thread = None
+        self.waiters = set()
+
+    def _current(self):
+        """Reads the latest sequence numbers straight from Redis."""
+        try:
+            raw, *stream_raw = self.redis_client.mget([self.seq_key] + self.stream_keys)
+            with self.cond:
+                for stream, value in zip(FRAME_STREAMS, stream_raw):
+                    # Older publishers do not store per-stream numbers
+                    self.stream_seqs[stream] = int(value) if value else int(raw or 0)
+            return int(raw) if raw else 0
+        except Exception:
+            return self.seq
+
+    def _ensure_started(self):
+        with self.cond:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._listen, daemon=True)
+            self.thread.start()
+        self._update(self._current())
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Catch up on anything published while (re)subscribing
+                self._update(self._current())
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._update(*parse_message(message["data"]))
+            except Exception as e:
+                print(f"Frame notifier lost its subscription: {e}")
+                time.sleep(1)
+
+    def _update(self, seq, streams=()):
+        with self.cond:
+            for stream in streams:
+                self.stream_seqs[stream] = seq
+            if seq == self.seq:
+                return
+            self.seq = seq
+            self.cond.notify_all()
+            waiters, self.waiters = self.waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, seq)
+
+    def stream_seq(self, stream):
+        """Sequence number at which a stream ("color" or "depth") last changed."""
+        if self.thread is None:
+            self._ensure_started()
+        with self.cond:
+            return self.stream_seqs.get(stream, self.seq)
+
+    def wait(self, after_seq=None, timeout=None):
+        """
+        Blocks until a frame other than after_seq is available.
+
+        Args:
+            after_seq (int): Last sequence number the caller has seen. None
+            waits for the next frame after the current one.
+            timeout (float): Seconds to wait, None waits forever.
+        Returns:
+            int: The new sequence number, or None on timeout.
+        """
+        self._ensure_started()
+        with self.cond:
+            if after_seq is None:
+                after_seq = self.seq
+            if self.cond.wait_for(lambda: self.seq != after_seq, timeout):
+                return self.seq
+        # No notification arrived; poll once in case pub/sub is unavailable
+        seq = self._current()
+        if seq != after_seq:
+            self._update(seq)
+            return seq
+        return None
+
+    async def wait_async(self, after_seq=None, timeout=None):
+        """Asynchronous version of wait(); never blocks the event loop."""
+        if self.thread is None or not self.thread.is_alive():
+            await asyncio.get_running_loop().run_in_executor(None, self._ensure_started)
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            if after_seq is None:
+                after_seq = self.seq
+            if self.seq != after_seq:
+                return self.seq
+            future = loop.create_future()
+            waiter = (loop, future)
+            self.waiters.add(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self.cond:
+                self.waiters.discard(waiter)
+        seq = await loop.run_in_executor(None, self._current)
+        if seq != after_seq:
+            self._update(seq)
+            return seq
+        return None
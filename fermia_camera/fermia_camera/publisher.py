@@ -1,91 +1,465 @@
+import os
+import argparse
+import json
+import signal
+import subprocess
+import sys
 import time
+import threading
 import redis
 import cv2
 import base64
 import numpy as np
-import pyrealsense2 as rs
+
+from fermia_camera.frame import pack_frame, ENCODING_JPEG, ENCODING_RAW, STREAM_CONFIG_KEY, FRAMESET_KEY, FRAMESET_COLOR_KEY
+from fermia_camera.shm import FrameRing, SHM_KEY
+from fermia_camera.notify import announce_frame
+from fermia_camera.heartbeat import Heartbeat, PublisherLease
+from fermia_camera.cameras import camera_key, register, unregister
+from fermia_camera import metrics
+from fermia_camera.sources import (
+    make_source, connected_serials, SourceUnavailable, SourceEnded, DEFAULT_SIZE, DEPTH_FILTERS,
+)
+from fermia_camera.substreams import load_substreams, feed_key, render as render_substream
 
 # Initialize Redis client (make sure this matches the consumer)
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+redis_client = redis.Redis(host=os.environ.get("FERMIA_REDIS_HOST", "localhost"),
+                           port=int(os.environ.get("FERMIA_REDIS_PORT", "6379")), db=0)
+
+# Frame transport: "binary" stores raw bytes behind a small fixed header,
+# "base64" keeps the legacy base64 text payloads.
+TRANSPORT = os.environ.get("FERMIA_TRANSPORT", "binary")
+
+# Shared-memory rings for consumers on the same host. When enabled, frames go
+# into the rings uncompressed and Redis only carries metadata and liveness.
+SHM_ENABLED = os.environ.get("FERMIA_SHM", "0") == "1"
+SHM_SLOTS = int(os.environ.get("FERMIA_SHM_SLOTS", "4"))
+
+# JPEG quality of the published color stream
+JPEG_QUALITY = int(os.environ.get("FERMIA_JPEG_QUALITY", "95"))
+
+# Seconds between pushes of the publisher's stage metrics to Redis, and
+# between re-reads of the requested substreams
+METRICS_INTERVAL = 1.0
+SUBSTREAM_INTERVAL = 1.0
+
+# Seconds the stream configuration outlives the publisher
+CONFIG_TTL = 10
+
+# Quick restarts of a source that stopped delivering frames before falling
+# back to a full restart, and the pauses of the slow path (no camera at all)
+RECONNECT_ATTEMPTS = 5
+RESTART_DELAY = 0.2
+UNAVAILABLE_RETRY = 1.0
+
+# Name of the serialization stage in the metrics
+PACK_STAGE = "base64_encode" if TRANSPORT == "base64" else "pack"
+
+def open_rings(width, height, camera=None):
+    """Create the color and depth rings for a given resolution."""
+    suffix = f"_{camera}" if camera is not None else ""
+    return {
+        "color": FrameRing.create(f"fermia_color{suffix}", width * height * 3, SHM_SLOTS),
+        "depth": FrameRing.create(f"fermia_depth{suffix}", width * height * 2, SHM_SLOTS),
+    }
+
+def announce_rings(rings, camera=None, pipe=None):
+    """Tell consumers where the rings are; expires with the publisher."""
+    info = {stream: {"name": ring.name, "created": ring.created} for stream, ring in rings.items()}
+    (pipe or redis_client).set(camera_key(SHM_KEY, camera), json.dumps(info), ex=5)
+
+def close_rings(rings, camera=None):
+    """Withdraw the announcement and remove the rings."""
+    redis_client.delete(camera_key(SHM_KEY, camera))
+    for ring in rings.values():
+        ring.close()
 
-def publish_placeholder():
+def encode_color(jpeg_bytes, width, height, seq, timestamp, transport=None):
+    """Prepare an encoded JPEG color frame for Redis."""
+    if (transport or TRANSPORT) == "base64":
+        return base64.b64encode(jpeg_bytes).decode('utf-8')
+    return pack_frame(jpeg_bytes, width, height, channels=3, dtype=np.uint8,
+                      encoding=ENCODING_JPEG, seq=seq, timestamp=timestamp)
+
+def encode_depth(depth_array, seq, timestamp, transport=None):
+    """Prepare a raw z16 depth frame for Redis."""
+    if (transport or TRANSPORT) == "base64":
+        return base64.b64encode(depth_array.tobytes()).decode('utf-8')
+    height, width = depth_array.shape[:2]
+    return pack_frame(depth_array, width, height, channels=1, dtype=np.uint16,
+                      encoding=ENCODING_RAW, seq=seq, timestamp=timestamp)
+
+def publish_placeholder(seq=0, size=DEFAULT_SIZE, camera=None):
     """Publish a default placeholder (black image) to Redis."""
-    placeholder_img = np.zeros((720, 1280, 3), dtype=np.uint8)
+    width, height = size
+    placeholder_img = np.zeros((height, width, 3), dtype=np.uint8)
     ret, encoded_img = cv2.imencode('.jpg', placeholder_img)
     if ret:
-        b64_img = base64.b64encode(encoded_img.tobytes()).decode('utf-8')
-        redis_client.set("camera_feed", b64_img)
+        timestamp = time.time()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(feed_key("color", camera=camera),
+                 encode_color(encoded_img.tobytes(), width, height, seq, timestamp))
         
         # depth image
-        depth_placeholder = np.zeros((720, 1280), dtype=np.uint16)
-        b64_depth = base64.b64encode(depth_placeholder.tobytes()).decode('utf-8')
-        redis_client.set("depth_feed", b64_depth)
+        depth_placeholder = np.zeros((height, width), dtype=np.uint16)
+        pipe.set(feed_key("depth", camera=camera), encode_depth(depth_placeholder, seq, timestamp))
+        announce_frame(pipe, seq, camera=camera)
+        pipe.execute()
 
-def run_publisher():
-    while True:
-        try:
-            # Check for connected RealSense devices
-            ctx = rs.context()
-            devices = ctx.devices
-            if len(devices) == 0:
-                print("No camera detected. Publishing placeholder image.")
-                publish_placeholder()
-                time.sleep(2)
-                continue
-            
-            print("Camera detected. Starting pipeline.")
-            pipeline = rs.pipeline()
-            config = rs.config()
-            
-            # color image stream
-            config.enable_stream(rs.stream.color, 1280, 720, rs.format.bgr8, 15)
-            # depth image stream
-            config.enable_stream(rs.stream.depth, 1280, 720, rs.format.z16, 6)
-            
-            pipeline.start(config)
-            
-            # frame_skip = 5 # Skip initial unstable frames
-            # frame_count = 0
-            
-            while True:
-                # Refresh running key so consumers know the publisher is alive
-                redis_client.set("fermia_publisher_running", "true", ex=5)
-                
-                try:
-                    frames = pipeline.wait_for_frames(timeout_ms=5000)
-                except Exception:
-                    print("Camera stopped sending frames. Stopping pipeline.")
-                    break
-                
-                color_frame = frames.get_color_frame()
-                depth_frame = frames.get_depth_frame()
-                
-                if not color_frame:
+class Publisher:
+    """
+    Stores frames and announces them. Color and depth are published
+    independently, each only when the source delivered a new frame for it,
+    together with the substreams consumers asked for (see substreams.py).
+    Color JPEG encoding runs on a worker thread so the capture loop never
+    waits on it; if the encoder falls behind, only the newest color frame is
+    kept. camera selects the keys (None: the default camera's plain keys).
+    """
+    def __init__(self, source, seq=0, camera=None):
+        self.source = source
+        self.seq = seq
+        self.camera = camera
+        self.rings = None
+        self.substreams = {}
+        # Capture time of the newest color frame, paired with the depth frames that follow
+        self.color_timestamp = None
+        # Color frame the newest depth frame is paired with, and the newest
+        # stored color frame as (timestamp, binary frame); guarded by pending_cond
+        self.paired_timestamp = None
+        self.last_color = None
+        # What consumers find under STREAM_CONFIG_KEY; frame sizes are filled
+        # in from the frames themselves (depth filters may change them)
+        self.config = {
+            "source": type(source).__name__,
+            "camera": camera,
+            "serial": getattr(source, "device_serial", None),
+            "transport": "shm" if SHM_ENABLED else TRANSPORT,
+            "color": {"width": source.width, "height": source.height, "fps": source.fps,
+                      "format": "bgr8", "encoding": "raw" if SHM_ENABLED else "jpeg",
+                      "jpeg_quality": JPEG_QUALITY},
+            "depth": {"width": source.width, "height": source.height,
+                      "fps": getattr(source, "depth_fps", source.fps),
+                      "format": "z16", "filters": DEPTH_FILTERS,
+                      "depth_scale": source.depth_scale, "intrinsics": source.intrinsics()},
+            "substreams": {},
+        }
+        # Serializes sequence numbers with their Redis writes so SEQ_KEY never goes backwards
+        self.lock = threading.Lock()
+        self.pending = None
+        self.pending_cond = threading.Condition()
+        self.running = True
+        self.encoder = threading.Thread(target=self._encode_loop, daemon=True)
+        self.encoder.start()
+
+    def refresh(self):
+        """Re-read the requested substreams and republish the stream configuration."""
+        self.substreams = load_substreams(redis_client, self.camera)
+        self.config["substreams"] = self.substreams
+        redis_client.set(camera_key(STREAM_CONFIG_KEY, self.camera), json.dumps(self.config), ex=CONFIG_TTL)
+
+    def _selected(self, stream):
+        return {name: spec for name, spec in self.substreams.items() if spec["stream"] == stream}
+
+    def _store(self, streams, fill):
+        """Run fill(pipe, seq) with the next sequence number and announce the streams."""
+        with self.lock:
+            self.seq += 1
+            pipe = redis_client.pipeline(transaction=False)
+            fill(pipe, self.seq)
+            announce_frame(pipe, self.seq, streams, self.camera)
+            with metrics.timed("redis_write"):
+                pipe.execute()
+        metrics.count("frames_published")
+
+    def publish(self, img, depth_img, timestamp):
+        """Publish whichever of the color and depth frames are not None."""
+        if depth_img is not None:
+            self.config["depth"]["height"], self.config["depth"]["width"] = depth_img.shape[:2]
+        if img is not None:
+            self.config["color"]["height"], self.config["color"]["width"] = img.shape[:2]
+            self.color_timestamp = timestamp
+        color_timestamp = self.color_timestamp
+        paired_color = None
+        if depth_img is not None and color_timestamp is not None and self.rings is None:
+            with self.pending_cond:
+                # Already stored, or the encoder stores it once it is encoded
+                self.paired_timestamp = color_timestamp
+                if self.last_color is not None and self.last_color[0] == color_timestamp:
+                    paired_color = self.last_color[1]
+
+        streams = []
+        depth_substreams = self._selected("depth") if depth_img is not None else {}
+        if self.rings is not None:
+            # Same-host consumers read raw frames straight from shared memory
+            streams = [name for name, frame in (("color", img), ("depth", depth_img)) if frame is not None]
+        elif depth_img is not None:
+            streams = ["depth"]
+        streams += [f"depth:{name}" for name in depth_substreams]
+
+        def fill(pipe, seq):
+            if self.rings is not None:
+                with metrics.timed("shm_write"):
+                    if img is not None:
+                        self.rings["color"].write(img, seq, timestamp)
+                    if depth_img is not None:
+                        self.rings["depth"].write(depth_img, seq, timestamp)
+            with metrics.timed(PACK_STAGE):
+                if depth_img is not None and self.rings is None:
+                    pipe.set(feed_key("depth", camera=self.camera), encode_depth(depth_img, seq, timestamp))
+                if depth_img is not None and color_timestamp is not None:
+                    # Lets consumers pick the color frame captured with this depth frame
+                    pipe.set(camera_key(FRAMESET_KEY, self.camera), json.dumps(
+                        {"seq": seq, "timestamp": timestamp, "color_timestamp": color_timestamp}))
+                if paired_color is not None:
+                    pipe.set(camera_key(FRAMESET_COLOR_KEY, self.camera), paired_color)
+                # Substreams are new, so they always carry the binary header
+                for name, spec in depth_substreams.items():
+                    sub_depth = np.ascontiguousarray(render_substream(spec, depth_img))
+                    pipe.set(feed_key("depth", name, self.camera),
+                             encode_depth(sub_depth, seq, timestamp, "binary"))
+        if streams:
+            self._store(streams, fill)
+
+        # JPEG encoding (the full frame outside shm mode, color substreams) on the worker
+        if img is not None and (self.rings is None or self._selected("color")):
+            with self.pending_cond:
+                if self.pending is not None:
+                    # Encoder still busy with an older frame: replace it
+                    metrics.count("color_frames_replaced")
+                self.pending = (img, timestamp)
+                self.pending_cond.notify()
+
+    def _encode(self, img, quality=None):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality or JPEG_QUALITY]
+        with metrics.timed("jpeg_encode"):
+            ret, img_encoded = cv2.imencode('.jpg', img, params)
+        return img_encoded.tobytes() if ret else None
+
+    def _encode_loop(self):
+        while True:
+            with self.pending_cond:
+                self.pending_cond.wait_for(lambda: self.pending is not None or not self.running)
+                if not self.running:
+                    return
+                img, timestamp = self.pending
+                self.pending = None
+            try:
+                # (stream name, Redis key, JPEG, image) of everything to store
+                outputs = []
+                if self.rings is None:
+                    outputs.append(("color", feed_key("color", camera=self.camera), self._encode(img), img))
+                for name, spec in self._selected("color").items():
+                    with metrics.timed("substream_render"):
+                        sub_img = render_substream(spec, img)
+                    outputs.append((f"color:{name}", feed_key("color", name, self.camera),
+                                    self._encode(sub_img, spec.get("quality")), sub_img))
+                outputs = [output for output in outputs if output[2] is not None]
+                if not outputs:
                     continue
-                
-                # frame_count += 1
-                # if frame_count <= frame_skip:
-                #     continue # Skip early frames
-                
-                img = np.asanyarray(color_frame.get_data())
-                ret, img_encoded = cv2.imencode('.jpg', img)
-                if ret:
-                    b64_img = base64.b64encode(img_encoded.tobytes()).decode('utf-8')
-                    redis_client.set("camera_feed", b64_img)
-                
-                # Process and publish the depth frame
-                depth_img = np.asanyarray(depth_frame.get_data())
-                b64_depth = base64.b64encode(depth_img.tobytes()).decode('utf-8')
-                redis_client.set("depth_feed", b64_depth)
-                
+                def fill(pipe, seq):
+                    with metrics.timed(PACK_STAGE):
+                        for stream, key, jpeg, image in outputs:
+                            height, width = image.shape[:2]
+                            transport = None if stream == "color" else "binary"
+                            payload = encode_color(jpeg, width, height, seq, timestamp, transport)
+                            pipe.set(key, payload)
+                            if stream == "color":
+                                self._store_paired(pipe, jpeg, payload, width, height, seq, timestamp)
+                self._store([output[0] for output in outputs], fill)
+            except Exception as e:
+                print("Exception in color encoder:", e)
+
+    def _store_paired(self, pipe, jpeg, payload, width, height, seq, timestamp):
+        """Keep the newest color frame, and store it for get_frameset() if a depth frame is paired with it."""
+        if TRANSPORT == "base64":
+            payload = encode_color(jpeg, width, height, seq, timestamp, "binary")
+        with self.pending_cond:
+            self.last_color = (timestamp, payload)
+            paired = timestamp == self.paired_timestamp
+        if paired:
+            pipe.set(camera_key(FRAMESET_COLOR_KEY, self.camera), payload)
+
+    def close(self):
+        """Stop the encoder thread."""
+        with self.pending_cond:
+            self.running = False
+            self.pending_cond.notify()
+        self.encoder.join()
+
+def reconnect(source, heartbeat):
+    """
+    Restarts a source that stopped delivering frames, retrying briefly.
+    Returns:
+        bool: True once it delivers again, False to fall back to a full
+        restart (close, placeholder, open).
+    """
+    heartbeat.set_state("reconnecting")
+    delay = 0.05
+    for attempt in range(RECONNECT_ATTEMPTS):
+        if heartbeat.lost.is_set():
+            return False
+        try:
+            started = time.monotonic()
+            source.reconnect()
+            print(f"Reconnected {type(source).__name__} in {time.monotonic() - started:.2f} s.")
+            metrics.count("source_reconnects")
+            return True
         except Exception as e:
-            print("Exception in publisher:", e)
-        finally:
+            print(f"Reconnect attempt {attempt + 1} failed: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+    return False
+
+def run_publisher(source_spec=None, camera=None, serial=None):
+    """
+    Publishes frames from the configured source (FERMIA_SOURCE, see
+    sources.py) until the process is stopped, falling back to a placeholder
+    image while the source is unavailable. Only one publisher runs per
+    camera: a second one exits once it finds the lease held.
+    Args:
+        camera (str): Serial of the camera to publish under its own keys
+        (see cameras.py), None for the default camera.
+        serial (str): RealSense device to capture from; defaults to camera,
+        or the first device found.
+    """
+    serial = serial or camera
+    lease = PublisherLease(redis_client, camera=camera)
+    if not lease.acquire():
+        print(f"Another publisher is running ({lease.holder()}). Exiting.")
+        return
+    heartbeat = Heartbeat(redis_client, lease)
+    # Rings and device of the current source, refreshed with every heartbeat
+    active = {"rings": None, "serial": None}
+
+    def beat(pipe):
+        if active["rings"]:
+            announce_rings(active["rings"], camera, pipe)
+        if active["serial"]:
+            register(pipe, active["serial"], camera)
+    heartbeat.callbacks.append(beat)
+    heartbeat.start()
+    process = "publisher" if camera is None else f"publisher:{camera}"
+
+    # Frame sequence numbers keep counting across source restarts
+    seq = 0
+    metrics_pushed = 0.0
+    try:
+        while not heartbeat.lost.is_set():
+            source = make_source(source_spec, serial)
+            publisher = None
             try:
-                pipeline.stop()
-            except Exception:
-                pass
-            time.sleep(1)
+                try:
+                    source.open()
+                except SourceUnavailable as e:
+                    print(f"{e}. Publishing placeholder image.")
+                    heartbeat.set_state("unavailable")
+                    seq += 1
+                    publish_placeholder(seq, camera=camera)
+                    time.sleep(UNAVAILABLE_RETRY)
+                    continue
+
+                print(f"Starting {type(source).__name__}" + (f" for camera {camera}." if camera else "."))
+                publisher = Publisher(source, seq, camera)
+                active["serial"] = getattr(source, "device_serial", None) or camera
+                refreshed = 0.0
+
+                # frame_skip = 5 # Skip initial unstable frames
+                # frame_count = 0
+
+                while not heartbeat.lost.is_set():
+                    if time.monotonic() - refreshed >= SUBSTREAM_INTERVAL:
+                        publisher.refresh()
+                        refreshed = time.monotonic()
+                    if time.monotonic() - metrics_pushed >= METRICS_INTERVAL:
+                        metrics.push(redis_client, process)
+                        metrics_pushed = time.monotonic()
+
+                    try:
+                        with metrics.timed("source_read"):
+                            frame = source.read()
+                    except SourceEnded as e:
+                        print(f"{e}. Reconnecting.")
+                        if reconnect(source, heartbeat):
+                            continue
+                        break
+                    if frame is None:
+                        metrics.count("frames_skipped")
+                        continue
+
+                    # frame_count += 1
+                    # if frame_count <= frame_skip:
+                    #     continue # Skip early frames
+
+                    img, depth_img = frame
+                    if SHM_ENABLED and publisher.rings is None:
+                        # Sized once the first frame is in, as replayed sources only know their size now
+                        publisher.rings = open_rings(source.width, source.height, camera)
+                        active["rings"] = publisher.rings
+                        announce_rings(publisher.rings, camera)
+
+                    timestamp = time.time()
+                    publisher.publish(img, depth_img, timestamp)
+                    heartbeat.frame(timestamp)
+
+            except Exception as e:
+                print("Exception in publisher:", e)
+            finally:
+                heartbeat.set_state("unavailable")
+                source.close()
+                if publisher is not None:
+                    publisher.close()
+                    seq = publisher.seq
+                    if publisher.rings:
+                        active["rings"] = None
+                        close_rings(publisher.rings, camera)
+                if not heartbeat.lost.is_set():
+                    time.sleep(RESTART_DELAY)
+    finally:
+        heartbeat.stop()
+        if active["serial"]:
+            unregister(redis_client, active["serial"])
+
+def run_all(source_spec=None):
+    """
+    Runs one publisher process per connected RealSense device, so cameras
+    are captured and encoded on separate cores. The first device (by serial)
+    is the default camera; the others publish under their serials.
+    """
+    serials = connected_serials()
+    if len(serials) < 2:
+        # Nothing to spread out: publish the only camera (or the placeholder) here
+        return run_publisher(source_spec, serial=serials[0] if serials else None)
+    commands = [[sys.executable, "-m", "fermia_camera.publisher", "--device", serials[0]]]
+    commands += [[sys.executable, "-m", "fermia_camera.publisher", "--camera", serial]
+                 for serial in serials[1:]]
+    if source_spec:
+        for command in commands:
+            command += ["--source", source_spec]
+    print(f"Starting publishers for cameras {', '.join(serials)}.")
+    children = [subprocess.Popen(command) for command in commands]
+    try:
+        for child in children:
+            child.wait()
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
 
 if __name__ == "__main__":
-    run_publisher()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Publish camera frames to Redis")
+    parser.add_argument("--camera", default=os.environ.get("FERMIA_CAMERA") or None,
+                        help="serial of the camera to publish under its own keys (default: the default camera)")
+    parser.add_argument("--device", default=None,
+                        help="RealSense serial to capture from (default: --camera, or the first device)")
+    parser.add_argument("--all", action="store_true",
+                        help="one publisher process per connected camera")
+    parser.add_argument("--source", default=None, help="frame source, overrides FERMIA_SOURCE")
+    args = parser.parse_args()
+
+    # Let SIGTERM run the cleanup (lease release, rings) like Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.all:
+        run_all(args.source)
+    else:
+        run_publisher(args.source, args.camera, args.device)
@@ -0,0 +1,259 @@
+import json
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from fermia_camera.frame import FrameHeader, ENCODING_RAW, dtype_code, numpy_dtype
+
+# Shared-memory ring buffer for frames published on the same host.
+#
+# The segment starts with a ring header followed by `slots` fixed-size slots.
+# Each slot has its own seqlock counter: the writer bumps it to an odd value
+# before touching the slot and to the next even value once it is done, so a
+# reader can tell whether the slot changed under it.
+#
+#   ring header  <4sIQQd : magic, slots, slot_size, generation, created
+#   slot header  <QQHHHBxdQ : lock, seq, width, height, channels, dtype, timestamp, nbytes
+RING_MAGIC = b"FRNG"
+RING_HEADER = struct.Struct("<4sIQQd")
+SLOT_HEADER = struct.Struct("<QQHHHBxdQ")
+RING_HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64
+
+_GENERATION_OFFSET = 16
+
+# Redis key where the publisher announces its rings: {stream: {name, created}}
+SHM_KEY = "fermia_shm"
+
+
+def _attach(name):
+    """Attach to an existing segment without handing it to the resource tracker."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the segment, which would unlink it
+        # when this (reader) process exits.
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+class RingFrame:
+    """
+    A frame read from a FrameRing.
+
+    `array` is a zero-copy view into shared memory. It stays valid until the
+    writer wraps around to the same slot; check `valid()` after using it, or
+    call `copy()` to take a private copy.
+    """
+
+    def __init__(self, ring, slot, lock, header, array):
+        self.ring = ring
+        self.slot = slot
+        self.lock = lock
+        self.header = header
+        self.array = array
+
+    def valid(self):
+        """Returns True if the slot has not been overwritten since the read."""
+        return self.ring._slot_lock(self.slot) == self.lock
+
+    def copy(self):
+        """
+        Returns a private copy of the frame data, or None if the slot was
+        overwritten while copying.
+        """
+        data = self.array.copy()
+        if not self.valid():
+            return None
+        return data
+
+
+class FrameRing:
+    """
+    Ring buffer of N frame slots in a multiprocessing.shared_memory segment.
+    The publisher creates it with `FrameRing.create()`, consumers attach with
+    `FrameRing.attach()` and read the newest frame with `read_latest()`.
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, self.slots, self.slot_size, _, self.created = RING_HEADER.unpack_from(self.buf, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(f"Shared memory segment {shm.name} is not a frame ring")
+        self.name = shm.name
+
+    @classmethod
+    def create(cls, name, slot_size, slots=4):
+        """
+        Creates (or replaces) a ring able to hold frames of up to slot_size bytes.
+        """
+        size = RING_HEADER_SIZE + slots * (SLOT_HEADER_SIZE + slot_size)
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:RING_HEADER_SIZE] = bytes(RING_HEADER_SIZE)
+        for slot in range(slots):
+            offset = RING_HEADER_SIZE + slot * (SLOT_HEADER_SIZE + slot_size)
+            shm.buf[offset:offset + SLOT_HEADER_SIZE] = bytes(SLOT_HEADER_SIZE)
+        RING_HEADER.pack_into(shm.buf, 0, RING_MAGIC, slots, slot_size, 0, time.time())
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to a ring created by another process."""
+        return cls(_attach(name))
+
+    def _slot_offset(self, slot):
+        return RING_HEADER_SIZE + slot * (SLOT_HEADER_SIZE + self.slot_size)
+
+    def _slot_lock(self, slot):
+        return struct.unpack_from("<Q", self.buf, self._slot_offset(slot))[0]
+
+    @property
+    def generation(self):
+        """Number of frames written so far."""
+        return struct.unpack_from("<Q", self.buf, _GENERATION_OFFSET)[0]
+
+    def write(self, array, seq, timestamp=None):
+        """
+        Copies a frame into the next slot.
+
+        Args:
+            array (np.ndarray): uint8 (H, W[, C]) or uint16 (H, W) frame.
+            seq (int): Publisher sequence number.
+            timestamp (float): Capture time, defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        nbytes = array.nbytes
+        if nbytes > self.slot_size:
+            raise ValueError(f"Frame of {nbytes} bytes does not fit in a {self.slot_size} byte slot")
+        height, width = array.shape[:2]
+        channels = array.shape[2] if array.ndim > 2 else 1
+
+        generation = self.generation + 1
+        slot = generation % self.slots
+        offset = self._slot_offset(slot)
+        lock = self._slot_lock(slot)
+
+        # Mark the slot as being written (odd), fill it, then publish (even)
+        struct.pack_into("<Q", self.buf, offset, lock + 1)
+        data_offset = offset + SLOT_HEADER_SIZE
+        dest = np.ndarray(array.shape, dtype=array.dtype, buffer=self.buf, offset=data_offset)
+        np.copyto(dest, array)
+        SLOT_HEADER.pack_into(self.buf, offset, lock + 1, seq, width, height, channels,
+                              dtype_code(array.dtype), timestamp, nbytes)
+        struct.pack_into("<Q", self.buf, offset, lock + 2)
+        struct.pack_into("<Q", self.buf, _GENERATION_OFFSET, generation)
+
+    def read_latest(self, timestamp=None):
+        """
+        Reads the newest complete frame. If the writer has wrapped around onto
+        the newest slot, the next older complete slot is returned instead.
+
+        Args:
+            timestamp (float): Only return the frame captured at this time,
+            which may be older than the newest one while it is still in the
+            ring.
+        Returns:
+            RingFrame or None if nothing (matching) has been written yet.
+        """
+        generation = self.generation
+        for candidate in range(generation, max(generation - self.slots, 0), -1):
+            slot = candidate % self.slots
+            offset = self._slot_offset(slot)
+            lock, seq, width, height, channels, dtype, frame_timestamp, nbytes = SLOT_HEADER.unpack_from(self.buf, offset)
+            if lock % 2:
+                # Writer is in this slot right now
+                continue
+            if timestamp is not None and frame_timestamp != timestamp:
+                continue
+            header = FrameHeader(ENCODING_RAW, dtype, width, height, channels, seq, frame_timestamp)
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            array = np.ndarray(shape, dtype=numpy_dtype(dtype), buffer=self.buf,
+                               offset=offset + SLOT_HEADER_SIZE)
+            array.flags.writeable = False
+            if self._slot_lock(slot) != lock:
+                continue
+            return RingFrame(self, slot, lock, header, array)
+        return None
+
+    def close(self):
+        """Detaches from the segment, and removes it if this process created it."""
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views handed out by read_latest() are still alive
+            return
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RingReader:
+    """
+    Consumer-side lookup of the publisher's rings.
+
+    The ring names are read from Redis at most once per `check_interval`
+    seconds, so the per-frame read path never touches Redis. Rings are
+    re-attached when the publisher recreates them and dropped when the
+    announcement expires.
+    """
+
+    def __init__(self, redis_client, check_interval=1.0, key=SHM_KEY):
+        self.redis_client = redis_client
+        self.key = key
+        self.check_interval = check_interval
+        self.checked = 0.0
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            raw = self.redis_client.get(self.key)
+            info = json.loads(raw) if raw else {}
+        except Exception:
+            info = {}
+        for stream in list(self.rings):
+            ring = self.rings[stream]
+            entry = info.get(stream)
+            if not entry or entry["name"] != ring.name or entry["created"] != ring.created:
+                del self.rings[stream]
+                ring.close()
+        for stream, entry in info.items():
+            if stream in self.rings:
+                continue
+            try:
+                ring = FrameRing.attach(entry["name"])
+            except (FileNotFoundError, ValueError):
+                continue
+            if ring.created != entry["created"]:
+                ring.close()
+                continue
+            self.rings[stream] = ring
+
+    def get(self, stream):
+        """Returns the attached FrameRing for a stream, or None."""
+        now = time.monotonic()
+        if now - self.checked > self.check_interval:
+            with self.lock:
+                if now - self.checked > self.check_interval:
+                    self.checked = now
+                    self._refresh()
+        return self.rings.get(stream)
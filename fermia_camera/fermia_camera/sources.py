@@ -0,0 +1,464 @@
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import pyrealsense2 as rs
+except ImportError:
+    rs = None
+
+# Frame sources for the publisher. Every source hands out the same thing the
+# RealSense pipeline does, a BGR uint8 color image and a z16 (uint16) depth
+# image of equal size, so everything downstream of the publisher (encoding,
+# Redis/shared-memory transport, the stream apps) runs exactly as it would
+# with a camera attached.
+#
+# FERMIA_SOURCE picks the source:
+#   realsense                       live camera (default)
+#   synthetic[:WIDTHxHEIGHT[@FPS[/DEPTH_FPS]]]
+#                                   generated test pattern, e.g. synthetic:640x480@30/6
+#   replay:PATH                     a .fdr depth recording, a video file or a
+#                                   directory of image/.npy frames
+SOURCE = os.environ.get("FERMIA_SOURCE", "realsense")
+
+# Replayed recordings start over when they reach the end
+REPLAY_LOOP = os.environ.get("FERMIA_REPLAY_LOOP", "1") == "1"
+
+# Stream configuration of the camera (and the defaults of the other sources)
+DEFAULT_SIZE = (int(os.environ.get("FERMIA_WIDTH", "1280")),
+                int(os.environ.get("FERMIA_HEIGHT", "720")))
+DEFAULT_COLOR_FPS = int(os.environ.get("FERMIA_FPS", "15"))
+DEFAULT_DEPTH_FPS = int(os.environ.get("FERMIA_DEPTH_FPS", "6"))
+
+# Optional RealSense post-processing of the depth stream, applied in this
+# order: comma-separated "decimation", "spatial", "temporal"
+DEPTH_FILTERS = [f for f in os.environ.get("FERMIA_DEPTH_FILTERS", "").split(",") if f]
+# Decimation factor (2 halves the depth resolution)
+DECIMATION = int(os.environ.get("FERMIA_DECIMATION", "2"))
+
+# How long the camera may go without delivering a frame before the source
+# reports it as stopped (and the publisher reconnects)
+FRAME_TIMEOUT_MS = int(os.environ.get("FERMIA_FRAME_TIMEOUT_MS", "500"))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".npy")
+
+# Metres per depth unit of the z16 stream (the RealSense default, 1 mm)
+DEFAULT_DEPTH_SCALE = 0.001
+# Horizontal field of view assumed for sources that carry no calibration
+# (the D435 depth camera's nominal 87 degrees)
+ESTIMATED_HFOV = float(os.environ.get("FERMIA_HFOV", "87"))
+
+
+class SourceUnavailable(Exception):
+    """The source cannot be opened (no camera, missing file, ...)."""
+
+
+class SourceEnded(Exception):
+    """The source stopped delivering frames."""
+
+
+def estimated_intrinsics(width, height, hfov=ESTIMATED_HFOV):
+    """
+    Pinhole intrinsics of an ideal camera with the given horizontal field of
+    view, for sources without a calibration. Same keys as the RealSense
+    intrinsics published by RealSenseSource.intrinsics().
+    """
+    fx = width / 2 / np.tan(np.radians(hfov) / 2)
+    return {
+        "width": width, "height": height,
+        "fx": float(fx), "fy": float(fx),
+        "ppx": (width - 1) / 2, "ppy": (height - 1) / 2,
+        "model": "none", "coeffs": [0.0] * 5,
+        "estimated": True,
+    }
+
+
+class FrameSource:
+    """
+    Base class of the publisher's frame sources. open() prepares the source,
+    read() blocks until the next frame and returns (color, depth), or None
+    when there is nothing to publish this time. Streams run at their own
+    rates: either element is None when that stream has no new frame.
+    """
+    width, height = DEFAULT_SIZE
+    fps = DEFAULT_COLOR_FPS
+    depth_scale = DEFAULT_DEPTH_SCALE
+
+    def open(self):
+        pass
+
+    def intrinsics(self):
+        """
+        Intrinsics of the depth stream as a dict (width, height, fx, fy, ppx,
+        ppy, model, coeffs), for the resolution the stream was opened at.
+        """
+        return estimated_intrinsics(self.width, self.height)
+
+    def read(self):
+        raise NotImplementedError
+
+    def reconnect(self):
+        """
+        Restarts a source that raised SourceEnded, as cheaply as the source
+        allows. Raises SourceUnavailable if it cannot be restarted.
+        """
+        self.close()
+        self.open()
+
+    def close(self):
+        pass
+
+
+class _Pacer:
+    """Sleeps so that successive frames are 1/fps apart on a fixed schedule."""
+    def __init__(self, fps):
+        self.interval = 1.0 / fps
+        self.next = None
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next is None or now - self.next > self.interval:
+            # First frame, or we fell behind: restart the schedule
+            self.next = now
+        elif self.next > now:
+            time.sleep(self.next - now)
+        self.next += self.interval
+
+
+def connected_serials():
+    """Serial numbers of the connected RealSense devices, sorted."""
+    if rs is None:
+        return []
+    return sorted(device.get_info(rs.camera_info.serial_number) for device in rs.context().devices)
+
+
+class RealSenseSource(FrameSource):
+    """Live Intel RealSense camera: the device with the given serial, or the first one found."""
+    def __init__(self, width=DEFAULT_SIZE[0], height=DEFAULT_SIZE[1],
+                 fps=DEFAULT_COLOR_FPS, depth_fps=DEFAULT_DEPTH_FPS, serial=None):
+        self.serial = serial
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.depth_fps = depth_fps
+        self.pipeline = None
+        self.config = None
+        self.device_serial = None
+        self.profile = None
+        self.filters = []
+        # Last frame number published per stream
+        self.color_number = None
+        self.depth_number = None
+
+    def open(self):
+        if rs is None:
+            raise SourceUnavailable("pyrealsense2 is not installed")
+        # Check for connected RealSense devices
+        serials = connected_serials()
+        if len(serials) == 0:
+            raise SourceUnavailable("No camera detected")
+        if self.serial is not None and self.serial not in serials:
+            raise SourceUnavailable(f"Camera {self.serial} not connected")
+
+        self.pipeline = rs.pipeline()
+        self.config = rs.config()
+        # Pin the device, so a reconnect skips enumeration and gets the same camera
+        self.device_serial = self.serial or serials[0]
+        self.config.enable_device(self.device_serial)
+        # color image stream
+        self.config.enable_stream(rs.stream.color, self.width, self.height, rs.format.bgr8, self.fps)
+        # depth image stream
+        self.config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, self.depth_fps)
+        self._start()
+
+    def _start(self):
+        try:
+            self.profile = self.pipeline.start(self.config)
+        except RuntimeError as e:
+            raise SourceUnavailable(f"Cannot start the camera: {e}")
+        self.depth_scale = self.profile.get_device().first_depth_sensor().get_depth_scale()
+        self.filters = [self._make_filter(name) for name in DEPTH_FILTERS]
+        self.color_number = None
+        self.depth_number = None
+
+    def reconnect(self):
+        # Restart streaming on the existing pipeline and device handle; a
+        # full close() and open() would re-enumerate the USB devices
+        if self.pipeline is None:
+            return super().reconnect()
+        try:
+            self.pipeline.stop()
+        except RuntimeError:
+            pass
+        self._start()
+
+    def intrinsics(self):
+        # Factory calibration of the depth stream, before any decimation
+        stream = self.profile.get_stream(rs.stream.depth).as_video_stream_profile()
+        intr = stream.get_intrinsics()
+        return {
+            "width": intr.width, "height": intr.height,
+            "fx": intr.fx, "fy": intr.fy, "ppx": intr.ppx, "ppy": intr.ppy,
+            "model": str(intr.model).rpartition(".")[2], "coeffs": list(intr.coeffs),
+            "estimated": False,
+        }
+
+    @staticmethod
+    def _make_filter(name):
+        if name == "decimation":
+            decimation = rs.decimation_filter()
+            decimation.set_option(rs.option.filter_magnitude, DECIMATION)
+            return decimation
+        if name == "spatial":
+            return rs.spatial_filter()
+        if name == "temporal":
+            return rs.temporal_filter()
+        raise ValueError(f"Unknown depth filter: {name}")
+
+    def read(self):
+        try:
+            frames = self.pipeline.wait_for_frames(timeout_ms=FRAME_TIMEOUT_MS)
+        except Exception:
+            raise SourceEnded("Camera stopped sending frames")
+
+        # The frameset repeats the newest frame of the slower stream; only
+        # hand out frames whose frame number moved on
+        color = None
+        color_frame = frames.get_color_frame()
+        if color_frame and color_frame.get_frame_number() != self.color_number:
+            self.color_number = color_frame.get_frame_number()
+            color = np.asanyarray(color_frame.get_data())
+
+        depth = None
+        depth_frame = frames.get_depth_frame()
+        if depth_frame and depth_frame.get_frame_number() != self.depth_number:
+            self.depth_number = depth_frame.get_frame_number()
+            for depth_filter in self.filters:
+                depth_frame = depth_filter.process(depth_frame)
+            depth = np.asanyarray(depth_frame.get_data())
+
+        if color is None and depth is None:
+            return None
+        return color, depth
+
+    def close(self):
+        if self.pipeline is not None:
+            try:
+                self.pipeline.stop()
+            except Exception:
+                pass
+            self.pipeline = None
+            self.config = None
+
+
+class SyntheticSource(FrameSource):
+    """
+    Generated test pattern: a scrolling color gradient with a bouncing box,
+    and a tilted depth plane with the box standing out in front of it. Cheap
+    enough to run at full resolution and frame rate on a plain Linux box.
+    """
+    def __init__(self, width=DEFAULT_SIZE[0], height=DEFAULT_SIZE[1], fps=DEFAULT_COLOR_FPS,
+                 depth_fps=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.depth_fps = min(depth_fps or fps, fps)
+        self.pacer = _Pacer(fps)
+        self.frame = 0
+
+        # Precompute the backgrounds once; each frame only scrolls and stamps
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self.background = np.empty((height, width, 3), dtype=np.uint8)
+        self.background[..., 0] = x
+        self.background[..., 1] = y
+        self.background[..., 2] = 128
+        # Floor-like plane from 4 m at the top to 1 m at the bottom (millimetres)
+        self.depth_plane = np.repeat(
+            np.linspace(4000, 1000, height, dtype=np.uint16)[:, None], width, axis=1)
+        self.box = max(min(width, height) // 6, 1)
+
+    def read(self):
+        self.pacer.wait()
+        self.frame += 1
+        color = np.roll(self.background, self.frame * 4, axis=1)
+
+        # Box bouncing between the edges
+        span_x = max(self.width - self.box, 1)
+        span_y = max(self.height - self.box, 1)
+        bx = abs((self.frame * 7) % (2 * span_x) - span_x)
+        by = abs((self.frame * 5) % (2 * span_y) - span_y)
+        color[by:by + self.box, bx:bx + self.box] = (255, 255, 255)
+        cv2.putText(color, str(self.frame), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+
+        # Depth ticks at its own, lower rate, like the camera's depth stream
+        depth = None
+        if int(self.frame * self.depth_fps / self.fps) != int((self.frame - 1) * self.depth_fps / self.fps):
+            depth = self.depth_plane.copy()
+            depth[by:by + self.box, bx:bx + self.box] = 800
+        return color, depth
+
+
+def _load_image(path, depth):
+    if path.endswith(".npy"):
+        return np.load(path)
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED if depth else cv2.IMREAD_COLOR)
+
+
+class ReplaySource(FrameSource):
+    """
+    Replays recorded frames through the publisher as if they were live.
+
+    PATH may be:
+      - a .fdr lossless depth recording (fermia_camera.depthlog), paced by its
+        recorded timestamps; the color stream is black
+      - a video file, paced by its frame rate; the depth stream is empty
+      - a directory of frames, paced at fps: color images (.jpg/.png) and
+        depth frames (16-bit .png or .npy) whose names start with "depth",
+        paired in sorted order
+    """
+    def __init__(self, path, fps=DEFAULT_COLOR_FPS, loop=REPLAY_LOOP):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.playback = None
+        self.capture = None
+        self.frames = None
+
+    def open(self):
+        if not os.path.exists(self.path):
+            raise SourceUnavailable(f"No recording at {self.path}")
+
+        if self.path.endswith(".fdr"):
+            from fermia_camera.depthlog import DepthPlayback
+            self.playback = DepthPlayback(self.path)
+            if not len(self.playback):
+                raise SourceUnavailable(f"{self.path} has no frames")
+            self.width, self.height = self.playback.width, self.playback.height
+            self.fps = (len(self.playback) - 1) / self.playback.duration if self.playback.duration else self.fps
+            self.frames = self.playback.play(realtime=True, loop=self.loop)
+            self.black = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+            self.color_sent = False
+        elif os.path.isdir(self.path):
+            files = sorted(f for f in glob.glob(os.path.join(self.path, "*"))
+                           if f.lower().endswith(IMAGE_EXTENSIONS))
+            depth_files = [f for f in files if os.path.basename(f).startswith("depth")]
+            color_files = [f for f in files if f not in depth_files]
+            if not color_files and not depth_files:
+                raise SourceUnavailable(f"No frames in {self.path}")
+            # Known before the first read, like the other modes: the publisher
+            # sizes its buffers and intrinsics from it
+            first = (_load_image(color_files[0], False) if color_files
+                     else _load_image(depth_files[0], True))
+            if first is None:
+                raise SourceUnavailable(f"Cannot read {(color_files or depth_files)[0]}")
+            self.height, self.width = first.shape[:2]
+            self.frames = self._directory_frames(color_files, depth_files)
+            self.pacer = _Pacer(self.fps)
+        else:
+            self.capture = cv2.VideoCapture(self.path)
+            if not self.capture.isOpened():
+                raise SourceUnavailable(f"Cannot open {self.path}")
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS) or self.fps
+            self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.pacer = _Pacer(self.fps)
+            self.depth_sent = False
+
+    def _directory_frames(self, color_files, depth_files):
+        count = max(len(color_files), len(depth_files))
+        first = True
+        while first or self.loop:
+            first = False
+            for i in range(count):
+                color = _load_image(color_files[i % len(color_files)], False) if color_files else None
+                depth = _load_image(depth_files[i % len(depth_files)], True) if depth_files else None
+                if color is None and depth is not None:
+                    color = np.zeros(depth.shape[:2] + (3,), dtype=np.uint8)
+                if depth is None and color is not None:
+                    depth = np.zeros(color.shape[:2], dtype=np.uint16)
+                if color is None:
+                    continue
+                if depth.shape[:2] != color.shape[:2]:
+                    depth = cv2.resize(depth, (color.shape[1], color.shape[0]),
+                                       interpolation=cv2.INTER_NEAREST)
+                self.height, self.width = color.shape[:2]
+                yield color, depth.astype(np.uint16, copy=False)
+
+    def read(self):
+        if self.capture is not None:
+            self.pacer.wait()
+            ok, color = self.capture.read()
+            if not ok:
+                if not self.loop:
+                    raise SourceEnded(f"End of {self.path}")
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, color = self.capture.read()
+                if not ok:
+                    raise SourceEnded(f"Cannot read {self.path}")
+            # The empty depth frame never changes: publish it once
+            depth = None
+            if not self.depth_sent:
+                depth = np.zeros(color.shape[:2], dtype=np.uint16)
+                self.depth_sent = True
+            return color, depth
+
+        if self.playback is None:
+            self.pacer.wait()
+        try:
+            frame = next(self.frames)
+        except StopIteration:
+            raise SourceEnded(f"End of {self.path}")
+        if self.playback is not None:
+            _, _, depth = frame
+            # The black color frame never changes: publish it once
+            color = None if self.color_sent else self.black
+            self.color_sent = True
+            return color, depth
+        return frame
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+        if self.playback is not None:
+            self.frames = None
+            self.playback.close()
+            self.playback = None
+
+
+def _parse_size(spec):
+    """
+    Parses "WIDTHxHEIGHT[@FPS[/DEPTH_FPS]]" into
+    (width, height, fps or None, depth fps or None).
+    """
+    size, _, rates = spec.partition("@")
+    fps, _, depth_fps = rates.partition("/")
+    width, _, height = size.lower().partition("x")
+    return (int(width), int(height),
+            float(fps) if fps else None, float(depth_fps) if depth_fps else None)
+
+
+def make_source(spec=None, serial=None):
+    """
+    Creates the frame source described by spec (default: FERMIA_SOURCE).
+    Args:
+        serial (str): RealSense device to open, None for the first one.
+    Returns:
+        FrameSource: The unopened source.
+    """
+    spec = spec or SOURCE
+    kind, _, arg = spec.partition(":")
+    if kind == "realsense":
+        return RealSenseSource(serial=serial)
+    if kind == "synthetic":
+        if not arg:
+            return SyntheticSource()
+        width, height, fps, depth_fps = _parse_size(arg)
+        return SyntheticSource(width, height, fps or DEFAULT_COLOR_FPS, depth_fps)
+    if kind == "replay":
+        return ReplaySource(arg)
+    raise ValueError(f"Unknown frame source: {spec}")
@@ -0,0 +1,131 @@
+import json
+import time
+
+import cv2
+
+from fermia_camera.cameras import camera_key
+
+# Named substreams: downscaled and/or cropped views of the color or depth
+# stream, produced once by the publisher for every consumer that wants them.
+#
+# Consumers describe what they need in the Redis hash SUBSTREAMS_KEY
+# (name -> JSON spec, see substream_spec()). The publisher re-reads the hash
+# about once a second and stores each substream frame next to the full one:
+#
+#   camera_feed:<name>   JPEG color substream
+#   depth_feed:<name>    raw z16 depth substream
+#
+# with the usual binary frame header, so the readers parse them like the full
+# frames. Specs carry an expiry time; consumers that stop renewing them stop
+# costing the publisher anything. Other cameras than the default one keep
+# both the hash and the frames under their own keys (camera_key()).
+SUBSTREAMS_KEY = "fermia_substreams"
+
+FEED_KEYS = {
+    "color": "camera_feed",
+    "depth": "depth_feed",
+}
+
+
+def feed_key(stream, name=None, camera=None):
+    """Redis key of a stream ("color" or "depth"), or of one of its substreams."""
+    key = FEED_KEYS[stream] if name is None else f"{FEED_KEYS[stream]}:{name}"
+    return camera_key(key, camera)
+
+
+def substream_spec(stream="color", width=None, height=None, roi=None, quality=None, ttl=None):
+    """
+    Builds a substream spec.
+
+    Args:
+        stream (str): "color" or "depth".
+        width (int), height (int): Output size. Given only one, the other
+        follows the aspect ratio of the (cropped) frame.
+        roi (tuple): (x, y, w, h) crop in full-frame pixels, applied first.
+        quality (int): JPEG quality of color substreams.
+        ttl (float): Seconds until the spec expires, None keeps it forever.
+    Returns:
+        dict: The spec, ready for define_substream().
+    Raises:
+        ValueError: If the options are invalid.
+    """
+    if stream not in FEED_KEYS:
+        raise ValueError(f"Unknown stream: {stream}")
+    if roi is not None:
+        roi = [int(v) for v in roi]
+        if len(roi) != 4 or roi[2] <= 0 or roi[3] <= 0:
+            raise ValueError("roi must be (x, y, w, h) with a positive size")
+    for name, value in (("width", width), ("height", height)):
+        if value is not None and int(value) <= 0:
+            raise ValueError(f"{name} must be positive")
+    if quality is not None and not 1 <= int(quality) <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    return {
+        "stream": stream,
+        "width": int(width) if width is not None else None,
+        "height": int(height) if height is not None else None,
+        "roi": roi,
+        "quality": int(quality) if quality is not None else None,
+        "expires": time.time() + ttl if ttl is not None else None,
+    }
+
+
+def load_substreams(redis_client, camera=None):
+    """
+    Reads the live substream specs, dropping expired ones from the hash.
+    Returns:
+        dict: {name: spec}
+    """
+    key = camera_key(SUBSTREAMS_KEY, camera)
+    now = time.time()
+    specs = {}
+    expired = []
+    for name, raw in redis_client.hgetall(key).items():
+        try:
+            spec = json.loads(raw)
+        except ValueError:
+            expired.append(name)
+            continue
+        if spec.get("expires") is not None and spec["expires"] < now:
+            expired.append(name)
+            continue
+        specs[name.decode()] = spec
+    if expired:
+        redis_client.hdel(key, *expired)
+    return specs
+
+
+def _output_size(spec, width, height):
+    out_w, out_h = spec.get("width"), spec.get("height")
+    if out_w is None and out_h is None:
+        return width, height
+    if out_w is None:
+        out_w = max(round(width * out_h / height), 1)
+    if out_h is None:
+        out_h = max(round(height * out_w / width), 1)
+    return out_w, out_h
+
+
+def render(spec, frame):
+    """
+    Crops and scales a full frame (color image or depth array) to a
+    substream spec. Depth is scaled with nearest-neighbour so no invented
+    distances appear at object edges.
+    """
+    roi = spec.get("roi")
+    if roi is not None:
+        x, y, w, h = roi
+        x = min(max(x, 0), frame.shape[1] - 1)
+        y = min(max(y, 0), frame.shape[0] - 1)
+        frame = frame[y:y + h, x:x + w]
+    height, width = frame.shape[:2]
+    size = _output_size(spec, width, height)
+    if size == (width, height):
+        return frame
+    if spec["stream"] == "depth":
+        interpolation = cv2.INTER_NEAREST
+    elif size[0] < width:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_LINEAR
+    return cv2.resize(frame, size, interpolation=interpolation)
@@ -7,10 +7,13 @@ setup(
     install_requires=[
         "numpy",
         "opencv-python",
-        "redis",
-        "pyrealsense2"
+        "redis>=4.2",  # redis.asyncio
     ],  # Dependencies
-    python_requires=">=3.6",
+    extras_require={
+        # RealSense capture; synthetic and replay sources work without it
+        "realsense": ["pyrealsense2"],
+    },
+    python_requires=">=3.8",  # multiprocessing.shared_memory
     author="Aryan Senthil",
     author_email="aryanyaminisenthil@gmail.com",
     description="A package for managing camera feeds using Redis",
@@ -128,29 +128,29 @@ def depth_feed() -> str:
     
     # Check if the RealSense camera is connected 
     if not is_realsense_connected():
-        stop_process_on_port(5001)
+        stop_process_on_port(5000)
         return "No Camera Detected."
     
-    # Camera is detected, check if stream is already running 
-    result = subprocess.run(["lsof", "-t", "-i:5001"], 
+    # The depth stream is served by the same stream process as the camera feed
+    result = subprocess.run(["lsof", "-t", "-i:5000"], 
                             capture_output=True, text=True)
     
     if not result.stdout:
         # Stream is not running, start it 
         script_dir = os.path.dirname(os.path.abspath(__file__))
-        depth_stream_script = os.path.join(script_dir, "depth_stream.sh")
+        camera_stream_script = os.path.join(script_dir, "camera_stream.sh")
 
         # Make sure the script is executable 
-        subprocess.run(["chmod", "+x", depth_stream_script], check=False)
+        subprocess.run(["chmod", "+x", camera_stream_script], check=False)
 
-        # Start the depth stream in the background 
-        subprocess.Popen([depth_stream_script],
+        # Start the stream in the background 
+        subprocess.Popen([camera_stream_script],
                          stdout=subprocess.PIPE, 
                          stderr=subprocess.PIPE)
         
         # Give it a moment to start 
         time.sleep(2) 
-    return f"[Click here](http://{device_ip}:5001)"
+    return f"[Click here](http://{device_ip}:5000/view/depth)"
 
 
 
@@ -235,6 +235,24 @@ def vision_model(prompt: str) -> str:
     return response
 
 
+@tool
+def depth_sensing(region: Literal["center", "left", "right", "top", "bottom", "full"] = "center") -> str:
+    """
+    Measures distances with the depth camera: how far away things are in a region of the view
+    and where the nearest obstacle is. Much faster than the vision model; use it for
+    "how far", "how close" and "is anything in front" questions.
+
+    Args:
+        region (str): Part of the view to measure: "center" (straight ahead), "left", "right",
+            "top", "bottom" or "full".
+
+    Returns:
+        str: Distances in metres.
+    """
+    from fermia_camera.depth import describe_region
+    return describe_region(region)
+
+
 @tool
 def move_servo(motor: int, target_angle: float, speed: Optional[Literal["low", "medium", "high"]] = None) -> str:
     """
@@ -367,7 +385,7 @@ llm = ChatOllama(
 
 # Set up available tools
 tools = [
-    camera_feed, depth_feed, vision_model, photos_feed, 
+    camera_feed, depth_feed, vision_model, depth_sensing, photos_feed, 
     motor_control_interface_app, move_servo, set_default_angle, 
     set_default_speed, initialize_all_servos, initialize_servo_to_default, 
     get_motor_info
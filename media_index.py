@@ -0,0 +1,446 @@
+# media_index.py
+# Persistent index of the photos and videos served by photos_app, so listing
+# the gallery is a query on SQLite instead of a listdir plus a stat of every
+# file in the archive on every page view.
+#
+# Change detection is by directory mtime: creating, deleting or renaming a
+# file bumps the mtime of its directory, so a sync that finds the directory
+# unchanged costs one stat. Files that were still being written at the last
+# sync (recordings grow without touching the directory) are kept on a short
+# "unsettled" list and re-stated until they stop changing.
+#
+# Dimensions and durations are probed by a background thread after a file is
+# indexed; rows read before that simply have them as None.
+import base64
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov")
+DEPTH_EXTENSIONS = (".fdr",)
+
+# Minimum seconds between two syncs of the same directory
+SYNC_INTERVAL = float(os.environ.get("FERMIA_INDEX_SYNC_INTERVAL", "1.0"))
+
+# Files modified this recently are re-stated on every sync
+SETTLE_SECONDS = 10.0
+
+# Largest page query() returns
+MAX_PAGE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    duration REAL,
+    probed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS media_by_mtime ON media (kind, mtime_ns DESC, name DESC);
+CREATE INDEX IF NOT EXISTS media_by_time ON media (mtime_ns DESC, name DESC, kind DESC);
+CREATE TABLE IF NOT EXISTS directories (
+    kind TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+-- Bumped by every change to the media table; clients revalidate against it
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0);
+"""
+
+
+def _jpeg_size(f):
+    """Reads width and height from the SOF segment of a JPEG."""
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack(">H", length)[0]
+        # SOF0..SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _png_size(f):
+    """Reads width and height from the IHDR chunk of a PNG."""
+    header = f.read(24)
+    if len(header) < 24 or header[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def probe_media(path):
+    """
+    Retrieves the dimensions and, for videos and depth recordings, the
+    duration of a media file, reading as little of it as possible.
+    Returns:
+        tuple: (width, height, duration); any of them None if unknown.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in VIDEO_EXTENSIONS:
+        capture = cv2.VideoCapture(path)
+        try:
+            if not capture.isOpened():
+                return None, None, None
+            width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+            height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            frames = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+            duration = frames / fps if fps > 0 and frames > 0 else None
+            return width, height, duration
+        finally:
+            capture.release()
+    if extension in DEPTH_EXTENSIONS:
+        try:
+            from fermia_camera.depthlog import DepthPlayback
+        except ImportError:
+            return None, None, None
+        with DepthPlayback(path) as playback:
+            return playback.width, playback.height, playback.duration
+
+    with open(path, "rb") as f:
+        size = _jpeg_size(f)
+        if size is None:
+            f.seek(0)
+            size = _png_size(f)
+    if size is None:
+        # Anything else: decode it at an eighth of the scale
+        img = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+        if img is None:
+            return None, None, None
+        size = (img.shape[1] * 8, img.shape[0] * 8)
+    return size[0], size[1], None
+
+
+def encode_cursor(mtime_ns, name, kind):
+    """Opaque pagination cursor for the file with this sort key."""
+    raw = json.dumps([mtime_ns, name, kind], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(). Raises ValueError if the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        mtime_ns, name, kind = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(mtime_ns, int) or not isinstance(name, str) or not isinstance(kind, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return mtime_ns, name, kind
+
+
+class MediaIndex:
+    """
+    SQLite index of the files in a few media directories.
+
+    Args:
+        db_path (str): Database file; created if missing.
+        directories (dict): Kind ("photos", "videos") to directory path.
+    """
+    def __init__(self, db_path, directories):
+        self.db_path = db_path
+        self.directories = dict(directories)
+        self.local = threading.local()
+        self.sync_lock = threading.Lock()
+        self.last_sync = {}
+        # (kind, name) -> (size, mtime_ns) of files that may still be growing
+        self.unsettled = {}
+        self.probe_event = threading.Event()
+        self.prober = None
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.executescript(SCHEMA)
+        db.commit()
+
+    def _db(self):
+        # sqlite3 connections cannot be shared between threads; one per thread
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10.0)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def sync(self, kind=None, force=False):
+        """
+        Brings the index up to date with the directories, rescanning only
+        the ones whose mtime changed since the last sync.
+        Args:
+            kind (str): Sync only this kind, or all of them if None.
+            force (bool): Rescan even if the directory looks unchanged.
+        Returns:
+            int: Number of rows added, updated or removed.
+        """
+        kinds = [kind] if kind is not None else list(self.directories)
+        changes = 0
+        with self.sync_lock:
+            for kind in kinds:
+                now = time.monotonic()
+                if not force and now - self.last_sync.get(kind, -SYNC_INTERVAL) < SYNC_INTERVAL:
+                    continue
+                # The first sync of a process rescans, to pick up files still being written
+                first = kind not in self.last_sync
+                self.last_sync[kind] = now
+                changes += self._sync_directory(kind, force or first)
+        # Also on the first sync, for files an earlier process left unprobed
+        if changes or self.prober is None:
+            self._ensure_prober()
+            self.probe_event.set()
+        return changes
+
+    def _sync_directory(self, kind, force):
+        db = self._db()
+        directory = self.directories[kind]
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            # Directory gone: nothing in it can be listed
+            cursor = db.execute("DELETE FROM media WHERE kind = ?", (kind,))
+            db.execute("DELETE FROM directories WHERE kind = ?", (kind,))
+            if cursor.rowcount:
+                self._bump(db)
+            db.commit()
+            return cursor.rowcount
+
+        row = db.execute("SELECT path, mtime_ns FROM directories WHERE kind = ?", (kind,)).fetchone()
+        if not force and row is not None and row["path"] == directory and row["mtime_ns"] == dir_mtime:
+            return self._restat_unsettled(kind)
+
+        indexed = {r["name"]: (r["size"], r["mtime_ns"])
+                   for r in db.execute("SELECT name, size, mtime_ns FROM media WHERE kind = ?", (kind,))}
+        seen = set()
+        upserts = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stats = entry.stat()
+                except OSError:
+                    continue
+                seen.add(entry.name)
+                current = (stats.st_size, stats.st_mtime_ns)
+                if indexed.get(entry.name) != current:
+                    upserts.append((kind, entry.name) + current)
+                self._track(kind, entry.name, current)
+        removed = [(kind, name) for name in indexed if name not in seen]
+        for key in removed:
+            self.unsettled.pop(key, None)
+
+        self._upsert(db, upserts)
+        db.executemany("DELETE FROM media WHERE kind = ? AND name = ?", removed)
+        if upserts or removed:
+            self._bump(db)
+        # A directory changed within the last second may change again without
+        # its mtime moving (coarse timestamps); rescan it next time
+        if time.time() - dir_mtime / 1e9 < 1.0:
+            dir_mtime = 0
+        db.execute("INSERT OR REPLACE INTO directories (kind, path, mtime_ns) VALUES (?, ?, ?)",
+                   (kind, directory, dir_mtime))
+        db.commit()
+        return len(upserts) + len(removed)
+
+    def _track(self, kind, name, current):
+        """Remember files modified recently enough that they may still be written to."""
+        if time.time() - current[1] / 1e9 < SETTLE_SECONDS:
+            self.unsettled[(kind, name)] = current
+        else:
+            self.unsettled.pop((kind, name), None)
+
+    def _restat_unsettled(self, kind):
+        db = self._db()
+        upserts = []
+        for key, previous in list(self.unsettled.items()):
+            if key[0] != kind:
+                continue
+            try:
+                stats = os.stat(os.path.join(self.directories[kind], key[1]))
+            except OSError:
+                # Removed; the directory mtime changes too and the next sync drops it
+                self.unsettled.pop(key, None)
+                continue
+            current = (stats.st_size, stats.st_mtime_ns)
+            if current != previous:
+                upserts.append(key + current)
+            self._track(kind, key[1], current)
+        if upserts:
+            self._upsert(db, upserts)
+            self._bump(db)
+            db.commit()
+        return len(upserts)
+
+    def _bump(self, db):
+        db.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+
+    def generation(self):
+        """Counter that changes whenever anything in the index does."""
+        return self._db().execute("SELECT value FROM generation WHERE id = 0").fetchone()[0]
+
+    def _upsert(self, db, rows):
+        # A changed file has to be probed again
+        db.executemany(
+            "INSERT INTO media (kind, name, size, mtime_ns) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (kind, name) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+            "width = NULL, height = NULL, duration = NULL, probed = 0",
+            rows)
+
+    def _ensure_prober(self):
+        if self.prober is None:
+            self.prober = threading.Thread(target=self._probe_loop, daemon=True)
+            self.prober.start()
+
+    def _probe_loop(self):
+        while True:
+            self.probe_event.wait()
+            self.probe_event.clear()
+            try:
+                while self.probe_pending(limit=32):
+                    pass
+            except sqlite3.Error as e:
+                print(f"Media probe failed: {e}")
+
+    def probe_pending(self, limit=32):
+        """
+        Fills in dimensions and durations of up to `limit` files not probed yet.
+        Returns:
+            int: Number of files probed.
+        """
+        db = self._db()
+        rows = db.execute("SELECT kind, name, size, mtime_ns FROM media WHERE probed = 0 "
+                          "ORDER BY mtime_ns DESC LIMIT ?", (limit,)).fetchall()
+        updated = 0
+        for row in rows:
+            path = os.path.join(self.directories[row["kind"]], row["name"])
+            try:
+                width, height, duration = probe_media(path)
+            except Exception as e:
+                print(f"Could not probe {path}: {e}")
+                width = height = duration = None
+            # Only if the file did not change meanwhile
+            updated += db.execute("UPDATE media SET width = ?, height = ?, duration = ?, probed = 1 "
+                       "WHERE kind = ? AND name = ? AND size = ? AND mtime_ns = ?",
+                       (width, height, duration, row["kind"], row["name"], row["size"], row["mtime_ns"])).rowcount
+        if updated:
+            self._bump(db)
+        db.commit()
+        return len(rows)
+
+    def _info(self, row):
+        path = os.path.join(self.directories[row["kind"]], row["name"])
+        return {
+            'type': row["kind"],
+            'name': row["name"],
+            'date': datetime.fromtimestamp(row["mtime_ns"] / 1e9).strftime('%Y-%m-%d %H:%M:%S'),
+            'size': f"{row['size'] / (1024 * 1024):.2f} MB",
+            'path': path,
+            'version': f"{row['mtime_ns']}-{row['size']}",
+            'mtime': row["mtime_ns"] / 1e9,
+            'bytes': row["size"],
+            'width': row["width"],
+            'height': row["height"],
+            'duration': row["duration"],
+        }
+
+    def query(self, kind=None, limit=None, after=None, since=None, until=None, prefix=None,
+              oldest_first=False):
+        """
+        Retrieves indexed files newest first, one page at a time. Pages are
+        cut by keyset (the sort key of the last file of the previous page),
+        so a page costs the same however deep into the archive it is, and
+        files added meanwhile do not shift later pages.
+        Args:
+            kind (str): "photos" or "videos", or None for both.
+            limit (int): Page size (at most MAX_PAGE), or None for all files.
+            after (str): Cursor returned with the previous page.
+            since (float), until (float): Only files modified in [since, until) (Unix time).
+            prefix (str): Only files whose name starts with this.
+            oldest_first (bool): Reverse the order.
+        Returns:
+            tuple: (list of file info dicts, cursor of the next page or None).
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        kinds = [kind] if kind is not None else list(self.directories)
+        for k in kinds:
+            self.sync(k)
+        where = [f"kind IN ({', '.join('?' * len(kinds))})"]
+        params = list(kinds)
+        if after:
+            where.append(f"(mtime_ns, name, kind) {'>' if oldest_first else '<'} (?, ?, ?)")
+            params.extend(decode_cursor(after))
+        if since is not None:
+            where.append("mtime_ns >= ?")
+            params.append(int(since * 1e9))
+        if until is not None:
+            where.append("mtime_ns < ?")
+            params.append(int(until * 1e9))
+        if prefix:
+            where.append("substr(name, 1, ?) = ?")
+            params.extend([len(prefix), prefix])
+        limit = None if limit is None else max(1, min(limit, MAX_PAGE))
+        # One extra row tells whether there is a next page
+        params.append(-1 if limit is None else limit + 1)
+        order = "ASC" if oldest_first else "DESC"
+        rows = self._db().execute(
+            f"SELECT * FROM media WHERE {' AND '.join(where)} "
+            f"ORDER BY mtime_ns {order}, name {order}, kind {order} LIMIT ?", params).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last["mtime_ns"], last["name"], last["kind"])
+        return [self._info(row) for row in rows], next_cursor
+
+    def iterate(self, kind=None, **filters):
+        """
+        Yields every indexed file matching the filters of query(), a page
+        at a time, so memory stays flat however many files match.
+        """
+        after = None
+        while True:
+            items, after = self.query(kind, MAX_PAGE, after, **filters)
+            yield from items
+            if after is None:
+                return
+
+    def total_bytes(self, kind=None):
+        """Combined size of the indexed files of one kind, or of all of them."""
+        kinds = [kind] if kind is not None else list(self.directories)
+        for k in kinds:
+            self.sync(k)
+        return self._db().execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM media WHERE kind IN ({', '.join('?' * len(kinds))})",
+            kinds).fetchone()[0]
+
+    def count(self, kind):
+        """Number of indexed files of one kind."""
+        self.sync(kind)
+        return self._db().execute("SELECT COUNT(*) FROM media WHERE kind = ?", (kind,)).fetchone()[0]
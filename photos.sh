@@ -15,4 +15,4 @@ fi
 
 # Start the server with Uvicorn on port 5003
 echo "Starting the photos app on port 5003..."
-gunicorn --bind 0.0.0.0:5003 --worker-class=gthread --threads=4 --workers=1 photos_app:app
\ No newline at end of file
+gunicorn --bind 0.0.0.0:5003 --worker-class=gthread --threads=8 --workers=1 photos_app:app
\ No newline at end of file
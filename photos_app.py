@@ -1,14 +1,48 @@
-from flask import Flask, render_template, send_from_directory, request, jsonify
+from flask import Flask, Response, render_template, send_file, request, jsonify, abort, url_for
+from werkzeug.security import safe_join
 import os
 import socket
 import mimetypes
 from datetime import datetime
 
+from media_index import MediaIndex
+from archive import ZipStream, RetentionSweeper, delete_files
+from transfers import send_media, acquire_transfer_slot, too_many_transfers, transfer_slots
+from transcode import Transcoder
+from thumbnails import ThumbnailCache, FORMATS as THUMB_FORMATS, snap_width
+
 app = Flask(__name__)
 
 # Configure directories
 PHOTOS_DIR = "/home/arisenthil/fermia/photos"
 VIDEOS_DIR = "/home/arisenthil/fermia/videos"
+THUMBS_DIR = os.environ.get("FERMIA_THUMBS_DIR", "/home/arisenthil/fermia/thumbs")
+MEDIA_INDEX_PATH = os.environ.get("FERMIA_MEDIA_INDEX", "/home/arisenthil/fermia/media_index.db")
+TRANSCODE_DIR = os.environ.get("FERMIA_TRANSCODE_DIR", "/home/arisenthil/fermia/transcoded")
+
+MEDIA_DIRS = {"photos": PHOTOS_DIR, "videos": VIDEOS_DIR}
+
+# Thumbnail URLs carry the source version (?v=), so browsers may keep them forever
+THUMB_CACHE_SECONDS = 365 * 24 * 3600
+
+# Files per page of the gallery; further pages are fetched from /api/media on scroll
+PAGE_SIZE = int(os.environ.get("FERMIA_GALLERY_PAGE", "48"))
+
+# Retention policy: files older than this many days, and the oldest files
+# while the archive is larger than this many GB, are deleted. Unset: keep all.
+RETENTION_DAYS = os.environ.get("FERMIA_RETENTION_DAYS")
+RETENTION_GB = os.environ.get("FERMIA_RETENTION_GB")
+
+thumbnail_cache = ThumbnailCache(THUMBS_DIR)
+media_index = MediaIndex(MEDIA_INDEX_PATH, MEDIA_DIRS)
+transcoder = Transcoder(TRANSCODE_DIR)
+
+if RETENTION_DAYS or RETENTION_GB:
+    retention = RetentionSweeper(
+        media_index,
+        max_age=float(RETENTION_DAYS) * 86400 if RETENTION_DAYS else None,
+        max_bytes=int(float(RETENTION_GB) * 1e9) if RETENTION_GB else None)
+    retention.start()
 
 # Ensure correct MIME types are registered
 mimetypes.add_type('video/mp4', '.mp4')
@@ -16,53 +50,129 @@ mimetypes.add_type('video/x-msvideo', '.avi')  # Correct MIME type for AVI
 mimetypes.add_type('video/avi', '.avi')  # Fallback MIME type for AVI
 mimetypes.add_type('image/jpeg', '.jpg')
 
-def get_file_info(file_path):
-    """Get file information including creation time and size."""
-    stats = os.stat(file_path)
-    creation_time = datetime.fromtimestamp(stats.st_mtime)
-    size_mb = stats.st_size / (1024 * 1024)  # Convert to MB
-    
-    return {
-        'name': os.path.basename(file_path),
-        'date': creation_time.strftime('%Y-%m-%d %H:%M:%S'),
-        'size': f"{size_mb:.2f} MB",
-        'path': file_path
-    }
-
-def get_media_files(directory):
-    """Get all media files from directory with their info."""
-    files = []
-    if os.path.exists(directory):
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            if os.path.isfile(file_path):
-                files.append(get_file_info(file_path))
-    
-    # Sort by date (newest first)
-    files.sort(key=lambda x: x['date'], reverse=True)
-    return files
+def get_media_files(kind=None, limit=None, after=None, **filters):
+    """
+    Get media files from the index, newest first.
+    Args:
+        kind (str): "photos" or "videos", or None for both.
+        limit (int): Page size, or None for all files.
+        after (str): Cursor of the page to continue from.
+        filters: since, until (Unix time) and prefix, see MediaIndex.query().
+    Returns:
+        tuple: (list of file info dicts, cursor of the next page or None).
+    """
+    return media_index.query(kind, limit, after, **filters)
+
+def parse_time(value):
+    """Parse a Unix timestamp or an ISO 8601 date/time into Unix time."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def media_ref_path(ref):
+    """Path of a file given as "photos/<name>" or "videos/<name>", or None if there is no such file."""
+    kind, _, name = str(ref).partition('/')
+    if kind not in MEDIA_DIRS or not name:
+        return None
+    path = safe_join(MEDIA_DIRS[kind], name)
+    return path if path is not None and os.path.isfile(path) else None
+
+def selected_media(require_selection=False, json_only=False):
+    """
+    Files a bulk request applies to, given either as a "files" list of
+    "photos/<name>" and "videos/<name>" (JSON body, or repeated ?file=), or
+    by the type, since, until and prefix filters of /api/media.
+    Args:
+        require_selection (bool): Refuse a request that selects everything.
+        json_only (bool): Ignore the query string, taking the selection from
+        the JSON body alone.
+    Returns:
+        tuple: (iterable of ("kind/name", path) pairs, produced lazily, and
+        the list of requested files that do not exist).
+    Raises:
+        ValueError: On a malformed body or filters, or no selection when one
+        is required.
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object")
+    args = {} if json_only else request.args
+    files = body.get('files') or (None if json_only else request.args.getlist('file'))
+    if files:
+        if not isinstance(files, list) or not all(isinstance(ref, str) for ref in files):
+            raise ValueError('"files" must be a list of "photos/<name>" or "videos/<name>"')
+        # Each file once, however often (or however spelled) it was asked for
+        selected, missing = {}, []
+        for ref in dict.fromkeys(files):
+            path = media_ref_path(ref)
+            if path is None:
+                missing.append(ref)
+            else:
+                selected.setdefault(path, ref)
+        return [(ref, path) for path, ref in selected.items()], missing
+
+    def arg(name):
+        return body.get(name, args.get(name))
+
+    media_type = arg('type') or 'all'
+    if media_type not in ('photos', 'videos', 'all'):
+        raise ValueError(f"Unknown type: {media_type}")
+    filters = {'since': parse_time(arg('since')), 'until': parse_time(arg('until')),
+               'prefix': arg('prefix') or None}
+    if require_selection and not any(value is not None for value in filters.values()):
+        raise ValueError("Select files, or a date range or name prefix")
+    kind = None if media_type == 'all' else media_type
+    entries = ((f"{item['type']}/{item['name']}", item['path'])
+               for item in media_index.iterate(kind, **filters))
+    return entries, []
 
 @app.route('/')
 def index():  
     """Main page showing photos and videos."""
-    photos = get_media_files(PHOTOS_DIR)
-    videos = get_media_files(VIDEOS_DIR)
+    photos, photos_next = get_media_files('photos', PAGE_SIZE)
+    videos, videos_next = get_media_files('videos', PAGE_SIZE)
+
+    # Render the thumbnails the page is about to ask for in the background
+    thumbnail_cache.warm(item['path'] for item in photos + videos)
     
     return render_template('media_index.html', 
                           photos=photos, 
                           videos=videos,
+                          photos_next=photos_next,
+                          videos_next=videos_next,
+                          photo_count=media_index.count('photos'),
+                          video_count=media_index.count('videos'),
+                          page_size=PAGE_SIZE,
                           title="Fermia Media Gallery")
 
+def media_path(kind, filename):
+    """Path of a file in one of the media directories; aborts with 404 if there is none."""
+    path = safe_join(MEDIA_DIRS[kind], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return path
+
 @app.route('/photos/<path:filename>')
 def serve_photo(filename):
     """Serve photo files."""
-    return send_from_directory(PHOTOS_DIR, filename)
+    return send_media(media_path('photos', filename))
 
 @app.route('/videos/<path:filename>')
 def serve_video(filename):
-    """Serve video files with the correct MIME type."""
-    file_path = os.path.join(VIDEOS_DIR, filename)
-    
+    """
+    Serve video files with the correct MIME type, seekable through byte ranges.
+    Once a browser-playable copy was transcoded, that copy is served instead,
+    unless ?original=1 asks for the recorded file.
+    """
+    path = media_path('videos', filename)
+    if not request.args.get('original'):
+        variant = transcoder.ready(path)
+        if variant is not None:
+            return send_media(variant, 'video/mp4')
+
     # Determine MIME type based on file extension
     extension = os.path.splitext(filename)[1].lower()
     if extension == '.mp4':
@@ -70,26 +180,149 @@ def serve_video(filename):
     elif extension == '.avi':
         mimetype = 'video/x-msvideo'
     else:
-        # Let Flask guess the MIME type as a fallback
+        # Guess the MIME type as a fallback
         mimetype = None
         
-    return send_from_directory(VIDEOS_DIR, filename, mimetype=mimetype)
+    return send_media(path, mimetype)
+
+@app.route('/api/transcode/<path:filename>', methods=['GET', 'POST'])
+def transcode_video(filename):
+    """
+    Report (GET) or request (POST) the browser-playable copy of a video.
+    Returns the transcoder status ("original", "ready", "queued", "running",
+    "failed", "busy", "none" or "unavailable") with progress from 0 to 1,
+    and the URL to play.
+    """
+    path = media_path('videos', filename)
+    if request.method == 'POST':
+        status = transcoder.request(path)
+    else:
+        status = transcoder.status(path)
+    status['url'] = url_for('serve_video', filename=filename)
+    return jsonify(status), 202 if status['state'] in ('queued', 'running') else 200
+
+@app.route('/thumbs/<any(photos, videos):kind>/<path:filename>')
+def serve_thumbnail(kind, filename):
+    """Serve a small JPEG or WebP preview of a photo, or a poster frame of a video."""
+    source = safe_join(MEDIA_DIRS[kind], filename)
+    if source is None or not os.path.isfile(source):
+        abort(404)
+
+    width = snap_width(request.args.get('w', type=int))
+    # WebP for browsers that accept it, unless ?format= asks otherwise
+    fmt = request.args.get('format')
+    if fmt not in THUMB_FORMATS:
+        fmt = "webp" if "image/webp" in request.headers.get('Accept', '') else "jpeg"
+
+    path = thumbnail_cache.get(source, width, fmt)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=THUMB_FORMATS[fmt]["mimetype"], conditional=True, etag=True)
+    response.headers['Cache-Control'] = f"public, max-age={THUMB_CACHE_SECONDS}, immutable"
+    response.vary.add('Accept')
+    return response
 
 @app.route('/api/media')
 def get_all_media():
-    """API endpoint to get all media files."""
+    """
+    API endpoint listing media files, newest first (by modification time).
+
+    Query parameters:
+        type: photos, videos or all (default).
+        limit, after: Page size and the cursor returned as "next" by the
+            previous page. With either, the response is {"items": [...],
+            "next": cursor or null}; without, the full lists as before.
+        since, until: Only files modified in [since, until), as Unix time
+            or ISO 8601.
+        prefix: Only files whose name starts with this.
+
+    Responses carry a weak ETag that changes with the index, so polling
+    with If-None-Match costs a 304 while nothing changed.
+    """
     media_type = request.args.get('type', 'all')
-    
-    if media_type == 'photos':
-        return jsonify(get_media_files(PHOTOS_DIR))
-    elif media_type == 'videos':
-        return jsonify(get_media_files(VIDEOS_DIR))
+    if media_type not in ('photos', 'videos', 'all'):
+        return jsonify({'error': f"Unknown type: {media_type}"}), 400
+    kind = None if media_type == 'all' else media_type
+    try:
+        filters = {
+            'since': parse_time(request.args.get('since')),
+            'until': parse_time(request.args.get('until')),
+            'prefix': request.args.get('prefix') or None,
+        }
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('after') or None
+        paged = limit is not None or after is not None
+        if paged and limit is None:
+            limit = PAGE_SIZE
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Answer an unchanged poll before running the query
+    media_index.sync()
+    etag = f"media-{media_index.generation()}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
     else:
-        # Return both photos and videos
-        return jsonify({
-            'photos': get_media_files(PHOTOS_DIR),
-            'videos': get_media_files(VIDEOS_DIR)
-        })
+        try:
+            if paged:
+                items, next_cursor = get_media_files(kind, limit, after, **filters)
+                body = {'items': items, 'next': next_cursor}
+            elif kind is not None:
+                body = get_media_files(kind, **filters)[0]
+            else:
+                # Return both photos and videos
+                body = {
+                    'photos': get_media_files('photos', **filters)[0],
+                    'videos': get_media_files('videos', **filters)[0]
+                }
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify(body)
+    response.set_etag(etag, weak=True)
+    # Cached, but revalidated on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/archive', methods=['GET', 'POST'])
+def download_archive():
+    """
+    Stream a ZIP of the selected files (see selected_media(); no selection
+    means everything) while it is built, without staging it on disk.
+    """
+    try:
+        entries, _ = selected_media()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not acquire_transfer_slot():
+        return too_many_transfers()
+    filename = f"fermia_media_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(ZipStream(entries, on_close=transfer_slots.release), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/media/delete', methods=['POST'])
+def delete_media():
+    """
+    Delete the selected files (see selected_media(); a selection is required).
+    Returns the files deleted and, for the rest, why not.
+    """
+    # Only a JSON body selects files here: a cross-site form cannot send one
+    # without a preflight, while it could post any query string
+    if not request.is_json:
+        return jsonify({'error': 'Expected an application/json body'}), 415
+    try:
+        entries, missing = selected_media(require_selection=True, json_only=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    refs = {}
+    def paths():
+        for ref, path in entries:
+            refs[path] = ref
+            yield path
+    deleted, failed = delete_files(paths())
+    media_index.sync(force=True)
+    errors = {refs[path]: error for path, error in failed.items()}
+    errors.update({ref: "No such file" for ref in missing})
+    return jsonify({'deleted': [refs[path] for path in deleted], 'failed': errors})
 
 def get_ip_address():
     """Get the local IP address."""
@@ -152,6 +385,7 @@ if __name__ == '__main__':
             overflow: hidden;
             box-shadow: 0 2px 5px rgba(0,0,0,0.1);
             transition: transform 0.3s ease;
+            position: relative;
         }
         .media-item:hover {
             transform: translateY(-5px);
@@ -161,6 +395,16 @@ if __name__ == '__main__':
             height: 200px;
             object-fit: cover;
         }
+        .play-badge {
+            position: absolute;
+            top: 80px;
+            left: 50%;
+            transform: translateX(-50%);
+            color: white;
+            font-size: 32px;
+            text-shadow: 0 0 8px rgba(0,0,0,0.8);
+            pointer-events: none;
+        }
         .media-info {
             padding: 10px;
         }
@@ -191,11 +435,16 @@ if __name__ == '__main__':
             background: #007bff;
             color: white;
         }
-        .media-content {
+        .download-all {
+            font-size: 0.6em;
+            font-weight: normal;
+            margin-left: 10px;
+        }
+        .media-section.hidden {
             display: none;
         }
-        .media-content.active {
-            display: block;
+        .load-more {
+            height: 1px;
         }
         .modal {
             display: none;
@@ -213,6 +462,12 @@ if __name__ == '__main__':
             max-width: 90%;
             max-height: 90%;
         }
+        .modal-status {
+            display: none;
+            margin: auto;
+            color: #f1f1f1;
+            font-size: 1.2em;
+        }
         .close {
             position: absolute;
             top: 15px;
@@ -234,87 +489,38 @@ if __name__ == '__main__':
             <div class="tab" data-tab="videos">Videos</div>
         </div>
         
-        <div id="all-content" class="media-content active">
-            {% if photos or videos %}
-                {% if photos %}
-                <div class="media-section">
-                    <h2>Photos ({{ photos|length }})</h2>
-                    <div class="media-grid">
-                        {% for photo in photos %}
-                            <div class="media-item photo-item" data-src="/photos/{{ photo.name }}">
-                                <img src="/photos/{{ photo.name }}" alt="{{ photo.name }}">
-                                <div class="media-info">
-                                    <div class="media-name">{{ photo.name }}</div>
-                                    <div class="media-date">{{ photo.date }}</div>
-                                    <div class="media-size">{{ photo.size }}</div>
-                                </div>
-                            </div>
-                        {% endfor %}
-                    </div>
+        {% macro media_item(item) %}
+            {% set kind = item.type %}
+            <div class="media-item {{ 'photo-item' if kind == 'photos' else 'video-item' }}" data-src="/{{ kind }}/{{ item.name }}" data-name="{{ item.name }}">
+                <img src="/thumbs/{{ kind }}/{{ item.name }}?v={{ item.version }}" srcset="/thumbs/{{ kind }}/{{ item.name }}?w=320&amp;v={{ item.version }} 320w, /thumbs/{{ kind }}/{{ item.name }}?w=640&amp;v={{ item.version }} 640w" sizes="(max-width: 600px) 100vw, 300px" loading="lazy" alt="{{ item.name }}">
+                {% if kind == 'videos' %}<span class="play-badge">&#9654;</span>{% endif %}
+                <div class="media-info">
+                    <div class="media-name">{{ item.name }}</div>
+                    <div class="media-date">{{ item.date }}</div>
+                    <div class="media-size">{{ item.size }}</div>
                 </div>
-                {% endif %}
-                
-                {% if videos %}
-                <div class="media-section">
-                    <h2>Videos ({{ videos|length }})</h2>
-                    <div class="media-grid">
-                        {% for video in videos %}
-                            <div class="media-item video-item" data-src="/videos/{{ video.name }}">
-                                <video src="/videos/{{ video.name }}" preload="metadata" type="{% if video.name.endswith('.mp4') %}video/mp4{% elif video.name.endswith('.avi') %}video/x-msvideo{% endif %}"></video>
-                                <div class="media-info">
-                                    <div class="media-name">{{ video.name }}</div>
-                                    <div class="media-date">{{ video.date }}</div>
-                                    <div class="media-size">{{ video.size }}</div>
-                                </div>
-                            </div>
-                        {% endfor %}
-                    </div>
-                </div>
-                {% endif %}
-            {% else %}
-                <p>No media files found.</p>
-            {% endif %}
-        </div>
-        
-        <div id="photos-content" class="media-content">
+            </div>
+        {% endmacro %}
+
+        <div class="media-section" data-type="photos">
+            <h2>Photos ({{ photo_count }}) <a class="download-all" href="/api/archive?type=photos">Download all (ZIP)</a></h2>
             {% if photos %}
-                <div class="media-section">
-                    <h2>Photos ({{ photos|length }})</h2>
-                    <div class="media-grid">
-                        {% for photo in photos %}
-                            <div class="media-item photo-item" data-src="/photos/{{ photo.name }}">
-                                <img src="/photos/{{ photo.name }}" alt="{{ photo.name }}">
-                                <div class="media-info">
-                                    <div class="media-name">{{ photo.name }}</div>
-                                    <div class="media-date">{{ photo.date }}</div>
-                                    <div class="media-size">{{ photo.size }}</div>
-                                </div>
-                            </div>
-                        {% endfor %}
-                    </div>
+                <div class="media-grid" data-type="photos" data-next="{{ photos_next or '' }}">
+                    {% for item in photos %}{{ media_item(item) }}{% endfor %}
                 </div>
+                <div class="load-more" data-type="photos"></div>
             {% else %}
                 <p>No photos found.</p>
             {% endif %}
         </div>
-        
-        <div id="videos-content" class="media-content">
+
+        <div class="media-section" data-type="videos">
+            <h2>Videos ({{ video_count }}) <a class="download-all" href="/api/archive?type=videos">Download all (ZIP)</a></h2>
             {% if videos %}
-                <div class="media-section">
-                    <h2>Videos ({{ videos|length }})</h2>
-                    <div class="media-grid">
-                        {% for video in videos %}
-                            <div class="media-item video-item" data-src="/videos/{{ video.name }}">
-                                <video src="/videos/{{ video.name }}" preload="metadata"></video>
-                                <div class="media-info">
-                                    <div class="media-name">{{ video.name }}</div>
-                                    <div class="media-date">{{ video.date }}</div>
-                                    <div class="media-size">{{ video.size }}</div>
-                                </div>
-                            </div>
-                        {% endfor %}
-                    </div>
+                <div class="media-grid" data-type="videos" data-next="{{ videos_next or '' }}">
+                    {% for item in videos %}{{ media_item(item) }}{% endfor %}
                 </div>
+                <div class="load-more" data-type="videos"></div>
             {% else %}
                 <p>No videos found.</p>
             {% endif %}
@@ -326,90 +532,166 @@ if __name__ == '__main__':
         <span class="close">&times;</span>
         <img id="modalImage" class="modal-content">
         <video id="modalVideo" class="modal-content" controls></video>
+        <div id="modalStatus" class="modal-status"></div>
     </div>
     
     <script>
-        // Tab switching
+        // Tab switching: "all" shows both sections, the others just theirs
         document.querySelectorAll('.tab').forEach(tab => {
             tab.addEventListener('click', () => {
                 // Update active tab
                 document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
                 tab.classList.add('active');
                 
-                // Show corresponding content
-                document.querySelectorAll('.media-content').forEach(content => {
-                    content.classList.remove('active');
-                });
-                
+                // Show corresponding sections
                 const tabName = tab.getAttribute('data-tab');
-                if (tabName === 'all') {
-                    document.getElementById('all-content').classList.add('active');
-                } else if (tabName === 'photos') {
-                    document.getElementById('photos-content').classList.add('active');
-                } else if (tabName === 'videos') {
-                    document.getElementById('videos-content').classList.add('active');
-                }
+                document.querySelectorAll('.media-section').forEach(section => {
+                    const type = section.getAttribute('data-type');
+                    section.classList.toggle('hidden', tabName !== 'all' && tabName !== type);
+                });
+                loadVisible();
             });
         });
         
+        // Further pages are loaded from /api/media as the end of a grid scrolls into view
+        const pageSize = {{ page_size }};
+        const loading = {};
+        
+        function escapeHtml(text) {
+            const div = document.createElement('div');
+            div.textContent = text;
+            return div.innerHTML;
+        }
+        
+        function renderItem(item) {
+            const name = encodeURIComponent(item.name);
+            const thumb = `/thumbs/${item.type}/${name}`;
+            const version = encodeURIComponent(item.version);
+            const element = document.createElement('div');
+            element.className = 'media-item ' + (item.type === 'photos' ? 'photo-item' : 'video-item');
+            element.setAttribute('data-src', `/${item.type}/${name}`);
+            element.setAttribute('data-name', item.name);
+            element.innerHTML = `
+                <img src="${thumb}?v=${version}" srcset="${thumb}?w=320&v=${version} 320w, ${thumb}?w=640&v=${version} 640w" sizes="(max-width: 600px) 100vw, 300px" loading="lazy" alt="${escapeHtml(item.name)}">
+                ${item.type === 'videos' ? '<span class="play-badge">&#9654;</span>' : ''}
+                <div class="media-info">
+                    <div class="media-name">${escapeHtml(item.name)}</div>
+                    <div class="media-date">${escapeHtml(item.date)}</div>
+                    <div class="media-size">${escapeHtml(item.size)}</div>
+                </div>`;
+            return element;
+        }
+        
+        function loadMore(type) {
+            const grid = document.querySelector(`.media-grid[data-type="${type}"]`);
+            const next = grid && grid.getAttribute('data-next');
+            if (!next || loading[type]) {
+                return;
+            }
+            loading[type] = true;
+            fetch(`/api/media?type=${type}&limit=${pageSize}&after=${encodeURIComponent(next)}`)
+                .then(response => response.json())
+                .then(page => {
+                    page.items.forEach(item => grid.appendChild(renderItem(item)));
+                    grid.setAttribute('data-next', page.next || '');
+                })
+                .catch(error => console.error('Could not load more media:', error))
+                .finally(() => {
+                    loading[type] = false;
+                    // The new page may not have filled the screen
+                    loadVisible();
+                });
+        }
+        
+        function loadVisible() {
+            document.querySelectorAll('.load-more').forEach(marker => {
+                const rect = marker.getBoundingClientRect();
+                if (marker.offsetParent !== null && rect.top < window.innerHeight + 600) {
+                    loadMore(marker.getAttribute('data-type'));
+                }
+            });
+        }
+        
+        const observer = new IntersectionObserver(entries => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) {
+                    loadMore(entry.target.getAttribute('data-type'));
+                }
+            });
+        }, {rootMargin: '600px'});
+        document.querySelectorAll('.load-more').forEach(marker => observer.observe(marker));
+        
+        // Items are added while scrolling, so clicks are handled on the document
+        function onItemClick(selector, handler) {
+            document.addEventListener('click', function(event) {
+                const item = event.target.closest(selector);
+                if (item) {
+                    handler.call(item, event);
+                }
+            });
+        }
+        
         // Modal for viewing photos
         const modal = document.getElementById('mediaModal');
         const modalImg = document.getElementById('modalImage');
         const modalVideo = document.getElementById('modalVideo');
         const closeBtn = document.getElementsByClassName('close')[0];
         
-        // Load and display video thumbnails
-        document.querySelectorAll('.video-item video').forEach(video => {
-            video.addEventListener('loadedmetadata', function() {
-                this.currentTime = 1; // Seek to 1 second to get a thumbnail
-            });
-        });
-        
         // Handle photo clicks
-        document.querySelectorAll('.photo-item').forEach(item => {
-            item.addEventListener('click', function() {
-                modal.style.display = 'flex';
-                modalImg.style.display = 'block';
-                modalVideo.style.display = 'none';
-                modalImg.src = this.getAttribute('data-src');
-            });
+        onItemClick('.photo-item', function() {
+            modal.style.display = 'flex';
+            modalImg.style.display = 'block';
+            modalVideo.style.display = 'none';
+            modalStatus.style.display = 'none';
+            modalImg.src = this.getAttribute('data-src');
         });
         
-        // Handle video clicks
-        document.querySelectorAll('.video-item').forEach(item => {
-            item.addEventListener('click', function() {
-                const videoSrc = this.getAttribute('data-src');
-                const videoType = videoSrc.endsWith('.mp4') ? 'video/mp4' : 
-                                 videoSrc.endsWith('.avi') ? 'video/x-msvideo' : '';
-                
-                modal.style.display = 'flex';
-                modalImg.style.display = 'none';
-                modalVideo.style.display = 'block';
-                
-                // Clear previous source elements
-                while (modalVideo.firstChild) {
-                    modalVideo.removeChild(modalVideo.firstChild);
-                }
-                
-                // Create a source element with appropriate type
-                const source = document.createElement('source');
-                source.src = videoSrc;
-                source.type = videoType;
-                modalVideo.appendChild(source);
-                
-                // Try to load and play the video
-                modalVideo.load();
-                modalVideo.play().catch(error => {
-                    console.error('Error playing video:', error);
-                    alert('This video format may not be supported by your browser. Try using VLC or another media player to view this file.');
-                });
-            });
+        // Videos browsers cannot play as recorded are transcoded first
+        const modalStatus = document.getElementById('modalStatus');
+        let transcodePoll = null;
+        
+        function playVideo(src) {
+            modalStatus.style.display = 'none';
+            modalVideo.style.display = 'block';
+            modalVideo.src = src;
+            modalVideo.play().catch(error => console.error('Error playing video:', error));
+        }
+        
+        function prepareVideo(name, method) {
+            fetch(`/api/transcode/${encodeURIComponent(name)}`, {method: method})
+                .then(response => response.json())
+                .then(status => {
+                    if (modal.style.display === 'none') {
+                        return;
+                    }
+                    if (status.state === 'queued' || status.state === 'running' || status.state === 'busy') {
+                        modalStatus.textContent = status.state === 'busy'
+                            ? 'Waiting for the transcoder...'
+                            : `Preparing video for the browser... ${Math.round(status.progress * 100)}%`;
+                        // A full queue is asked again; a queued job is only watched
+                        transcodePoll = setTimeout(() => prepareVideo(name, status.state === 'busy' ? 'POST' : 'GET'), 1000);
+                    } else {
+                        // Ready, playable as recorded, or impossible to convert: play what there is
+                        playVideo(status.url);
+                    }
+                })
+                .catch(() => playVideo(`/videos/${encodeURIComponent(name)}`));
+        }
+        
+        onItemClick('.video-item', function() {
+            modal.style.display = 'flex';
+            modalImg.style.display = 'none';
+            modalVideo.style.display = 'none';
+            modalStatus.style.display = 'block';
+            modalStatus.textContent = 'Loading video...';
+            prepareVideo(this.getAttribute('data-name'), 'POST');
         });
         
         // Close modal
         closeBtn.addEventListener('click', function() {
             modal.style.display = 'none';
             modalVideo.pause();
+            clearTimeout(transcodePoll);
         });
         
         // Also close when clicking outside the modal content
@@ -417,6 +699,7 @@ if __name__ == '__main__':
             if (event.target === modal) {
                 modal.style.display = 'none';
                 modalVideo.pause();
+                clearTimeout(transcodePoll);
             }
         });
     </script>
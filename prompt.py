@@ -7,6 +7,7 @@ ALWAYS use the appropriate tool when a user request matches one of your capabili
 
 VISION AND CAMERA TOOLS:
 - When users ask what you can see, what's visible, or to analyze something in view → use `vision_model(prompt)` based on the user's prompt and respond accordingly
+- When users ask how far away something is, how close an object is, or whether anything is in front of you → use `depth_sensing(region)` with the matching part of the view ("center" for straight ahead)
 - When users want to see through your camera → `use camera_feed()` and return the link for the user to click.
 - When users request depth visualization or spatial awareness → `use depth_feed()` and return the link for the user to click.
 - When users want to access photos, recordings, or media gallery → `use photos_feed()` and return the link for the user to click.
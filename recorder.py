@@ -0,0 +1,164 @@
+# recorder.py
+# Video recordings are encoded in a dedicated process so encoding never
+# competes with MJPEG serving. The stream process hands over each published
+# JPEG with its publisher sequence number and capture timestamp through a
+# bounded queue; the encoder places frames on the output timeline from those
+# timestamps, so the file plays back in real time regardless of jitter.
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+from fermia_camera import metrics
+
+# "mp4" writes browser-playable H.264 with the moov atom up front (ffmpeg,
+# falling back to OpenCV's avc1/mp4v writers), "avi" keeps the old XVID files
+RECORD_FORMAT = os.environ.get("FERMIA_RECORD_FORMAT", "mp4")
+
+# Frames waiting for the encoder; beyond this, new frames are dropped
+QUEUE_SIZE = 64
+
+FORMATS = {
+    "mp4": {"ext": ".mp4", "fourccs": ("avc1", "mp4v")},
+    "avi": {"ext": ".avi", "fourccs": ("XVID",)},
+}
+
+
+def video_extension(fmt=RECORD_FORMAT):
+    """File extension for recordings in the given format."""
+    return FORMATS[fmt]["ext"]
+
+
+class _FfmpegWriter:
+    """Pipes the JPEG frames as-is into ffmpeg for H.264 encoding."""
+    def __init__(self, path, frame_rate):
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", "-y",
+             "-f", "image2pipe", "-c:v", "mjpeg", "-framerate", str(frame_rate), "-i", "-",
+             "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+             "-movflags", "+faststart", path],
+            stdin=subprocess.PIPE)
+
+    def write(self, jpeg):
+        self.proc.stdin.write(jpeg)
+
+    def release(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class _OpenCVWriter:
+    """Decodes the JPEG frames and writes them with cv2.VideoWriter."""
+    def __init__(self, path, frame_rate, size, fourccs):
+        self.size = size
+        for code in fourccs:
+            self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*code), frame_rate, size)
+            if self.writer.isOpened():
+                break
+
+    def write(self, jpeg):
+        img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return
+        if (img.shape[1], img.shape[0]) != self.size:
+            img = cv2.resize(img, self.size)
+        self.writer.write(img)
+
+    def release(self):
+        self.writer.release()
+
+
+def _open_writer(path, frame_rate, size, fmt):
+    if fmt == "mp4" and shutil.which("ffmpeg"):
+        return _FfmpegWriter(path, frame_rate)
+    return _OpenCVWriter(path, frame_rate, size, FORMATS[fmt]["fourccs"])
+
+
+def _encode_loop(frames, path, frame_rate, size, fmt):
+    """Encoder process: drains the queue until the None end marker."""
+    try:
+        # Stay behind the stream servers when the CPU is busy
+        os.nice(10)
+    except OSError:
+        pass
+
+    writer = _open_writer(path, frame_rate, size, fmt)
+    start = None
+    last_slot = -1
+    last_seq = None
+    last_jpeg = None
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            jpeg, seq, timestamp = item
+            if seq == last_seq:
+                continue
+            last_seq = seq
+
+            # Output slot of this frame on a fixed frame_rate timeline
+            if start is None:
+                start = timestamp
+            slot = round((timestamp - start) * frame_rate)
+            if slot <= last_slot:
+                # Faster than the output rate (or out of order): drop it
+                continue
+            # Repeat the previous frame over gaps so playback stays real time
+            if last_jpeg is not None:
+                for _ in range(slot - last_slot - 1):
+                    writer.write(last_jpeg)
+            writer.write(jpeg)
+            last_slot = slot
+            last_jpeg = jpeg
+    finally:
+        writer.release()
+
+
+class VideoRecorder:
+    """
+    One recording, encoded by its own process. submit() never blocks the
+    caller; close() flushes every queued frame and waits for the file to be
+    finalized.
+    """
+    def __init__(self, path, frame_rate, size, fmt=RECORD_FORMAT):
+        self.path = path
+        self.dropped = 0
+        ctx = mp.get_context("spawn")
+        self.frames = ctx.Queue(maxsize=QUEUE_SIZE)
+        self.process = ctx.Process(target=_encode_loop,
+                                   args=(self.frames, path, frame_rate, size, fmt),
+                                   daemon=True)
+        self.process.start()
+
+    def submit(self, jpeg, seq, timestamp):
+        """Queue a frame for encoding; returns False if it had to be dropped."""
+        try:
+            self.frames.put_nowait((jpeg, seq, timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.count("recording_frames_dropped")
+            return False
+
+    def close(self):
+        """
+        Ends the recording and waits until the encoder has written everything.
+        Returns:
+            bool: True if the encoder finished cleanly.
+        """
+        # Hand over the end marker, waiting for room as long as the encoder lives
+        while self.process.is_alive():
+            try:
+                self.frames.put(None, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.process.join()
+        if self.dropped:
+            print(f"Recording {self.path}: dropped {self.dropped} frames (encoder too slow)")
+        return self.process.exitcode == 0
@@ -0,0 +1,473 @@
+# stream_async.py
+# asyncio variant of stream_service.py for many concurrent viewers. Every
+# MJPEG connection is a coroutine on one event loop instead of a pinned
+# gunicorn thread; frames are read through the shared async Redis client
+# (one MGET per frame for all inputs) and all decoding/encoding runs in a
+# small thread pool off the loop. The stream table, broadcaster and
+# recordings come from stream_core.py, so the Flask app is never built here.
+#
+# Run with: uvicorn stream_async:app --host 0.0.0.0 --port 5002
+import asyncio
+import contextlib
+import datetime
+import os
+import time
+
+import cv2
+import numpy as np
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+
+import fermia_camera
+from fermia_camera import metrics
+from fermia_camera.frame import parse_color, parse_depth
+from fermia_camera.substreams import feed_key
+from stream_core import (
+    MAX_VARIANTS, STREAMS, STREAM_SETTINGS, STREAM_INPUTS, FrameBroadcaster, FrameCache,
+    METRICS_CONTENT_TYPE, Recording, camera_choices, camera_query, camera_suffix,
+    changed_streams, count_frame, encode_variant, mark_rendered, metrics_text, render_streams,
+    snap_client_settings, start_raw_depth_recording, stop_response,
+)
+from recorder import video_extension
+
+# Create directories if they don't exist
+os.makedirs('photos', exist_ok=True)
+os.makedirs('videos', exist_ok=True)
+
+templates = Jinja2Templates(directory='templates')
+
+
+class AsyncFrameBroadcaster(FrameBroadcaster):
+    """
+    FrameBroadcaster whose clients are coroutines. The current frame and its
+    variants are only touched on the event loop, so publish() and the clients
+    never wait on a lock held by the thread pool: decoding and encoding jobs
+    get the frame passed in, and decoded images come back to the loop through
+    loop.call_soon_threadsafe(). Recordings are fed through the inherited sinks.
+    """
+    def __init__(self):
+        super().__init__()
+        # Clients wait here for a frame newer than the one they sent last
+        self.frame_cond = asyncio.Condition()
+        # Set once the current frame is decoded, and whether a job is decoding it
+        self.decoded = asyncio.Event()
+        self.decoding = False
+
+    async def publish(self, jpeg, seq, image=None, timestamp=None):
+        """Store a new encoded frame (and its decoded image, if at hand) and wake all clients."""
+        if timestamp is None:
+            timestamp = time.time()
+        self.jpeg = jpeg
+        self.seq = seq
+        self.timestamp = timestamp
+        self.published += 1
+        self.image = image
+        self.image_seq = seq if image is not None else None
+        self.variants = {}
+        self.variants_seq = seq
+        self.decoded = asyncio.Event()
+        self.decoding = False
+        if image is not None:
+            self.decoded.set()
+        async with self.frame_cond:
+            self.frame_cond.notify_all()
+        for sink in self.sinks:
+            sink.submit(jpeg, seq, timestamp)
+
+    def _store_image(self, seq, image, decoded):
+        # Called on the loop by a pool thread that decoded frame `seq`
+        if image is not None and seq == self.seq:
+            self.image = image
+            self.image_seq = seq
+        decoded.set()
+
+    def _encode_job(self, loop, jpeg, seq, image, decoded, width, quality):
+        # Runs in the thread pool
+        if image is None:
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            loop.call_soon_threadsafe(self._store_image, seq, image, decoded)
+        return encode_variant(jpeg, image, width, quality)
+
+    async def _encode_variant(self, jpeg, seq, image, decode, decoded, width, quality):
+        if image is None and not decode:
+            # Another variant of this frame is decoding it: reuse its image
+            await decoded.wait()
+            image = self.image if self.image_seq == seq else None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._encode_job, loop, jpeg, seq, image,
+                                          decoded, width, quality)
+
+    async def avariant(self, width=None, quality=None):
+        """
+        Returns (jpeg, seq) of the newest frame scaled down to `width` pixels
+        wide and/or re-encoded at JPEG `quality`. The frame is decoded at most
+        once and each variant encoded once per frame, in the thread pool.
+        """
+        jpeg, seq = self.jpeg, self.seq
+        if jpeg is None or (width is None and quality is None):
+            return jpeg, seq
+        key = (width, quality)
+        job = self.variants.get(key)
+        if job is None:
+            image = self.image if self.image_seq == seq else None
+            decode = image is None and not self.decoding
+            if decode:
+                self.decoding = True
+            job = asyncio.ensure_future(self._encode_variant(jpeg, seq, image, decode, self.decoded,
+                                                             width, quality))
+            if len(self.variants) < MAX_VARIANTS:
+                self.variants[key] = job
+        # A client that disconnects must not cancel the encode others wait for
+        return await asyncio.shield(job), seq
+
+    async def aframes(self, fps=None, width=None, quality=None):
+        """
+        Async multipart MJPEG generator for one client. While the client's
+        socket is slow the generator is simply not resumed, so it always
+        sends the newest frame when it gets the chance.
+        """
+        loop = asyncio.get_running_loop()
+        self.acquire()
+        try:
+            min_interval = 1.0 / fps if fps else 0.0
+            last_seq = None
+            last_sent = 0.0
+            last_published = None
+            while True:
+                async with self.frame_cond:
+                    try:
+                        await asyncio.wait_for(self.frame_cond.wait_for(
+                            lambda: self.jpeg is not None and self.seq != last_seq), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        continue
+
+                # Respect the client's frame rate, then take whatever is newest
+                delay = last_sent + min_interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                jpeg, seq = await self.avariant(width, quality)
+                last_published = self.count_skipped(last_published)
+                last_seq = seq
+                last_sent = loop.time()
+                yield self.part(jpeg, seq)
+        finally:
+            self.release()
+
+
+class AsyncStreamHub:
+    """
+    Capture coroutine of one camera. On every new publisher frame it fetches
+    only the raw inputs needed by streams with demand, then renders them in
+    the thread pool from one shared FrameCache.
+    """
+    def __init__(self, camera=None):
+        self.camera = camera
+        self.broadcasters = {name: AsyncFrameBroadcaster() for name in STREAMS}
+        self.task = None
+
+    def __getitem__(self, stream):
+        return self.broadcasters[stream]
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.capture_frames())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def _shared(self):
+        """Key namespace of the camera and whether its frames are in same-host shared memory."""
+        namespace = fermia_camera.camera_namespace(self.camera)
+        return namespace, fermia_camera.get_ring_reader(namespace).get("color") is not None
+
+    async def fetch(self, inputs):
+        """
+        Fetches the latest frame of each input ("color", "depth").
+        Returns:
+            dict: input -> (FrameHeader, data).
+        """
+        loop = asyncio.get_running_loop()
+        namespace, shared = await loop.run_in_executor(None, self._shared)
+        if shared:
+            # Same-host shared memory: no Redis payload to fetch
+            readers = {"color": fermia_camera.get_jpeg_frame, "depth": fermia_camera.get_depth_frame}
+            return {name: await loop.run_in_executor(None, lambda: readers[name](camera=namespace))
+                    for name in inputs}
+        names = sorted(inputs)
+        # One round-trip for all inputs
+        with metrics.timed("redis_get"):
+            raws = await fermia_camera.get_async_client().mget([feed_key(name, camera=namespace)
+                                                                for name in names])
+        parsers = {"color": parse_color, "depth": parse_depth}
+        with metrics.timed("parse"):
+            return {name: parsers[name](raw) if raw is not None else (None, None)
+                    for name, raw in zip(names, raws)}
+
+    async def render(self, seq, streams):
+        """Fetch the inputs of the given streams asynchronously and render them."""
+        inputs = await self.fetch(set().union(*(STREAM_INPUTS[name] for name in streams)))
+        cache = FrameCache(seq, color=inputs.get("color"), depth=inputs.get("depth"), camera=self.camera)
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(None, render_streams, cache, streams)
+        return rendered, cache
+
+    async def capture_frames(self):
+        seq = None
+        frame_seq = None
+        rendered_inputs = {}
+        while True:
+            try:
+                # Sleep until the publisher has a new frame instead of polling
+                new_seq = await fermia_camera.wait_for_frame_async(seq, timeout=1.0, camera=self.camera)
+                if new_seq is None:
+                    continue
+                last_seq, seq = seq, new_seq
+
+                active = [name for name, b in self.broadcasters.items() if b.active]
+                # Nobody is watching, or nothing they watch changed: don't fetch or decode anything
+                active = changed_streams(active, rendered_inputs, self.camera)
+                if not active:
+                    continue
+
+                rendered, cache = await self.render(seq, active)
+                mark_rendered(rendered_inputs, active, cache)
+                frame_seq = count_frame(last_seq, seq, frame_seq, cache)
+                timestamp = cache.timestamp()
+                for name, (jpeg, img) in rendered.items():
+                    if jpeg is not None:
+                        await self.broadcasters[name].publish(jpeg, seq, img, timestamp)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error capturing frame: {e}")
+                await asyncio.sleep(1)
+
+    async def snapshot(self, stream):
+        """
+        Returns the newest JPEG of a stream, rendering one on demand if the
+        stream is not currently being rendered.
+        """
+        broadcaster = self.broadcasters[stream]
+        jpeg, _ = broadcaster.latest_jpeg()
+        if broadcaster.active and jpeg is not None:
+            return jpeg
+        rendered, _ = await self.render(None, [stream])
+        return rendered[stream][0]
+
+
+# One capture coroutine per camera namespace being watched (so a device
+# serial, a camera name and "no camera" that mean the same device share it);
+# started on first use
+hub = AsyncStreamHub()
+hubs = {None: hub}
+
+# Running recordings by (camera namespace, stream)
+recordings = {}
+recordings_lock = asyncio.Lock()
+
+DEFAULT_STREAM = os.environ.get("FERMIA_DEFAULT_STREAM", "color")
+
+
+async def camera_namespace(camera):
+    """fermia_camera.camera_namespace(), which may read the camera registry, off the loop."""
+    if camera is None:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(None, fermia_camera.camera_namespace, camera)
+
+
+async def hub_for(camera):
+    """The AsyncStreamHub of a camera (None for the default camera), started on first use."""
+    namespace = await camera_namespace(camera)
+    camera_hub = hubs.get(namespace)
+    if camera_hub is None:
+        camera_hub = hubs[namespace] = AsyncStreamHub(namespace)
+    camera_hub.start()
+    return camera_hub
+
+
+def _selected_stream(request):
+    stream = request.query_params.get('stream', DEFAULT_STREAM)
+    if stream not in STREAMS:
+        return None
+    return stream
+
+
+def _selected_camera(request):
+    """The ?camera= of a request: a device serial or camera name, None for the default camera."""
+    return request.query_params.get('camera') or None
+
+
+def _client_settings(request):
+    """Parse the ?fps=, ?width= and ?quality= options of an MJPEG request."""
+    def param(name, cast):
+        try:
+            value = request.query_params.get(name)
+            return cast(value) if value is not None else None
+        except ValueError:
+            return None
+    return snap_client_settings(param('fps', float), param('width', int), param('quality', int))
+
+
+async def _page(request, stream):
+    camera = _selected_camera(request)
+    cameras = await asyncio.get_running_loop().run_in_executor(None, camera_choices)
+    query = camera_query(camera)
+    return templates.TemplateResponse(request, STREAM_SETTINGS[stream]["template"], {
+        "stream": stream,
+        "feed_url": f"/{stream}" + ("?" + query[1:] if query else ""),
+        "camera": camera,
+        "camera_query": query,
+        "cameras": cameras,
+    })
+
+
+async def index(request):
+    return await _page(request, DEFAULT_STREAM)
+
+
+async def view(request):
+    stream = request.path_params['stream']
+    if stream not in STREAMS:
+        return JSONResponse({"success": False, "message": "Unknown stream"}, status_code=404)
+    return await _page(request, stream)
+
+
+async def _mjpeg(stream, request):
+    camera_hub = await hub_for(_selected_camera(request))
+    return StreamingResponse(camera_hub[stream].aframes(**_client_settings(request)),
+                             media_type='multipart/x-mixed-replace; boundary=frame')
+
+
+async def video_feed(request):
+    return await _mjpeg(DEFAULT_STREAM, request)
+
+
+async def stream_feed(request):
+    stream = request.path_params['stream']
+    if stream not in STREAMS:
+        return JSONResponse({"success": False, "message": "Unknown stream"}, status_code=404)
+    return await _mjpeg(stream, request)
+
+
+async def metrics_endpoint(request):
+    text = await asyncio.get_running_loop().run_in_executor(None, metrics_text, "stream_async")
+    return Response(text, media_type=METRICS_CONTENT_TYPE)
+
+
+async def take_photo(request):
+    stream = _selected_stream(request)
+    if stream is None:
+        return JSONResponse({"success": False, "message": "Unknown stream"})
+    settings = STREAM_SETTINGS[stream]
+    camera = _selected_camera(request)
+
+    camera_hub = await hub_for(camera)
+    jpeg = await camera_hub.snapshot(stream)
+    if jpeg is None:
+        return JSONResponse({"success": False, "message": "No camera frame available"})
+
+    # Generate a unique filename with timestamp
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{settings['photo_prefix']}_{timestamp}{camera_suffix(camera)}.jpg"
+    filepath = os.path.join("photos", filename)
+
+    # Save the already-encoded image as is
+    def write():
+        with open(filepath, 'wb') as f:
+            f.write(jpeg)
+    await asyncio.get_running_loop().run_in_executor(None, write)
+
+    return JSONResponse({
+        "success": True,
+        "message": f"{settings['label']} saved as {filename}",
+        "filename": filename
+    })
+
+
+async def start_recording(request):
+    stream = _selected_stream(request)
+    if stream is None:
+        return JSONResponse({"success": False, "message": "Unknown stream"})
+    settings = STREAM_SETTINGS[stream]
+    camera = _selected_camera(request)
+    camera_hub = await hub_for(camera)
+    key = (camera_hub.camera, stream)
+
+    async with recordings_lock:
+        if key in recordings:
+            return JSONResponse({"success": False, "message": "Already recording"})
+
+        if stream == "depth" and request.query_params.get('raw') == '1':
+            # Keep the real millimetre values instead of the colormap
+            try:
+                recording = recordings[key] = start_raw_depth_recording(camera)
+            except ValueError as e:
+                return JSONResponse({"success": False, "message": str(e)})
+            return JSONResponse({
+                "success": True,
+                "message": "Raw depth recording started",
+                "filename": recording.filename
+            })
+
+        jpeg = await camera_hub.snapshot(stream)
+        if jpeg is None:
+            return JSONResponse({"success": False, "message": "No camera frame available"})
+
+        # Get frame dimensions
+        first_frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if first_frame is None:
+            return JSONResponse({"success": False, "message": "No camera frame available"})
+        height, width = first_frame.shape[:2]
+
+        # Generate a unique filename with timestamp
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"{settings['video_prefix']}_{timestamp}{camera_suffix(camera)}{video_extension()}"
+        # Starting the encoder process takes a moment; keep it off the loop
+        recordings[key] = await asyncio.get_running_loop().run_in_executor(
+            None, Recording, stream, camera_hub[stream], filename,
+            settings["frame_rate"], (width, height))
+
+    return JSONResponse({
+        "success": True,
+        "message": "Recording started",
+        "filename": filename
+    })
+
+
+async def stop_recording(request):
+    stream = _selected_stream(request)
+    namespace = await camera_namespace(_selected_camera(request))
+
+    async with recordings_lock:
+        recording = recordings.pop((namespace, stream), None)
+    if recording is None:
+        return JSONResponse({"success": False, "message": "Not recording"})
+
+    error = await asyncio.get_running_loop().run_in_executor(None, recording.stop)
+    return JSONResponse(stop_response(recording, error))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    for camera_hub in hubs.values():
+        await camera_hub.stop()
+    await fermia_camera.get_async_client().aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/view/{stream}', view),
+        Route('/video_feed', video_feed),
+        Route('/metrics', metrics_endpoint),
+        Route('/take_photo', take_photo),
+        Route('/start_recording', start_recording),
+        Route('/stop_recording', stop_recording),
+        Route('/{stream}', stream_feed),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,18 @@
+#!/bin/bash
+# start_stream_async.sh - Start the asyncio camera and depth streams with Uvicorn
+
+# Get current directory where this script is located
+SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
+
+# Change to the script directory
+cd "$SCRIPT_DIR"
+
+# Check if Uvicorn is installed; if not, install it.
+if ! command -v uvicorn &> /dev/null; then
+    echo "Uvicorn is not installed. Installing now..."
+    pip install uvicorn starlette
+fi
+
+# A single event loop serves every MJPEG connection
+echo "Starting async camera streams on port 5002..."
+uvicorn stream_async:app --host 0.0.0.0 --port 5002 --workers 1
@@ -0,0 +1,565 @@
+# stream_core.py
+# Building blocks shared by the stream servers (stream_service.py with Flask
+# threads, stream_async.py on asyncio): the stream table, the per-stream
+# broadcaster and frame cache, the renderers and the recordings. Importing it
+# has no side effects; the servers own their hubs, routes and directories.
+import datetime
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import cv2
+import numpy as np
+
+import fermia_camera
+from fermia_camera import metrics
+from fermia_camera.depthlog import check_compression, record_depth
+from recorder import VideoRecorder
+
+STREAMS = ("color", "depth", "side_by_side")
+
+# Per-client settings are snapped to a few steps so clients asking for
+# similar settings share one encoded variant
+MAX_CLIENT_FPS = 30.0
+WIDTH_STEP = 160
+QUALITY_STEP = 5
+MAX_VARIANTS = 8
+
+# Per-frame compression of raw depth recordings: "zstd", "lz4" or none
+RAW_DEPTH_COMPRESSION = os.environ.get("FERMIA_DEPTH_COMPRESSION") or None
+
+# Per-stream page, file naming and recording settings. frame_rate is the
+# output rate of recordings; frames are placed by their capture timestamps.
+STREAM_SETTINGS = {
+    "color": {
+        "template": "camera_stream_index.html",
+        "label": "Photo",
+        "photo_prefix": "photo",
+        "video_prefix": "video",
+        "frame_rate": 15.0,
+    },
+    "depth": {
+        "template": "depth_stream_index.html",
+        "label": "Depth photo",
+        "photo_prefix": "depth_photo",
+        "video_prefix": "depth_video",
+        "frame_rate": 6.0,
+    },
+    "side_by_side": {
+        "template": "camera_stream_index.html",
+        "label": "RGB-D photo",
+        "photo_prefix": "rgbd_photo",
+        "video_prefix": "rgbd_video",
+        "frame_rate": 15.0,
+    },
+}
+
+
+def encode_variant(jpeg, img, width=None, quality=None):
+    """
+    Re-encodes a frame scaled down to `width` pixels wide and/or at JPEG
+    `quality`.
+    Args:
+        jpeg (bytes): The frame as published, returned if nothing would change.
+        img (np.ndarray): The same frame decoded, or None if it could not be.
+    Returns:
+        bytes: The encoded variant.
+    """
+    if img is None:
+        return jpeg
+    if width is not None and width >= img.shape[1]:
+        # Not smaller than the stream itself: only the quality differs
+        width = None
+        if quality is None:
+            return jpeg
+    with metrics.timed("variant_encode"):
+        if width is not None:
+            height = round(img.shape[0] * width / img.shape[1])
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else []
+        ret, buffer = cv2.imencode('.jpg', img, params)
+    return buffer.tobytes() if ret else jpeg
+
+
+class FrameBroadcaster:
+    """
+    Holds the latest JPEG-encoded frame of one stream and fans it out to every
+    client. Each frame is encoded at most once no matter how many viewers are
+    connected, and is only decoded again when a re-encoded variant needs it.
+    The capture loop only renders a stream while it has demand (connected
+    clients or an active recording).
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.jpeg = None
+        self.seq = None
+        self.timestamp = None
+        # Frames published so far, to count the ones a client never got
+        self.published = 0
+        self.image = None
+        self.image_seq = None
+        self.demand = 0
+        # Re-encoded (width, quality) variants of the current frame
+        self.variants = {}
+        self.variants_seq = None
+        # One lock per variant being encoded, so concurrent clients encode it once
+        self.variant_locks = {}
+        self.variant_locks_lock = threading.Lock()
+        # Recorders fed with every published frame
+        self.sinks = []
+
+    def acquire(self):
+        """Register a consumer of this stream."""
+        with self.cond:
+            self.demand += 1
+
+    def release(self):
+        """Unregister a consumer of this stream."""
+        with self.cond:
+            self.demand -= 1
+
+    @property
+    def active(self):
+        return self.demand > 0
+
+    def add_sink(self, sink):
+        """Feed every published frame to sink.submit(jpeg, seq, timestamp)."""
+        with self.cond:
+            self.sinks = self.sinks + [sink]
+            self.demand += 1
+
+    def remove_sink(self, sink):
+        with self.cond:
+            self.sinks = [s for s in self.sinks if s is not sink]
+            self.demand -= 1
+
+    def publish(self, jpeg, seq, image=None, timestamp=None):
+        """Store a new encoded frame (and its decoded image, if at hand) and wake all clients."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.cond:
+            self.jpeg = jpeg
+            self.seq = seq
+            self.timestamp = timestamp
+            self.published += 1
+            self.image = image
+            self.image_seq = seq if image is not None else None
+            self.cond.notify_all()
+            sinks = self.sinks
+        if sinks:
+            for sink in sinks:
+                sink.submit(jpeg, seq, timestamp)
+
+    def latest_jpeg(self):
+        """Returns (jpeg bytes, seq) of the newest frame."""
+        with self.cond:
+            return self.jpeg, self.seq
+
+    def count_skipped(self, last_published):
+        """
+        Count the frames published since a client's previous one that it
+        never got (slow socket or fps cap).
+        Returns:
+            int: The published count to pass next time.
+        """
+        with self.cond:
+            published = self.published
+        if last_published is not None and published > last_published + 1:
+            metrics.count("client_frames_skipped", published - last_published - 1)
+        return published
+
+    def part(self, jpeg, seq):
+        """
+        Multipart MJPEG part for a frame. Besides the length, each part
+        carries the publisher sequence number and capture timestamp so
+        clients (and benchmarks) can measure capture-to-wire latency.
+        """
+        with self.cond:
+            timestamp = self.timestamp if seq == self.seq else None
+        headers = f"Content-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n"
+        if seq is not None:
+            headers += f"X-Frame-Seq: {seq}\r\n"
+        if timestamp is not None:
+            headers += f"X-Timestamp: {timestamp:.6f}\r\n"
+        return b'--frame\r\n' + headers.encode() + b'\r\n' + jpeg + b'\r\n'
+
+    def _image_locked(self):
+        if self.image_seq != self.seq:
+            self.image = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            self.image_seq = self.seq
+        return self.image
+
+    def latest_image(self):
+        """Returns the newest frame decoded, decoding it at most once per frame."""
+        with self.cond:
+            if self.jpeg is None:
+                return None
+            return self._image_locked()
+
+    def _variant_lock(self, key):
+        with self.variant_locks_lock:
+            return self.variant_locks.setdefault(key, threading.Lock())
+
+    def variant(self, width=None, quality=None):
+        """
+        Returns (jpeg, seq) of the newest frame scaled down to `width` pixels
+        wide and/or re-encoded at JPEG `quality`. Each variant is encoded once
+        per frame and shared by every client asking for the same settings.
+        """
+        if width is None and quality is None:
+            return self.latest_jpeg()
+
+        key = (width, quality)
+        with self._variant_lock(key):
+            with self.cond:
+                jpeg, seq = self.jpeg, self.seq
+                if jpeg is None:
+                    return None, seq
+                if self.variants_seq != seq:
+                    self.variants = {}
+                    self.variants_seq = seq
+                # The variants of this frame, even if a newer one is published meanwhile
+                variants = self.variants
+                cached = variants.get(key)
+                if cached is not None:
+                    return cached, seq
+                img = self._image_locked()
+            encoded = encode_variant(jpeg, img, width, quality)
+            if len(variants) < MAX_VARIANTS:
+                variants[key] = encoded
+        with self.variant_locks_lock:
+            self.variant_locks.pop(key, None)
+        return encoded, seq
+
+    def frames(self, fps=None, width=None, quality=None):
+        """
+        Multipart MJPEG generator for one client. It always sends the newest
+        frame: while the socket write blocks, frames published in the meantime
+        are dropped instead of queued. fps caps the client's frame rate.
+        """
+        self.acquire()
+        try:
+            min_interval = 1.0 / fps if fps else 0.0
+            last_seq = None
+            last_sent = 0.0
+            last_published = None
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.jpeg is not None and self.seq != last_seq, timeout=1.0)
+                    if self.jpeg is None or self.seq == last_seq:
+                        continue
+
+                # Respect the client's frame rate, then take whatever is newest
+                delay = last_sent + min_interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                jpeg, seq = self.variant(width, quality)
+                last_published = self.count_skipped(last_published)
+                last_seq = seq
+                last_sent = time.monotonic()
+                yield self.part(jpeg, seq)
+        finally:
+            self.release()
+
+
+class FrameCache:
+    """
+    Inputs of one publisher frame, shared by every stream rendered from it.
+    Each input is fetched from fermia_camera and decoded at most once. Callers
+    that already fetched the raw frames (e.g. the async server) pass them in
+    as (FrameHeader, data) pairs.
+    """
+    def __init__(self, seq, color=None, depth=None, camera=None):
+        self.seq = seq
+        self.camera = camera
+        self._color = color
+        self._depth = depth
+        self._color_image = None
+        self._depth_image = None
+
+    def color_jpeg(self):
+        if self._color is None:
+            self._color = fermia_camera.get_jpeg_frame(camera=self.camera)
+        return self._color
+
+    def color_image(self):
+        if self._color_image is None:
+            _, jpeg = self.color_jpeg()
+            if jpeg is None:
+                return None
+            self._color_image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._color_image
+
+    def depth_data(self):
+        if self._depth is None:
+            self._depth = fermia_camera.get_depth_frame(copy=False, camera=self.camera)
+        return self._depth[1]
+
+    def input_seq(self, name):
+        """Sequence number of the fetched "color" or "depth" input."""
+        frame = self._color if name == "color" else self._depth
+        if frame is not None and frame[0] is not None:
+            return frame[0].seq
+        return fermia_camera.stream_seq(name, self.camera)
+
+    def frame_seq(self):
+        """Newest publisher sequence number among the fetched inputs, if known."""
+        seqs = [frame[0].seq for frame in (self._color, self._depth)
+                if frame is not None and frame[0] is not None]
+        return max(seqs) if seqs else None
+
+    def timestamp(self):
+        """Capture time of the frame, from whichever input was fetched."""
+        for frame in (self._color, self._depth):
+            if frame is not None and frame[0] is not None:
+                return frame[0].timestamp
+        return time.time()
+
+    def depth_image(self):
+        if self._depth_image is None:
+            depth = self.depth_data()
+            if depth is None:
+                return None
+            # Shared per depth frame with snapshots and the other streams
+            self._depth_image = fermia_camera.colorize_depth_frame(self._depth[0], depth, camera=self.camera)
+        return self._depth_image
+
+
+def _encode(img):
+    """Encode an image as JPEG bytes, returning (bytes, image)."""
+    if img is None:
+        return None, None
+    with metrics.timed("mjpeg_encode"):
+        ret, buffer = cv2.imencode('.jpg', img)
+    if not ret:
+        return None, None
+    return buffer.tobytes(), img
+
+def render_color(cache):
+    # Streams keep the publisher's resolution: pass its JPEG through untouched
+    _, jpeg = cache.color_jpeg()
+    return jpeg, None
+
+def render_depth(cache):
+    return _encode(cache.depth_image())
+
+def render_side_by_side(cache):
+    color_img = cache.color_image()
+    depth_img = cache.depth_image()
+    if color_img is None or depth_img is None:
+        return None, None
+    # Both halves at half the color resolution (depth may be decimated)
+    half = (color_img.shape[1] // 2, color_img.shape[0] // 2)
+    with metrics.timed("resize"):
+        combined = np.hstack((cv2.resize(color_img, half, interpolation=cv2.INTER_AREA),
+                              cv2.resize(depth_img, half, interpolation=cv2.INTER_NEAREST)))
+    return _encode(combined)
+
+RENDERERS = {
+    "color": render_color,
+    "depth": render_depth,
+    "side_by_side": render_side_by_side,
+}
+
+# Which raw inputs each stream is rendered from
+STREAM_INPUTS = {
+    "color": {"color"},
+    "depth": {"depth"},
+    "side_by_side": {"color", "depth"},
+}
+
+def render_streams(cache, streams):
+    """Render each of the given streams from one FrameCache."""
+    rendered = {}
+    for name in streams:
+        with metrics.timed(f"render_{name}"):
+            rendered[name] = RENDERERS[name](cache)
+    return rendered
+
+
+def changed_streams(streams, rendered_inputs, camera=None):
+    """
+    Picks the streams whose inputs changed since they were last rendered.
+    Color and depth are published at their own rates, so e.g. a depth-only
+    frame leaves the color stream as it is.
+    Args:
+        streams (list): Streams with demand.
+        rendered_inputs (dict): Input sequence numbers per rendered stream,
+        kept up to date by mark_rendered().
+        camera (str): Camera the streams show.
+    Returns:
+        list: The streams to render.
+    """
+    return [name for name in streams
+            if rendered_inputs.get(name) != tuple(fermia_camera.stream_seq(i, camera)
+                                                 for i in sorted(STREAM_INPUTS[name]))]
+
+
+def mark_rendered(rendered_inputs, streams, cache):
+    """Remember which input frames the given streams were rendered from."""
+    for name in streams:
+        rendered_inputs[name] = tuple(cache.input_seq(i) for i in sorted(STREAM_INPUTS[name]))
+
+
+def count_frame(last_seq, new_seq, last_frame_seq, cache):
+    """
+    Update the dropped/duplicate counters of a capture loop after rendering.
+    Returns:
+        The publisher sequence number of the rendered inputs.
+    """
+    if last_seq is not None and new_seq > last_seq + 1:
+        # Notifications the capture loop never got to
+        metrics.count("frames_dropped", new_seq - last_seq - 1)
+    frame_seq = cache.frame_seq()
+    if frame_seq is not None and frame_seq == last_frame_seq:
+        # Woken up, but the stored frame was the one already rendered
+        metrics.count("frames_duplicate")
+    return frame_seq
+
+
+def metrics_text(process):
+    """/metrics body: this process's stage metrics plus the publisher's."""
+    snapshots = metrics.pulled(fermia_camera.redis_client)
+    snapshots[process] = metrics.registry.snapshot()
+    return metrics.render_prometheus(snapshots)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Recording:
+    """A video being written from one stream by a dedicated encoder process."""
+    def __init__(self, stream, broadcaster, filename, frame_rate, size):
+        self.stream = stream
+        self.broadcaster = broadcaster
+        self.filename = filename
+        self.path = os.path.join("videos", filename)
+        self.recorder = VideoRecorder(self.path, frame_rate, size)
+
+        # Keep the stream rendered and feed it to the encoder while recording
+        self.broadcaster.add_sink(self.recorder)
+
+    def stop(self):
+        """
+        Stop feeding frames and wait until the encoder has flushed the file.
+        Returns:
+            str: Why the video was not saved, or None if it was.
+        """
+        self.broadcaster.remove_sink(self.recorder)
+        if self.recorder.close():
+            print(f"Video saved to {self.path}")
+            return None
+        print(f"Encoder for {self.path} exited with an error")
+        return f"encoder exited with code {self.recorder.process.exitcode}"
+
+
+class RawDepthRecording:
+    """
+    Lossless depth recording: the publisher's uint16 frames are appended to a
+    .fdr file (see fermia_camera.depthlog) by a background thread, instead of
+    encoding the colormapped stream as video.
+    Raises:
+        ValueError: If the compression cannot be used.
+    """
+    def __init__(self, filename, compression=RAW_DEPTH_COMPRESSION, camera=None):
+        # Fail here rather than in the writer thread
+        check_compression(compression)
+        self.filename = filename
+        self.path = os.path.join("videos", filename)
+        self.compression = compression
+        self.camera = camera
+        self.stopped = threading.Event()
+        # What ended the writer thread early, and how many frames it wrote
+        self.error = None
+        self.frames = 0
+        self.thread = threading.Thread(target=self._record)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _record(self):
+        try:
+            self.frames = record_depth(self.path, compression=self.compression,
+                                       stop_event=self.stopped, camera=self.camera)
+        except Exception as e:
+            print(f"Raw depth recording {self.path} failed: {e}")
+            self.error = e
+
+    def stop(self):
+        """
+        Stop recording and wait until the frame index has been written.
+        Returns:
+            str: Why the recording failed, or None if it was saved.
+        """
+        self.stopped.set()
+        self.thread.join()
+        if self.error is not None:
+            return str(self.error)
+        if not self.frames:
+            return "no depth frames were received"
+        print(f"Raw depth saved to {self.path}")
+        return None
+
+
+def stop_response(recording, error):
+    """
+    Body of a /stop_recording answer.
+    Args:
+        recording: The stopped Recording or RawDepthRecording.
+        error (str): What its stop() returned.
+    """
+    if error is not None:
+        return {"success": False, "message": f"Recording failed: {error}", "filename": recording.filename}
+    return {"success": True, "message": "Recording saved successfully", "filename": recording.filename}
+
+
+def camera_suffix(camera):
+    """Filename suffix telling the cameras' photos and videos apart."""
+    return f"_{camera}" if camera is not None else ""
+
+
+def start_raw_depth_recording(camera=None):
+    """
+    Starts a lossless depth recording.
+    Returns:
+        RawDepthRecording: The running recording.
+    Raises:
+        ValueError: If the configured compression cannot be used.
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return RawDepthRecording(f"depth_raw_{timestamp}{camera_suffix(camera)}.fdr", camera=camera)
+
+
+def camera_choices():
+    """
+    Cameras offered by the pages' selector.
+    Returns:
+        dict: ?camera= value ("" for the default camera) -> label.
+    """
+    cameras = fermia_camera.list_cameras()
+    choices = {}
+    if None not in cameras.values():
+        # The default camera is not registered when its source has no serial
+        choices[""] = "Default camera"
+    for serial, namespace in cameras.items():
+        choices[serial if namespace is not None else ""] = f"Camera {serial}"
+    return choices
+
+
+def camera_query(camera):
+    """Query string fragment appended to the pages' requests for a camera."""
+    return "&" + urlencode({"camera": camera}) if camera is not None else ""
+
+
+def snap_client_settings(fps=None, width=None, quality=None):
+    """
+    Clamp and snap per-client MJPEG options to shared steps.
+    Returns:
+        dict: keyword arguments for FrameBroadcaster.frames().
+    """
+    if fps is not None:
+        fps = min(max(fps, 0.1), MAX_CLIENT_FPS)
+    if width is not None:
+        width = max(WIDTH_STEP, width // WIDTH_STEP * WIDTH_STEP)
+    if quality is not None:
+        quality = min(max(round(quality / QUALITY_STEP) * QUALITY_STEP, 10), 95)
+    return {"fps": fps, "width": width, "quality": quality}
@@ -0,0 +1,269 @@
+# stream_service.py
+# One process, one capture loop and one frame cache for the color, depth and
+# side-by-side MJPEG streams, served by Flask threads. The building blocks
+# shared with stream_async.py live in stream_core.py; camera_stream.py and
+# depth_stream.py are thin entry points on top of this module.
+import cv2
+import fermia_camera
+import threading
+import time
+import datetime
+import os
+from flask import Flask, Response, render_template, jsonify, request, url_for
+import numpy as np
+
+from recorder import video_extension
+from stream_core import (
+    STREAMS, STREAM_SETTINGS, FrameBroadcaster, FrameCache, METRICS_CONTENT_TYPE, RENDERERS,
+    Recording, camera_choices, camera_query, camera_suffix, changed_streams, count_frame,
+    mark_rendered, metrics_text, render_streams, snap_client_settings,
+    start_raw_depth_recording, stop_response,
+)
+
+# Create directories if they don't exist
+os.makedirs('templates', exist_ok=True)
+os.makedirs('photos', exist_ok=True)
+os.makedirs('videos', exist_ok=True)
+
+
+class StreamHub:
+    """
+    Runs the single capture loop of a camera. On every new publisher frame it
+    renders only the streams that currently have demand, from one shared
+    FrameCache.
+    """
+    def __init__(self, camera=None):
+        self.camera = camera
+        self.broadcasters = {name: FrameBroadcaster() for name in STREAMS}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def __getitem__(self, stream):
+        return self.broadcasters[stream]
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.capture_frames)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def capture_frames(self):
+        seq = None
+        frame_seq = None
+        rendered_inputs = {}
+        while True:
+            try:
+                # Sleep until the publisher has a new frame instead of polling
+                new_seq = fermia_camera.wait_for_frame(seq, timeout=1.0, camera=self.camera)
+                if new_seq is None:
+                    print("Waiting for camera frames...")
+                    continue
+                last_seq, seq = seq, new_seq
+
+                active = [name for name, b in self.broadcasters.items() if b.active]
+                # Nobody is watching, or nothing they watch changed: don't fetch or decode anything
+                active = changed_streams(active, rendered_inputs, self.camera)
+                if not active:
+                    continue
+
+                cache = FrameCache(seq, camera=self.camera)
+                rendered = render_streams(cache, active)
+                mark_rendered(rendered_inputs, active, cache)
+                frame_seq = count_frame(last_seq, seq, frame_seq, cache)
+                for name, (jpeg, img) in rendered.items():
+                    if jpeg is not None:
+                        self.broadcasters[name].publish(jpeg, seq, img, cache.timestamp())
+            except Exception as e:
+                print(f"Error capturing frame: {e}")
+                time.sleep(1)
+
+    def snapshot(self, stream):
+        """
+        Returns the newest JPEG of a stream, rendering one on demand if the
+        stream is not currently being rendered.
+        """
+        broadcaster = self.broadcasters[stream]
+        jpeg, _ = broadcaster.latest_jpeg()
+        if broadcaster.active and jpeg is not None:
+            return jpeg
+        jpeg, _ = RENDERERS[stream](FrameCache(None, camera=self.camera))
+        return jpeg
+
+
+# One capture loop per camera being watched, keyed by camera namespace (so a
+# serial, a camera name and "no camera" that mean the same device share it);
+# started on first use
+hub = StreamHub()
+hubs = {None: hub}
+hubs_lock = threading.Lock()
+
+# Running recordings by (camera namespace, stream)
+recordings = {}
+recordings_lock = threading.Lock()
+
+
+def hub_for(camera):
+    """The StreamHub of a camera (None for the default camera), started on first use."""
+    namespace = fermia_camera.camera_namespace(camera)
+    with hubs_lock:
+        camera_hub = hubs.get(namespace)
+        if camera_hub is None:
+            camera_hub = hubs[namespace] = StreamHub(namespace)
+    camera_hub.start()
+    return camera_hub
+
+
+def _selected_stream(default_stream):
+    stream = request.args.get('stream', default_stream)
+    if stream not in STREAMS:
+        return None
+    return stream
+
+
+def _selected_camera():
+    """The ?camera= of a request: a device serial or camera name, None for the default camera."""
+    return request.args.get('camera') or None
+
+
+def _client_settings():
+    """Parse the ?fps=, ?width= and ?quality= options of an MJPEG request."""
+    return snap_client_settings(request.args.get('fps', type=float),
+                                request.args.get('width', type=int),
+                                request.args.get('quality', type=int))
+
+
+def create_app(default_stream="color"):
+    """
+    Build a Flask app serving every stream from the shared hub. default_stream
+    picks the page shown at '/' and the stream used by '/video_feed' and by
+    the photo and recording routes when no ?stream= is given.
+    """
+    app = Flask(__name__)
+
+    def render_page(stream):
+        camera = _selected_camera()
+        return render_template(STREAM_SETTINGS[stream]["template"],
+                               stream=stream,
+                               feed_url=url_for('stream_feed', stream=stream, camera=camera),
+                               camera=camera,
+                               camera_query=camera_query(camera),
+                               cameras=camera_choices())
+
+    @app.route('/')
+    def index():
+        return render_page(default_stream)
+
+    @app.route('/view/<any(color, depth, side_by_side):stream>')
+    def view(stream):
+        return render_page(stream)
+
+    @app.route('/video_feed')
+    def video_feed():
+        # The capture thread of a camera starts with its first request, not at import
+        return Response(hub_for(_selected_camera())[default_stream].frames(**_client_settings()),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    @app.route('/<any(color, depth, side_by_side):stream>')
+    def stream_feed(stream):
+        return Response(hub_for(_selected_camera())[stream].frames(**_client_settings()),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics_text("stream"), content_type=METRICS_CONTENT_TYPE)
+
+    @app.route('/take_photo')
+    def take_photo():
+        stream = _selected_stream(default_stream)
+        if stream is None:
+            return jsonify({"success": False, "message": "Unknown stream"})
+        settings = STREAM_SETTINGS[stream]
+        camera = _selected_camera()
+
+        jpeg = hub_for(camera).snapshot(stream)
+        if jpeg is None:
+            return jsonify({"success": False, "message": "No camera frame available"})
+
+        # Generate a unique filename with timestamp
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"{settings['photo_prefix']}_{timestamp}{camera_suffix(camera)}.jpg"
+        filepath = os.path.join("photos", filename)
+
+        # Save the already-encoded image as is
+        with open(filepath, 'wb') as f:
+            f.write(jpeg)
+
+        return jsonify({
+            "success": True,
+            "message": f"{settings['label']} saved as {filename}",
+            "filename": filename
+        })
+
+    @app.route('/start_recording')
+    def start_recording():
+        stream = _selected_stream(default_stream)
+        if stream is None:
+            return jsonify({"success": False, "message": "Unknown stream"})
+        settings = STREAM_SETTINGS[stream]
+        camera = _selected_camera()
+        camera_hub = hub_for(camera)
+
+        with recordings_lock:
+            key = (fermia_camera.camera_namespace(camera), stream)
+            if key in recordings:
+                return jsonify({"success": False, "message": "Already recording"})
+
+            if stream == "depth" and request.args.get('raw', type=int):
+                # Keep the real millimetre values instead of the colormap
+                try:
+                    recording = recordings[key] = start_raw_depth_recording(camera)
+                except ValueError as e:
+                    return jsonify({"success": False, "message": str(e)})
+                return jsonify({
+                    "success": True,
+                    "message": "Raw depth recording started",
+                    "filename": recording.filename
+                })
+
+            jpeg = camera_hub.snapshot(stream)
+            if jpeg is None:
+                return jsonify({"success": False, "message": "No camera frame available"})
+
+            # Get frame dimensions
+            first_frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if first_frame is None:
+                return jsonify({"success": False, "message": "No camera frame available"})
+            height, width = first_frame.shape[:2]
+
+            # Generate a unique filename with timestamp
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"{settings['video_prefix']}_{timestamp}{camera_suffix(camera)}{video_extension()}"
+            recordings[key] = Recording(stream, camera_hub[stream], filename,
+                                        settings["frame_rate"], (width, height))
+
+        return jsonify({
+            "success": True,
+            "message": "Recording started",
+            "filename": filename
+        })
+
+    @app.route('/stop_recording')
+    def stop_recording():
+        stream = _selected_stream(default_stream)
+
+        with recordings_lock:
+            recording = recordings.pop((fermia_camera.camera_namespace(_selected_camera()), stream), None)
+        if recording is None:
+            return jsonify({"success": False, "message": "Not recording"})
+
+        return jsonify(stop_response(recording, recording.stop()))
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
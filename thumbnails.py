@@ -0,0 +1,278 @@
+# thumbnails.py
+# Small previews for the photos_app gallery, so opening it costs kilobytes
+# instead of every full-size photo and a probe of every video. Photos are
+# decoded at a reduced scale (the JPEG decoder skips most of the work) and
+# shrunk to a few fixed widths; videos get a poster frame, raw depth
+# recordings (.fdr) their first frame colorized.
+#
+# Thumbnails live on disk under one directory per source file:
+#
+#   <cache dir>/<hash of the source path>/source              the source path
+#   <cache dir>/<hash of the source path>/<mtime>-<size>-<width>.<ext>
+#
+# so a changed source never hits a stale thumbnail, and a sweep can drop the
+# thumbnails of files that were replaced or deleted.
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Widths thumbnails are rendered at; requests are snapped up to one of them
+THUMB_WIDTHS = (160, 320, 640)
+DEFAULT_WIDTH = 320
+
+FORMATS = {
+    "jpeg": {"ext": ".jpg", "mimetype": "image/jpeg", "params": [cv2.IMWRITE_JPEG_QUALITY, 80]},
+    "webp": {"ext": ".webp", "mimetype": "image/webp", "params": [cv2.IMWRITE_WEBP_QUALITY, 75]},
+}
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov")
+DEPTH_EXTENSIONS = (".fdr",)
+
+# Where in a video the poster frame is taken
+POSTER_OFFSET_MS = 1000
+
+# Seconds between sweeps for thumbnails of deleted or changed files
+EVICT_INTERVAL = 300.0
+
+# Marks a source that could not be decoded, so it is not retried on every request
+FAILED_EXT = ".failed"
+
+
+def snap_width(width):
+    """Smallest thumbnail width at least as large as the requested one."""
+    if width is None:
+        return DEFAULT_WIDTH
+    for candidate in THUMB_WIDTHS:
+        if candidate >= width:
+            return candidate
+    return THUMB_WIDTHS[-1]
+
+
+def _load_photo(path, width):
+    """Decodes a photo at the smallest scale still at least `width` pixels wide."""
+    data = np.fromfile(path, dtype=np.uint8)
+    # An eighth-scale decode is nearly free and tells the full width
+    eighth = cv2.imdecode(data, cv2.IMREAD_REDUCED_COLOR_8)
+    if eighth is None:
+        return None
+    full_width = eighth.shape[1] * 8
+    for factor, flag in ((8, None), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if full_width // factor >= width:
+            return eighth if flag is None else cv2.imdecode(data, flag)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def _load_poster(path):
+    """Grabs a poster frame from a video, a second in or the first frame of short clips."""
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return None
+        capture.set(cv2.CAP_PROP_POS_MSEC, POSTER_OFFSET_MS)
+        ok, frame = capture.read()
+        if not ok:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = capture.read()
+        return frame if ok else None
+    finally:
+        capture.release()
+
+
+def _load_depth(path):
+    """First frame of a raw depth recording, colorized like the depth stream."""
+    try:
+        from fermia_camera.colormap import colorize
+        from fermia_camera.depthlog import DepthPlayback
+    except ImportError:
+        return None
+    with DepthPlayback(path) as playback:
+        if not len(playback):
+            return None
+        _, _, depth = playback.frame(0)
+        return colorize(depth)
+
+
+def load_preview(path, width):
+    """
+    Decodes the image a thumbnail of `path` is made from.
+    Returns:
+        numpy.ndarray: BGR image, or None if the file cannot be decoded.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in VIDEO_EXTENSIONS:
+        return _load_poster(path)
+    if extension in DEPTH_EXTENSIONS:
+        return _load_depth(path)
+    return _load_photo(path, width)
+
+
+def render_thumbnail(img, width, fmt):
+    """
+    Shrinks an image to `width` pixels (never enlarging it) and encodes it.
+    Returns:
+        bytes: The encoded thumbnail, or None if encoding failed.
+    """
+    if img.shape[1] > width:
+        height = max(round(img.shape[0] * width / img.shape[1]), 1)
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode(FORMATS[fmt]["ext"], img, FORMATS[fmt]["params"])
+    return buffer.tobytes() if ret else None
+
+
+class ThumbnailCache:
+    """
+    On-disk thumbnail cache. get() renders a missing thumbnail on the spot;
+    warm() queues sources for a background worker, which also sweeps out
+    thumbnails whose source disappeared or changed every EVICT_INTERVAL
+    seconds.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        # One lock per thumbnail being rendered, so concurrent requests render it once
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+
+    def _source_dir(self, source):
+        digest = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, digest)
+
+    def _version(self, stats):
+        return f"{stats.st_mtime_ns}-{stats.st_size}"
+
+    def _remove_stale(self, source_dir, version):
+        """Removes the thumbnails of other versions of a source. Returns how many."""
+        removed = 0
+        for name in os.listdir(source_dir):
+            if name != "source" and not name.startswith(version + "-") and name != version + FAILED_EXT:
+                os.remove(os.path.join(source_dir, name))
+                removed += 1
+        return removed
+
+    def thumbnail_path(self, source, width, fmt, stats=None):
+        """Cache path of a thumbnail for the current version of the source."""
+        stats = stats or os.stat(source)
+        return os.path.join(self._source_dir(source),
+                            f"{self._version(stats)}-{width}{FORMATS[fmt]['ext']}")
+
+    def _lock(self, key):
+        with self.locks_lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def get(self, source, width=DEFAULT_WIDTH, fmt="jpeg"):
+        """
+        Returns the path of the thumbnail of a source, rendering it if needed.
+        Returns:
+            str: Path of the cached thumbnail, or None if the source is gone
+            or cannot be decoded.
+        """
+        try:
+            stats = os.stat(source)
+        except OSError:
+            return None
+        path = self.thumbnail_path(source, width, fmt, stats)
+        if os.path.exists(path):
+            return path
+        failed = os.path.join(os.path.dirname(path), self._version(stats) + FAILED_EXT)
+        if os.path.exists(failed):
+            return None
+        with self._lock(path):
+            if os.path.exists(path):
+                return path
+            data = None
+            try:
+                img = load_preview(source, width)
+                if img is not None:
+                    data = render_thumbnail(img, width, fmt)
+            except Exception as e:
+                print(f"Could not render a thumbnail of {source}: {e}")
+            self._store(source, stats, path, failed, data)
+        with self.locks_lock:
+            self.locks.pop(path, None)
+        return path if data is not None else None
+
+    def _store(self, source, stats, path, failed, data):
+        source_dir = os.path.dirname(path)
+        os.makedirs(source_dir, exist_ok=True)
+        with open(os.path.join(source_dir, "source"), "w") as f:
+            f.write(os.path.abspath(source))
+        # Thumbnails of earlier versions of the file are dead now
+        self._remove_stale(source_dir, self._version(stats))
+        if data is None:
+            open(failed, "w").close()
+            return
+        # Write under a temporary name so readers never see a partial file
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    def warm(self, sources, width=DEFAULT_WIDTH, formats=("webp", "jpeg")):
+        """Queue thumbnails to be rendered in the background before anyone asks for them."""
+        self._ensure_worker()
+        for source in sources:
+            for fmt in formats:
+                key = (source, width, fmt)
+                if key in self.queued:
+                    continue
+                try:
+                    if os.path.exists(self.thumbnail_path(source, width, fmt)):
+                        continue
+                except OSError:
+                    continue
+                self.queued.add(key)
+                self.queue.put(key)
+
+    def _ensure_worker(self):
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._work, daemon=True)
+                self.worker.start()
+
+    def _work(self):
+        evicted = 0.0
+        while True:
+            if time.monotonic() - evicted >= EVICT_INTERVAL:
+                try:
+                    self.evict()
+                except OSError as e:
+                    print(f"Thumbnail sweep failed: {e}")
+                evicted = time.monotonic()
+            try:
+                key = self.queue.get(timeout=EVICT_INTERVAL)
+            except queue.Empty:
+                continue
+            self.get(*key)
+            self.queued.discard(key)
+
+    def evict(self):
+        """
+        Removes the thumbnails of sources that were deleted, and those of
+        older versions of sources that changed.
+        Returns:
+            int: Number of files removed.
+        """
+        removed = 0
+        for digest in os.listdir(self.cache_dir):
+            source_dir = os.path.join(self.cache_dir, digest)
+            try:
+                with open(os.path.join(source_dir, "source")) as f:
+                    source = f.read()
+                stats = os.stat(source)
+            except OSError:
+                # Source deleted (or never recorded): drop everything
+                removed += len(os.listdir(source_dir)) if os.path.isdir(source_dir) else 0
+                shutil.rmtree(source_dir, ignore_errors=True)
+                continue
+            removed += self._remove_stale(source_dir, self._version(stats))
+        return removed
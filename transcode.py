@@ -0,0 +1,296 @@
+# transcode.py
+# Browser-playable copies of recordings that browsers cannot play as they
+# are: XVID AVIs, mp4v MP4s written by the OpenCV fallback of recorder.py,
+# and H.264 MP4s with the moov atom at the end (which must be downloaded
+# completely before playback starts).
+#
+# Copies are made on demand by a small pool of background workers running
+# ffmpeg at the lowest CPU priority with few threads, so a transcode never
+# starves the stream servers or the recorder. H.264 sources are only
+# remuxed (-c copy, +faststart), which is nearly free; anything else is
+# re-encoded to H.264.
+#
+# Results are cached on disk like the thumbnails, one directory per source:
+#
+#   <cache dir>/<hash of the source path>/source                 the source path
+#   <cache dir>/<hash of the source path>/<mtime>-<size>.mp4
+#
+# so a changed source is transcoded again and stale copies can be swept.
+import hashlib
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import time
+
+import cv2
+
+from media_index import probe_media
+
+# Concurrent ffmpeg processes, and the threads each one may use
+TRANSCODE_WORKERS = int(os.environ.get("FERMIA_TRANSCODE_WORKERS", "1"))
+TRANSCODE_THREADS = int(os.environ.get("FERMIA_TRANSCODE_THREADS", "2"))
+
+# Jobs waiting for a worker; beyond this, requests are turned away
+MAX_PENDING = 16
+
+# Below the recorder (nice 10) and the stream servers
+NICENESS = 19
+
+# Seconds between sweeps for copies of deleted or changed sources
+EVICT_INTERVAL = 600.0
+
+FAILED_EXT = ".failed"
+
+# Codecs browsers play inside MP4, by OpenCV FOURCC
+BROWSER_CODECS = ("avc1", "h264", "H264", "x264", "X264")
+
+
+def _fourcc(path):
+    """FOURCC of the video stream of a file, or None if it cannot be opened."""
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return None
+        code = int(capture.get(cv2.CAP_PROP_FOURCC))
+        return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+    finally:
+        capture.release()
+
+
+def is_faststart(path):
+    """Whether the moov atom of an MP4 file comes before its media data."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, box = struct.unpack(">I4s", header)
+            if box == b"moov":
+                return True
+            if box == b"mdat":
+                return False
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                f.seek(size - 16, os.SEEK_CUR)
+            elif size == 0:
+                return False
+            else:
+                f.seek(size - 8, os.SEEK_CUR)
+
+
+def browser_playable(path):
+    """Whether browsers can stream a file as it is (H.264 MP4 with the moov atom up front)."""
+    if os.path.splitext(path)[1].lower() != ".mp4":
+        return False
+    return _fourcc(path) in BROWSER_CODECS and is_faststart(path)
+
+
+def _command(source, output):
+    if _fourcc(source) in BROWSER_CODECS:
+        video = ["-c:v", "copy"]
+    else:
+        video = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+                 "-threads", str(TRANSCODE_THREADS)]
+    return (["ffmpeg", "-loglevel", "error", "-nostdin", "-y", "-i", source,
+             "-map", "0:v:0", "-map", "0:a?"] + video +
+            ["-c:a", "aac", "-movflags", "+faststart", "-f", "mp4",
+             "-progress", "pipe:1", "-nostats", output])
+
+
+def _lower_priority():
+    # Runs in the ffmpeg child before exec
+    try:
+        os.nice(NICENESS)
+    except OSError:
+        pass
+
+
+class Transcoder:
+    """
+    Background transcode queue with an on-disk cache of browser-playable
+    copies. request() queues a source, status() reports how far it got, and
+    ready() returns the copy to serve once it exists.
+    """
+    def __init__(self, cache_dir, workers=TRANSCODE_WORKERS):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.available = shutil.which("ffmpeg") is not None
+        self.workers = workers
+        self.threads = []
+        self.queue = queue.Queue()
+        # Variant path -> {"state", "progress"} of queued and running jobs
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.evicted = time.monotonic()
+
+    def _source_dir(self, source):
+        digest = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, digest)
+
+    def _version(self, stats):
+        return f"{stats.st_mtime_ns}-{stats.st_size}"
+
+    def variant_path(self, source, stats=None):
+        """Cache path of the browser-playable copy of the current version of a source."""
+        stats = stats or os.stat(source)
+        return os.path.join(self._source_dir(source), self._version(stats) + ".mp4")
+
+    def ready(self, source):
+        """
+        Retrieves the browser-playable copy of a source, if one was made.
+        Returns:
+            str: Path of the copy, or None.
+        """
+        try:
+            path = self.variant_path(source)
+        except OSError:
+            return None
+        return path if os.path.exists(path) else None
+
+    def status(self, source):
+        """
+        Reports whether a source needs a transcode and how far it got.
+        Returns:
+            dict: "state" is one of "original" (playable as is), "ready",
+            "queued", "running", "failed", "none" (not requested) or
+            "unavailable" (no ffmpeg); "progress" runs from 0 to 1.
+        """
+        stats = os.stat(source)
+        path = self.variant_path(source, stats)
+        if os.path.exists(path):
+            return {"state": "ready", "progress": 1.0}
+        with self.lock:
+            job = self.jobs.get(path)
+            if job is not None:
+                return dict(job)
+        if os.path.exists(path[:-len(".mp4")] + FAILED_EXT):
+            return {"state": "failed", "progress": 0.0}
+        if browser_playable(source):
+            return {"state": "original", "progress": 1.0}
+        if not self.available:
+            return {"state": "unavailable", "progress": 0.0}
+        return {"state": "none", "progress": 0.0}
+
+    def request(self, source):
+        """
+        Queues a source for transcoding unless it is playable, already
+        transcoded or on its way.
+        Returns:
+            dict: The status after the request (see status()), with state
+            "busy" if the queue is full.
+        """
+        current = self.status(source)
+        if current["state"] != "none":
+            return current
+        stats = os.stat(source)
+        path = self.variant_path(source, stats)
+        with self.lock:
+            if path in self.jobs:
+                return dict(self.jobs[path])
+            if self.queue.qsize() >= MAX_PENDING:
+                return {"state": "busy", "progress": 0.0}
+            self.jobs[path] = {"state": "queued", "progress": 0.0}
+            self._ensure_workers()
+        self.queue.put((os.path.abspath(source), stats, path))
+        return {"state": "queued", "progress": 0.0}
+
+    def _ensure_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            try:
+                source, stats, path = self.queue.get(timeout=EVICT_INTERVAL)
+            except queue.Empty:
+                source = None
+            if time.monotonic() - self.evicted >= EVICT_INTERVAL:
+                self.evicted = time.monotonic()
+                try:
+                    self.evict()
+                except OSError as e:
+                    print(f"Transcode sweep failed: {e}")
+            if source is None:
+                continue
+            try:
+                self._transcode(source, stats, path)
+            except Exception as e:
+                print(f"Could not transcode {source}: {e}")
+                self._mark_failed(path)
+            with self.lock:
+                self.jobs.pop(path, None)
+
+    def _set(self, path, **fields):
+        with self.lock:
+            if path in self.jobs:
+                self.jobs[path].update(fields)
+
+    def _mark_failed(self, path):
+        """Marks a job as failed on disk, so it is not retried on every request."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path[:-len(".mp4")] + FAILED_EXT, "w").close()
+
+    def _transcode(self, source, stats, path):
+        source_dir = os.path.dirname(path)
+        os.makedirs(source_dir, exist_ok=True)
+        with open(os.path.join(source_dir, "source"), "w") as f:
+            f.write(source)
+        # Copies of earlier versions of the file are dead now
+        self._remove_stale(source_dir, self._version(stats))
+
+        duration = probe_media(source)[2]
+        self._set(path, state="running")
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        started = time.monotonic()
+        proc = subprocess.Popen(_command(source, temporary), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True, preexec_fn=_lower_priority)
+        # -progress writes key=value lines; out_time_us is how far the output got
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and duration and value.isdigit():
+                self._set(path, progress=min(int(value) / 1e6 / duration, 0.99))
+        error = proc.stderr.read()
+        if proc.wait() != 0:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            print(f"ffmpeg failed on {source}: {error.strip()}")
+            self._mark_failed(path)
+            return
+        os.replace(temporary, path)
+        print(f"Transcoded {source} in {time.monotonic() - started:.1f} s")
+
+    def _remove_stale(self, source_dir, version):
+        """Removes the copies of other versions of a source. Returns how many."""
+        removed = 0
+        for name in os.listdir(source_dir):
+            if name != "source" and not name.startswith(version + ".") and not name.endswith(".tmp"):
+                os.remove(os.path.join(source_dir, name))
+                removed += 1
+        return removed
+
+    def evict(self):
+        """
+        Removes the copies of sources that were deleted, and those of older
+        versions of sources that changed.
+        Returns:
+            int: Number of files removed.
+        """
+        removed = 0
+        for digest in os.listdir(self.cache_dir):
+            source_dir = os.path.join(self.cache_dir, digest)
+            try:
+                with open(os.path.join(source_dir, "source")) as f:
+                    source = f.read()
+                stats = os.stat(source)
+            except OSError:
+                # Source deleted (or never recorded): drop everything
+                removed += len(os.listdir(source_dir)) if os.path.isdir(source_dir) else 0
+                shutil.rmtree(source_dir, ignore_errors=True)
+                continue
+            removed += self._remove_stale(source_dir, self._version(stats))
+        return removed
@@ -0,0 +1,179 @@
+# transfers.py
+# Serving large media files from photos_app: single byte ranges (206), so a
+# browser scrubbing through a recording reads only the bytes it shows,
+# conditional GET, and zero-copy sends.
+#
+# Under gunicorn the file goes out through the server's wsgi.file_wrapper,
+# positioned at the start of the range with Content-Length set to its
+# length; gunicorn then hands it to sendfile(2) and never copies it through
+# Python. Other servers get an iterator that reads exactly the range.
+#
+# Transfers larger than LARGE_TRANSFER bytes hold one of MAX_TRANSFERS slots
+# until the response is closed, so a few downloads cannot occupy every
+# worker thread; a request that gets no slot within TRANSFER_WAIT seconds is
+# answered 503 with Retry-After.
+import mimetypes
+import os
+import threading
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date
+
+LARGE_TRANSFER = int(os.environ.get("FERMIA_LARGE_TRANSFER", str(16 * 1024 * 1024)))
+MAX_TRANSFERS = int(os.environ.get("FERMIA_MAX_TRANSFERS", "4"))
+TRANSFER_WAIT = 2.0
+
+# Block size of the fallback reader
+CHUNK_SIZE = 256 * 1024
+
+transfer_slots = threading.BoundedSemaphore(MAX_TRANSFERS)
+
+
+class _TransferFile:
+    """File handed to the WSGI server; closing it gives back the transfer slot, if any."""
+    def __init__(self, f, slot):
+        self.f = f
+        self.slot = slot
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+        if self.slot is not None:
+            self.slot.release()
+            self.slot = None
+
+
+class _RangeReader:
+    """Response body reading exactly `length` bytes from the current position of f."""
+    def __init__(self, f, length):
+        self.f = f
+        self.length = length
+
+    def __iter__(self):
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        # Called by the server when the response ends, even if it was never iterated
+        self.f.close()
+
+
+def _etag(stats):
+    return f"{stats.st_mtime_ns:x}-{stats.st_size:x}"
+
+
+def _not_modified(etag, mtime):
+    """Whether the client's cached copy (If-None-Match / If-Modified-Since) is current."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return int(mtime) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _range_applies(etag, mtime):
+    """Whether a Range header may be honoured (If-Range still matches the file)."""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Only strong validators count for ranges
+        return if_range == f'"{etag}"'
+    date = parse_date(if_range)
+    return date is not None and int(mtime) == int(date.timestamp())
+
+
+def acquire_transfer_slot():
+    """
+    Takes one of the MAX_TRANSFERS large-transfer slots, waiting up to
+    TRANSFER_WAIT seconds. The caller releases it with transfer_slots.release().
+    Returns:
+        bool: False if no slot freed up in time.
+    """
+    return transfer_slots.acquire(timeout=TRANSFER_WAIT)
+
+
+def too_many_transfers():
+    """503 response for a large transfer that got no slot."""
+    return Response("Too many transfers in progress, try again shortly.\n", status=503,
+                    headers={"Retry-After": "2"}, mimetype="text/plain")
+
+
+def send_media(path, mimetype=None):
+    """
+    Sends a file with byte-range and conditional GET support.
+    Args:
+        path (str): File to send; must exist.
+        mimetype (str): Content type, or None to guess it from the file name.
+    Returns:
+        flask.Response: 200, 206, 304, 416 or 503.
+    """
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    stats = os.stat(path)
+    size = stats.st_size
+    etag = _etag(stats)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Last-Modified": http_date(stats.st_mtime),
+        # Revalidate, which costs a 304 while the file is unchanged
+        "Cache-Control": "no-cache",
+    }
+
+    if _not_modified(etag, stats.st_mtime):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    start, length, status = 0, size, 200
+    byte_range = request.range
+    # Multiple ranges are not supported; those requests get the whole file
+    if byte_range is not None and len(byte_range.ranges) == 1 and _range_applies(etag, stats.st_mtime):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            response = Response(status=416, headers=headers)
+            response.set_etag(etag)
+            return response
+        start, stop = bounds
+        length, status = stop - start, 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    headers["Content-Length"] = str(length)
+
+    if request.method == "HEAD":
+        response = Response(status=status, headers=headers, mimetype=mimetype)
+        response.set_etag(etag)
+        return response
+
+    slot = None
+    if length > LARGE_TRANSFER:
+        if not acquire_transfer_slot():
+            return too_many_transfers()
+        slot = transfer_slots
+
+    try:
+        f = _TransferFile(open(path, "rb"), slot)
+    except OSError:
+        if slot is not None:
+            slot.release()
+        raise
+    f.f.seek(start)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        # gunicorn stops at Content-Length and uses sendfile() from the current offset
+        body = file_wrapper(f, CHUNK_SIZE)
+    else:
+        body = _RangeReader(f, length)
+    response = Response(body, status=status, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.set_etag(etag)
+    return response